@@ -0,0 +1,328 @@
+"""
+Claim throughput of the job queue with many concurrent workers, per claim strategy.
+
+Builds the bnp schema from the SQL scripts of dap_lite in a throwaway database, loads
+--rows synthetic Sentinel-2 L1C products into bnp.dataset_location and then lets
+--workers worker processes claim a job and report it finished in a loop for
+--duration seconds, once per strategy in STRATEGIES. Prints claims/sec, p50/p99 claim
+latency, empty claims and claim conflicts (another worker created the job first).
+
+The workers go through BNPDriver, so the claims and reports measure its hot path:
+prepared statements, retries and lease tokens. v1 and queue claim with
+get_next_job (queue with job_queue=True). v2 has no driver method, its SQL is run
+through the driver's query path. Conflicts are the driver's claim_conflicts
+counter, from the conflict notice of v1 and v2. The queue claims skip locked rows
+and never conflict, their conflicts print as n/a.
+
+Connects with the usual BNP_DB_* environment variables to a server where the user may
+create databases, e.g. a local throwaway one:
+
+    docker run --rm -d -p 5432:5432 -e POSTGRES_PASSWORD=bench postgres:16
+    export BNP_DB_HOSTNAME=localhost BNP_DB_PORT=5432 BNP_DB_USERNAME=postgres
+    export BNP_DB_PASSWORD=bench BNP_DB_DATABASE=postgres
+    python benchmarks/claim_throughput.py --rows 10000 1000000 --workers 1 8 32
+
+BNPDriver needs a non-empty BNP_DB_PASSWORD, also for servers that do not check it.
+"""
+
+import argparse
+import multiprocessing
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import psycopg2
+
+import dap_lite
+from dap_lite.driver import BNPDriver
+
+SQL_DIR = Path(dap_lite.__file__).parent / "sql"
+SCHEMA_FILES = ("odc-db-additions.sql", "odc-db-bnp-log.sql", "get-next-job-v2.sql")
+
+# The ODC tables the scripts expect, normally provided by the datacube database
+ODC_TABLES = """
+    CREATE SCHEMA agdc;
+    CREATE TABLE agdc.dataset_location (
+        id SERIAL PRIMARY KEY,
+        dataset_ref UUID,
+        uri_scheme TEXT,
+        uri_body TEXT,
+        added TIMESTAMPTZ DEFAULT NOW()
+    );
+    CREATE SCHEMA bnp;
+    CREATE TABLE bnp.dataset_location (
+        id INTEGER PRIMARY KEY,
+        dataset_ref UUID,
+        uri_scheme TEXT,
+        uri_body TEXT,
+        added TIMESTAMPTZ
+    );
+"""
+
+# Products of DAYS consecutive days per tile, tiles numbered through the MGRS
+# zones (01-60), latitude bands and 100 km squares
+DAYS = 1000
+SYNTHETIC_PRODUCTS = """
+    INSERT INTO bnp.dataset_location (id, dataset_ref, uri_scheme, uri_body, added)
+    SELECT
+        g,
+        md5(g::TEXT)::UUID,
+        's3',
+        '//eodata-sentinel2-s2msi1c-' || to_char(day, 'YYYY')
+            || '/' || EXTRACT(MONTH FROM day)::INTEGER
+            || '/' || EXTRACT(DAY FROM day)::INTEGER
+            || '/S2' || CASE WHEN mod(g, 2) = 0 THEN 'A' ELSE 'B' END
+            || '_MSIL1C_' || to_char(day, 'YYYYMMDD') || 'T102559_N0511_R'
+            || lpad((1 + mod(g, 143))::TEXT, 3, '0')
+            || '_T' || lpad((1 + mod(tile, 60))::TEXT, 2, '0')
+            || substr('CDEFGHJKLMNPQRSTUVWX', 1 + mod(tile / 60, 20), 1)
+            || substr('ABCDEFGHJKLMNPQRSTUVWXYZ', 1 + mod(tile / 1200, 24), 1)
+            || substr('ABCDEFGHJKLMNPQRSTUV', 1 + mod(tile / 28800, 20), 1)
+            || '_' || to_char(day, 'YYYYMMDD') || 'T123129.stac_item.json',
+        day
+    FROM (
+        SELECT
+            g,
+            (g - 1) / %(days)s AS tile,
+            DATE '2017-01-01' + mod(g - 1, %(days)s)::INTEGER AS day
+        FROM generate_series(%(first)s, %(last)s) AS g
+    ) products;
+"""
+LOAD_CHUNK = 1_000_000
+
+DOLLAR_QUOTE = re.compile(r"\$(?:[A-Za-z_]\w*)?\$")
+
+# Driver options of the strategies that claim with BNPDriver.get_next_job
+DRIVER_STRATEGIES = {
+    "v1": {},
+    "queue": {"job_queue": True},
+}
+# Strategies without a driver method, called with (processor_id, worker_id,
+# src_pattern) and returning (job_id, src_uri)
+SQL_STRATEGIES = {
+    "v2": "SELECT job_id, src_uri FROM bnp.get_next_processing_job_v2(%s, %s, %s)",
+}
+# Add future claim strategies to one of the above
+STRATEGIES = ["v1", "v2", "queue"]
+# Claims that cannot conflict, SKIP LOCKED passes over the rows of other workers
+NO_CONFLICTS = {"queue"}
+PROCESSOR_ID = 1
+SRC_PATTERN = "MSIL1C"
+
+
+def connect_kwargs(dbname: str) -> dict:
+    return dict(
+        host=os.getenv("BNP_DB_HOSTNAME", "localhost"),
+        port=os.getenv("BNP_DB_PORT", 5432),
+        user=os.getenv("BNP_DB_USERNAME", "postgres"),
+        password=os.getenv("BNP_DB_PASSWORD", ""),
+        dbname=dbname,
+    )
+
+
+def split_statements(sql: str) -> List[str]:
+    """
+    Split a script into statements on semicolons outside of comments, quoted
+    strings and dollar quoted function bodies, like psql does.
+    """
+    statements = []
+    start = i = 0
+    while i < len(sql):
+        if sql.startswith("--", i):
+            i = sql.find("\n", i)
+            i = len(sql) if i < 0 else i
+        elif sql[i] == "'":
+            i = sql.find("'", i + 1)
+            i = len(sql) if i < 0 else i
+        elif sql[i] == "$" and DOLLAR_QUOTE.match(sql, i):
+            tag = DOLLAR_QUOTE.match(sql, i).group()
+            end = sql.find(tag, i + len(tag))
+            i = len(sql) if end < 0 else end + len(tag) - 1
+        elif sql[i] == ";":
+            statements.append(sql[start:i])
+            start = i + 1
+        i += 1
+    statements.append(sql[start:])
+    return [s for s in statements if s.strip() and not _only_comments(s)]
+
+
+def _only_comments(statement: str) -> bool:
+    return all(
+        not line.strip() or line.strip().startswith("--")
+        for line in statement.splitlines()
+    )
+
+
+def build_database(dbname: str, rows: int) -> None:
+    """Create dbname with the bnp schema and rows synthetic products."""
+    admin = psycopg2.connect(**connect_kwargs(os.getenv("BNP_DB_DATABASE", "postgres")))
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"DROP DATABASE IF EXISTS {dbname};")
+        cur.execute(f"CREATE DATABASE {dbname};")
+    admin.close()
+
+    conn = psycopg2.connect(**connect_kwargs(dbname))
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(ODC_TABLES)
+        failed = []
+        for name in SCHEMA_FILES:
+            # Like psql, a failing statement does not stop the script
+            for statement in split_statements((SQL_DIR / name).read_text()):
+                try:
+                    cur.execute(statement)
+                except psycopg2.Error:
+                    failed.append((name, statement))
+        # The scripts refer to each other's tables, retry once all ran
+        for name, statement in failed:
+            try:
+                cur.execute(statement)
+            except psycopg2.Error as e:
+                print(f"  {name}: {str(e).splitlines()[0]}")
+        start = time.perf_counter()
+        for first in range(1, rows + 1, LOAD_CHUNK):
+            last = min(first + LOAD_CHUNK - 1, rows)
+            cur.execute(SYNTHETIC_PRODUCTS, dict(days=DAYS, first=first, last=last))
+        cur.execute("ANALYZE;")
+        print(f"Loaded {rows} products in {time.perf_counter() - start:.1f}s")
+    conn.close()
+
+
+def reset_queue(dbname: str) -> None:
+    conn = psycopg2.connect(**connect_kwargs(dbname))
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(
+            "TRUNCATE bnp.process_executions, bnp.log, bnp.job_queue RESTART IDENTITY;"
+        )
+        # TRUNCATE fires no delete triggers, queue all products again
+        cur.execute("SELECT bnp.sync_job_queue();")
+        cur.execute("VACUUM ANALYZE bnp.process_executions, bnp.job_queue;")
+    conn.close()
+
+
+def drop_database(dbname: str) -> None:
+    admin = psycopg2.connect(**connect_kwargs(os.getenv("BNP_DB_DATABASE", "postgres")))
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"DROP DATABASE IF EXISTS {dbname};")
+    admin.close()
+
+
+def claim(driver: BNPDriver, strategy: str) -> Optional[int]:
+    """Claim a job with strategy, returns its id or None."""
+    if strategy in SQL_STRATEGIES:
+        rows = driver._query(
+            SQL_STRATEGIES[strategy],
+            (PROCESSOR_ID, driver.worker_id, SRC_PATTERN),
+            idempotent=False,
+        )
+        return rows[0][0] if rows else None
+    job_id, _ = driver.get_next_job(SRC_PATTERN)
+    return job_id
+
+
+def worker(dbname, strategy, worker_id, go, duration, results) -> None:
+    """Claim and report jobs until duration has passed, put the tallies to results."""
+    os.environ["BNP_DB_DATABASE"] = dbname
+    driver = BNPDriver(
+        processor_id=PROCESSOR_ID,
+        worker_id=worker_id,
+        **DRIVER_STRATEGIES.get(strategy, {}),
+    )
+    latencies = []
+    empty = 0
+    go.wait()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        job_id = claim(driver, strategy)
+        latencies.append(time.perf_counter() - start)
+        if job_id is None:
+            empty += 1
+            continue
+        driver.report_finished("s3://benchmark/output", job_id=job_id)
+    conflicts = driver.stats()["counters"].get("claim_conflicts", 0)
+    driver.close()
+    results.put(dict(latencies=latencies, empty=empty, conflicts=conflicts))
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run(
+    dbname: str, strategy: str, workers: int, duration: float
+) -> Dict[str, Union[float, str]]:
+    reset_queue(dbname)
+    # spawn, so that no worker inherits a connection of the parent
+    mp = multiprocessing.get_context("spawn")
+    go = mp.Event()
+    results = mp.Queue()
+    processes = [
+        mp.Process(
+            target=worker,
+            args=(dbname, strategy, f"bench-{i}", go, duration, results),
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(1.0)  # Let all workers connect before the clock starts
+    go.set()
+    tallies = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = [latency for tally in tallies for latency in tally["latencies"]]
+    empty = sum(tally["empty"] for tally in tallies)
+    return {
+        "claims": len(latencies) - empty,
+        "claims_per_sec": (len(latencies) - empty) / duration,
+        "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else 0.0,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else 0.0,
+        "empty": empty,
+        "conflicts": (
+            "n/a"
+            if strategy in NO_CONFLICTS
+            else sum(tally["conflicts"] for tally in tallies)
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument(
+        "--strategies", nargs="+", choices=STRATEGIES, default=STRATEGIES
+    )
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the databases, bnp_bench_<rows>"
+    )
+    args = parser.parse_args()
+
+    header = f"{'rows':>9} {'strategy':<8} {'workers':>7} {'claims':>7} {'claims/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'empty':>6} {'conflicts':>9}"
+    for rows in args.rows:
+        dbname = f"bnp_bench_{rows}"
+        build_database(dbname, rows)
+        print(header)
+        try:
+            for workers in args.workers:
+                for strategy in args.strategies:
+                    r = run(dbname, strategy, workers, args.duration)
+                    print(
+                        f"{rows:>9} {strategy:<8} {workers:>7} {r['claims']:>7} {r['claims_per_sec']:>9.1f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['empty']:>6} {r['conflicts']:>9}"
+                    )
+        finally:
+            if not args.keep:
+                drop_database(dbname)
+
+
+if __name__ == "__main__":
+    main()
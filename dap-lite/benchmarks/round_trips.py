@@ -0,0 +1,96 @@
+"""
+Round trips and wall time per job of the DB driver, before and after the hot path
+optimizations (prepared statements and buffered logging).
+
+Every job is claimed, gets --logs log messages and is reported finished, like a
+worker running its WorkflowSteps. Needs a database with the bnp schema and free
+rows in bnp.dataset_location (2 x --jobs), configured through the usual BNP_DB_*
+environment variables:
+
+    python benchmarks/round_trips.py --jobs 100 --logs 5
+"""
+
+import argparse
+import time
+from contextlib import contextmanager
+
+from dap_lite.driver import BNPDriver
+
+CONFIGS = {
+    "before": dict(prepared_statements=False),
+    "after": dict(prepared_statements=True, buffered_logging=True),
+}
+
+
+class CountingCursor:
+    """Cursor proxy that counts executed statements, one round trip each."""
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter["round_trips"] += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class CountingDriver(BNPDriver):
+    def __init__(self, **kwargs):
+        self.counter = {"round_trips": 0}
+        super().__init__(**kwargs)
+
+    @contextmanager
+    def _cursor(self, cursor_factory=None):
+        with super()._cursor(cursor_factory=cursor_factory) as cur:
+            yield CountingCursor(cur, self.counter)
+
+
+def run(config: dict, jobs: int, logs: int) -> dict:
+    driver = CountingDriver(lease_seconds=None, **config)
+    done = 0
+    start = time.perf_counter()
+    try:
+        for _ in range(jobs):
+            job_id, _ = driver.get_next_job()
+            if not job_id:
+                break
+            for step in range(logs):
+                driver.store_log_message(f"Step {step} done")
+            driver.report_finished("s3://benchmark/output")
+            done += 1
+    finally:
+        elapsed = time.perf_counter() - start
+        driver.close()
+    if not done:
+        raise RuntimeError(
+            "No jobs available, load more rows into bnp.dataset_location"
+        )
+    return {
+        "jobs": done,
+        "round_trips_per_job": driver.counter["round_trips"] / done,
+        "ms_per_job": elapsed * 1000 / done,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--logs", type=int, default=5, help="log messages per job")
+    args = parser.parse_args()
+
+    print(f"{'config':<8} {'jobs':>6} {'round trips/job':>16} {'ms/job':>8}")
+    for name, config in CONFIGS.items():
+        result = run(config, args.jobs, args.logs)
+        print(
+            f"{name:<8} {result['jobs']:>6} {result['round_trips_per_job']:>16.2f} {result['ms_per_job']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
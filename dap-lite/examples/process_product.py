@@ -1,7 +1,10 @@
 import time
 import sys
 import os
+import signal
 from dap_lite import get_driver, DriverType
+from dap_lite.driver import BNPCircuitOpenException
+from dap_lite.polling import AdaptivePoller
 from dap_lite.workflow_step import WorkflowStep, WorkFlowStepSkippedException
 import random
 import logging
@@ -38,15 +41,36 @@ MY_PROCESSOR_ID = 1
 # Initialize the driver (mock or real based on configuration)
 driver = get_driver(DriverType.DB)
 log = setup_logging(driver.worker_id)
+# Backs off while the queue stays empty and sleeps long while the power is off
+poller = AdaptivePoller(min_interval=0.5, max_interval=60, power_off_interval=300)
+
+# Kubernetes sends SIGTERM on rolling deploys, finish the current job and stop
+stopping = False
+
+
+def request_stop(signum, frame):
+    global stopping
+    stopping = True
+
+
+signal.signal(signal.SIGTERM, request_stop)
 try:
-    while True:
+    while not stopping:
         # Measure time for `get_next_job`
-        job_id, next_s3 = driver.get_next_job(src_pattern="MSIL1C")
+        try:
+            job_id, next_s3 = driver.get_next_job(src_pattern="MSIL1C")
+        except BNPCircuitOpenException as e:
+            log.warning(f"Database unavailable, pausing. {e}")
+            time.sleep(e.retry_in or 1)
+            continue
 
         if not job_id:
-            log.debug("No jobs available or system starved/busy. Sleeping...")
-            time.sleep(3)  # Avoid tight loops if no jobs are available
+            log.debug(
+                "No jobs available or system starved/busy. Waiting for new jobs..."
+            )
+            poller.wait(driver, "MSIL1C")  # Wakes up as soon as new work is notified
             continue
+        poller.reset()
 
         log.debug(f"Processing job {job_id} for product: {next_s3}")
 
@@ -92,5 +116,6 @@ try:
 except KeyboardInterrupt:
     print("Shutting down gracefully.")
 finally:
-    # Close the driver connection
+    # Give an interrupted job back to the queue, then close the driver connection
+    driver.drain(timeout=0)
     driver.close()
@@ -0,0 +1,32 @@
+"""
+A processor for the worker runner, run it on all cores of the node with:
+
+    dap-lite worker runner_processor:process --workers 4
+
+(with examples/ on PYTHONPATH, add --driver mock to try it without a database)
+"""
+
+import logging
+import random
+import time
+
+from dap_lite import JobHandle
+from dap_lite.workflow_step import WorkflowStep, WorkFlowStepSkippedException
+
+log = logging.getLogger("MainLoop")
+
+
+def process(job: JobHandle) -> str:
+    """Process one product, the runner reports the returned path as the result."""
+    with WorkflowStep(name="Downloading", bnp_driver=job, logger=log):
+        time.sleep(random.uniform(0, 2))
+
+    with WorkflowStep(name="Force Processing", bnp_driver=job, logger=log):
+        time.sleep(random.uniform(0, 2))
+        if random.randint(0, 100) > 90:
+            raise WorkFlowStepSkippedException("Too cloudy")
+
+    with WorkflowStep(name="Uploading final product", bnp_driver=job, logger=log):
+        time.sleep(random.uniform(0, 2))
+
+    return f"s3://dummy/path/job-{job.job_id}"
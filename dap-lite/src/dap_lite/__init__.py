@@ -1,29 +1,49 @@
 from .driver import BNPDriver as DB_BNPDriver
 from .mock_driver import BNPDriver as MOCK_BNPDriver
 
-from .driver_protocol import BNPDriverProtocol
+from .async_mock_driver import AsyncBNPDriver as ASYNC_MOCK_BNPDriver
+from .sqlite_driver import BNPDriver as SQLITE_BNPDriver
+
+from .driver_protocol import BNPDriverProtocol, AsyncBNPDriverProtocol
+from .job_handle import JobHandle, AsyncJobHandle
 
 from enum import Enum
+from typing import Union
 
 
 class DriverType(Enum):
     DB = "db"
     MOCK = "mock"
+    ASYNC_DB = "async_db"
+    ASYNC_MOCK = "async_mock"
+    SQLITE = "sqlite"
 
 
 def get_driver(
     driver_type: DriverType = DriverType.MOCK,  processor_id:int = 1, **kwargs 
-) -> BNPDriverProtocol:
+) -> Union[BNPDriverProtocol, AsyncBNPDriverProtocol]:
     if driver_type == DriverType.DB:
-        return DB_BNPDriver(processor_id=processor_id)  # Return the actual DB driver
+        return DB_BNPDriver(processor_id=processor_id, **kwargs)  # Return the actual DB driver
     elif driver_type == DriverType.MOCK:
-        return MOCK_BNPDriver(processor_id=processor_id)  # Return the mock driver
+        return MOCK_BNPDriver(processor_id=processor_id, **kwargs)  # Return the mock driver
+    elif driver_type == DriverType.ASYNC_DB:
+        # asyncpg is an optional dependency (extra "async"), only import it when asked for
+        from .async_driver import AsyncBNPDriver as ASYNC_DB_BNPDriver
+
+        return ASYNC_DB_BNPDriver(processor_id=processor_id, **kwargs)
+    elif driver_type == DriverType.ASYNC_MOCK:
+        return ASYNC_MOCK_BNPDriver(processor_id=processor_id, **kwargs)
+    elif driver_type == DriverType.SQLITE:
+        return SQLITE_BNPDriver(processor_id=processor_id, **kwargs)
     else:
         raise ValueError(f"Unsupported driver type: {driver_type}")
 
 
 __all__ = [
     "BNPDriverProtocol",  # Protocol for type hinting
+    "AsyncBNPDriverProtocol",  # Protocol for the async drivers
     "DriverType",  # Enum for driver types
     "get_driver",  # Factory function for getting drivers
+    "JobHandle",  # Per job handle returned in pooled mode
+    "AsyncJobHandle",  # Per job handle returned by the async drivers
 ]
@@ -0,0 +1,367 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+import asyncpg
+
+from dap_lite.constants import PROCESSORS
+from dap_lite.driver import (
+    STALE_LEASE_PGCODE,
+    BNPDriverException,
+    BNPStaleLeaseException,
+    get_worker_id,
+)
+from dap_lite.job_handle import AsyncJobHandle
+from dap_lite.logger import log
+
+
+class AsyncBNPDriver:
+    """
+    asyncio version of the DB driver, backed by an asyncpg connection pool.
+
+    The pool is created on the first call, so the driver can be constructed
+    outside of a running event loop (e.g. through get_driver). Jobs are returned
+    as AsyncJobHandle, which lets many overlapping jobs be processed from one
+    event loop:
+
+        driver = get_driver(DriverType.ASYNC_DB)
+        job = await driver.get_next_job()
+        if job:
+            await job.store_log_message("Started")
+            await job.report_finished("s3://bucket/path")
+        await driver.close()
+
+    Claimed jobs carry a lease of lease_seconds (default 600), like with the sync
+    driver. Once the pool exists, a heartbeat task renews the leases of all
+    claimed jobs that are not reported yet every lease_seconds / 3, until
+    close(). lease_seconds=None disables leases and the heartbeat. Claims pass
+    max_attempts (default: the processor's retry_limit in PROCESSORS), reports
+    and log messages are fenced by lease tokens, and release_job() and drain()
+    give unfinished jobs back like the sync driver's.
+
+    Not supported, unlike BNPDriver: reconnecting with retries and the circuit
+    breaker (asyncpg errors are raised to the caller), buffered logging,
+    wait_for_job, prefetching, the outbox, stats(), queue_depth, scheduler mode
+    (get_next_scheduled_job), the processor registry cache, tile affinity and the
+    job queue table.
+    """
+
+    def __init__(self, **kwargs):  # noqa
+        self.db_host = os.getenv("BNP_DB_HOSTNAME", "datasource.main.rise-ck8s.com")
+        self.db_port = os.getenv("BNP_DB_PORT", 30103)
+        self.db_user = os.getenv("BNP_DB_USERNAME", "bnp_db_rw")
+        self.db_password = os.getenv("BNP_DB_PASSWORD", "bnp_password")
+        self.db_name = os.getenv("BNP_DB_DATABASE", "datacube")
+        self.current_worker_id: str = kwargs.get("worker_id") or get_worker_id()
+        self.current_job_id: Optional[int] = None
+        self.current_src_path: Optional[str] = None
+        self.processor_id = kwargs.get("processor_id", 1)
+        self.pool_size: int = kwargs.get("pool_size") or 4
+        self.lease_seconds: Optional[int] = kwargs.get("lease_seconds", 600)
+        self.max_attempts: int = kwargs.get(
+            "max_attempts",
+            next((p for p in PROCESSORS if p["id"] == self.processor_id), {}).get(
+                "retry_limit", 3
+            ),
+        )
+        self.draining = False
+        if not self.db_password:
+            raise ValueError("BNP_DB_PASSWORD is not set in the environment variables")
+        self.driver_type = "ASYNC_DB"
+        self.pool: Optional[asyncpg.Pool] = None
+        self._pool_lock: Optional[asyncio.Lock] = None
+        # Lease tokens of claimed jobs that have not been reported yet
+        self._lease_tokens: Dict[int, int] = {}
+        # Claimed jobs whose lease the heartbeat renews
+        self._in_flight: Set[int] = set()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        if self.pool is None:
+            # Created lazily so that it binds to the running loop
+            if self._pool_lock is None:
+                self._pool_lock = asyncio.Lock()
+            async with self._pool_lock:
+                if self.pool is None:
+                    self.pool = await asyncpg.create_pool(
+                        host=self.db_host,
+                        port=int(self.db_port),
+                        user=self.db_user,
+                        password=self.db_password,
+                        database=self.db_name,
+                        min_size=1,
+                        max_size=self.pool_size,
+                    )
+                    if self.lease_seconds:
+                        self._heartbeat_task = asyncio.ensure_future(
+                            self._heartbeat_loop()
+                        )
+        return self.pool
+
+    async def get_next_job(self, src_pattern: str = "MSIL1C") -> AsyncJobHandle:
+        """
+        Fetch the next available job for the given processor.
+
+        The returned handle unpacks as (job_id, src_uri) and is falsy when no job
+        was found.
+        """
+        log.debug(
+            f"SELECT * FROM bnp.get_next_processing_job('{self.processor_id}', '{self.current_worker_id}', '{src_pattern}', {self.lease_seconds}, {self.max_attempts})"
+        )
+        self.current_job_id, self.current_src_path = None, None
+        if self.draining:
+            return AsyncJobHandle(self, None, None)
+        pool = await self._get_pool()
+        row = await pool.fetchrow(
+            "SELECT * FROM bnp.get_next_processing_job($1, $2, $3, $4, $5)",
+            self.processor_id,
+            self.current_worker_id,
+            src_pattern,
+            self.lease_seconds,
+            self.max_attempts,
+        )
+        if not row or row["job_id"] is None:
+            return AsyncJobHandle(self, None, None)
+        self.current_job_id, self.current_src_path = row["job_id"], row["src_uri"]
+        return self._handle(row)
+
+    async def get_next_jobs(
+        self, n: int, src_pattern: str = "MSIL1C"
+    ) -> List[AsyncJobHandle]:
+        """
+        Claim up to n jobs for the given processor in a single round trip.
+        The current job is not changed.
+        """
+        if n < 1 or self.draining:
+            return []
+        pool = await self._get_pool()
+        rows = await pool.fetch(
+            "SELECT * FROM bnp.get_next_processing_jobs($1, $2, $3, $4, $5, $6)",
+            self.processor_id,
+            self.current_worker_id,
+            src_pattern,
+            n,
+            self.lease_seconds,
+            self.max_attempts,
+        )
+        return [self._handle(row) for row in rows]
+
+    def _handle(self, row: asyncpg.Record) -> AsyncJobHandle:
+        self._lease_tokens[row["job_id"]] = row["lease_token"]
+        self._in_flight.add(row["job_id"])
+        return AsyncJobHandle(self, row["job_id"], row["src_uri"], row["lease_token"])
+
+    async def _report(self, query: str, job_id: Optional[int], text: str) -> None:
+        """
+        Run one of the report_* functions with the job's lease token, raises
+        BNPStaleLeaseException when the job was reclaimed by another worker.
+        """
+        pool = await self._get_pool()
+        try:
+            await pool.execute(
+                query,
+                self.processor_id,
+                job_id,
+                text,
+                self._lease_tokens.get(job_id),
+            )
+        except asyncpg.PostgresError as e:
+            if e.sqlstate != STALE_LEASE_PGCODE:
+                raise
+            self._lease_tokens.pop(job_id, None)
+            self._in_flight.discard(job_id)
+            self._forget_job(job_id)
+            raise BNPStaleLeaseException(e.message) from e
+        self._lease_tokens.pop(job_id, None)
+        self._in_flight.discard(job_id)
+
+    def _resolve_job_id(self, job_id: Optional[int]) -> Optional[int]:
+        return self.current_job_id if job_id is None else job_id
+
+    def _forget_job(self, job_id: Optional[int]) -> None:
+        if job_id == self.current_job_id:
+            self.current_job_id = None
+            self.current_src_path = None
+
+    @property
+    def current_job(self) -> Tuple[Optional[int], Optional[str]]:
+        return self.current_job_id, self.current_src_path
+
+    @property
+    def worker_id(self) -> str:
+        return self.current_worker_id
+
+    async def report_finished(
+        self, dst_path: str = "s3://dummy/path", job_id: Optional[int] = None
+    ) -> None:
+        """
+        Mark the job as finished. Defaults to the current job.
+        """
+        job_id = self._resolve_job_id(job_id)
+        await self._report(
+            "SELECT bnp.report_finished_processing($1, $2, $3, $4)", job_id, dst_path
+        )
+        self._forget_job(job_id)
+
+    async def report_skipped(
+        self, message: str = "", job_id: Optional[int] = None
+    ) -> None:
+        """
+        Mark the job as skipped. Defaults to the current job.
+        """
+        job_id = self._resolve_job_id(job_id)
+        await self._report(
+            "SELECT bnp.report_processing_skipped($1, $2, $3, $4)", job_id, message
+        )
+        self._forget_job(job_id)
+
+    async def report_failure(self, message: str, job_id: Optional[int] = None) -> None:
+        """
+        Mark the job as failed. Defaults to the current job.
+        """
+        job_id = self._resolve_job_id(job_id)
+        await self._report(
+            "SELECT bnp.report_processing_failure($1, $2, $3, $4)", job_id, message
+        )
+
+    async def store_log_message(
+        self, message: str, job_id: Optional[int] = None
+    ) -> None:
+        """
+        Stores a log message in the bnp.log table. Raises BNPStaleLeaseException
+        when the job was reclaimed by another worker.
+        """
+        job_id = self._resolve_job_id(job_id)
+        if not job_id:
+            raise BNPDriverException(
+                "Current Job is either already reported or never started."
+            )
+        lease_token = self._lease_tokens.get(job_id)
+        pool = await self._get_pool()
+        stored = await pool.fetchval(
+            "SELECT bnp.store_log_message($1, $2, $3)", job_id, message, lease_token
+        )
+        if not stored:
+            raise BNPStaleLeaseException(
+                f"Lease token {lease_token} of job {job_id} is stale, the job was released or reclaimed"
+            )
+
+    async def release_job(self, job_id: Optional[int] = None) -> bool:
+        """
+        Give a claimed job back to the queue without reporting it. Defaults to
+        the current job. Returns False when the job was no longer held by this
+        worker.
+        """
+        job_id = self._resolve_job_id(job_id)
+        if not job_id:
+            raise BNPDriverException(
+                "Current Job is either already reported or never started."
+            )
+        pool = await self._get_pool()
+        released = await pool.fetchval(
+            "SELECT bnp.release_job($1, $2, $3, $4)",
+            self.processor_id,
+            job_id,
+            self.current_worker_id,
+            # The token is kept, a late report of the job is rejected
+            self._lease_tokens.get(job_id),
+        )
+        self._in_flight.discard(job_id)
+        self._forget_job(job_id)
+        return released
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop claiming new jobs, then wait up to timeout seconds (forever if None)
+        for the claimed jobs to be reported. Jobs still unreported after that are
+        released. Returns True when all claimed jobs were reported.
+        """
+        self.draining = True
+        loop = asyncio.get_event_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self._in_flight and (deadline is None or loop.time() < deadline):
+            # Reports run on the same loop, polling is cheap
+            await asyncio.sleep(0.05)
+        remaining = sorted(self._in_flight)
+        if not remaining:
+            return True
+        log.warning(f"drain: Releasing {len(remaining)} unfinished jobs.")
+        pool = await self._get_pool()
+        await pool.fetch(
+            "SELECT * FROM bnp.release_jobs($1, $2, $3, $4)",
+            self.processor_id,
+            self.current_worker_id,
+            remaining,
+            # The tokens are kept, late reports of the jobs are rejected
+            [self._lease_tokens.get(job_id) for job_id in remaining],
+        )
+        for job_id in remaining:
+            self._in_flight.discard(job_id)
+            self._forget_job(job_id)
+        return False
+
+    async def renew_leases(self) -> List[int]:
+        """
+        Extend the lease of all claimed jobs that are not reported yet, returns
+        the ids that were renewed. Jobs whose lease could not be renewed have been
+        reclaimed by another worker, they are no longer renewed. Their lease token
+        is kept so that late reports are still rejected.
+        """
+        job_ids = list(self._in_flight)
+        if not job_ids or not self.lease_seconds:
+            return []
+        pool = await self._get_pool()
+        rows = await pool.fetch(
+            "SELECT * FROM bnp.renew_leases($1, $2, $3) AS job_id",
+            self.current_worker_id,
+            job_ids,
+            self.lease_seconds,
+        )
+        renewed = [row["job_id"] for row in rows]
+        for job_id in set(job_ids) - set(renewed):
+            log.warning(f"renew_leases: Lease of job {job_id} was lost.")
+            self._in_flight.discard(job_id)
+        return renewed
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.renew_leases()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(
+                    f"Heartbeat: Failed to renew leases. {type(e).__name__}: {e}"
+                )
+
+    async def get_processed_products_by_worker(self, worker_id: str) -> List[dict]:
+        """Retrieves products processed by a specific worker."""
+        pool = await self._get_pool()
+        rows = await pool.fetch(
+            "SELECT * FROM bnp.get_processed_products_by_worker($1)", worker_id
+        )
+        return [dict(row) for row in rows]
+
+    async def get_logs_for_product(self, l1c_source: str) -> List[dict]:
+        """Retrieves logs for a specific L1C product."""
+        pool = await self._get_pool()
+        rows = await pool.fetch(
+            "SELECT * FROM bnp.get_logs_for_product($1)", l1c_source
+        )
+        return [dict(row) for row in rows]
+
+    async def close(self) -> None:
+        """
+        Stop the heartbeat and close all pooled connections.
+        """
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
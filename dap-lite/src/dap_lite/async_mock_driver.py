@@ -0,0 +1,126 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from .job_handle import AsyncJobHandle
+from .mock_driver import BNPDriver as MockBNPDriver
+
+
+class AsyncBNPDriver:
+    """
+    Async twin of the mock driver, for testing async workers without a database.
+
+    All state lives in a wrapped mock_driver.BNPDriver. Every call yields to the
+    event loop once, so concurrently running jobs interleave like they would
+    against the real async driver.
+    """
+
+    def __init__(self, **kwargs):  # noqa
+        self.mock = MockBNPDriver(
+            **{k: v for k, v in kwargs.items() if k != "pool_size"}
+        )
+        self.driver_type = "ASYNC_MOCK"
+
+    async def get_next_job(self, src_pattern: str = "MSIL1C") -> AsyncJobHandle:
+        """
+        Fetch the next available job for the given processor.
+        """
+        await asyncio.sleep(0)
+        job_id, src_uri = self.mock.get_next_job(src_pattern)
+        return AsyncJobHandle(self, job_id, src_uri)
+
+    async def get_next_jobs(
+        self, n: int, src_pattern: str = "MSIL1C"
+    ) -> List[AsyncJobHandle]:
+        """
+        Claim up to n jobs for the given processor. The current job is not changed.
+        """
+        await asyncio.sleep(0)
+        return [
+            AsyncJobHandle(self, job_id, src_uri)
+            for job_id, src_uri in self.mock.get_next_jobs(n, src_pattern)
+        ]
+
+    @property
+    def current_job(self) -> Tuple[Optional[int], Optional[str]]:
+        return self.mock.current_job
+
+    @property
+    def worker_id(self) -> str:
+        return self.mock.worker_id
+
+    @property
+    def mock_jobs(self) -> List[dict]:
+        return self.mock.mock_jobs
+
+    async def report_finished(
+        self, dst_path: str = "s3://dummy/path", job_id: Optional[int] = None
+    ) -> None:
+        """
+        Mark the job as finished.
+        """
+        await asyncio.sleep(0)
+        self.mock.report_finished(dst_path, job_id=job_id)
+
+    async def report_skipped(
+        self, message: str = "", job_id: Optional[int] = None
+    ) -> None:
+        """
+        Mark the job as skipped.
+        """
+        await asyncio.sleep(0)
+        self.mock.report_skipped(message, job_id=job_id)
+
+    async def report_failure(self, message: str, job_id: Optional[int] = None) -> None:
+        """
+        Mark the job as failed.
+        """
+        await asyncio.sleep(0)
+        self.mock.report_failure(message, job_id=job_id)
+
+    async def store_log_message(
+        self, message: str, job_id: Optional[int] = None
+    ) -> None:
+        """Stores a log message."""
+        await asyncio.sleep(0)
+        self.mock.store_log_message(message, job_id=job_id)
+
+    async def release_job(self, job_id: Optional[int] = None) -> bool:
+        """
+        Put a claimed job back to pending.
+        """
+        await asyncio.sleep(0)
+        return self.mock.release_job(job_id=job_id)
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop claiming new jobs, wait up to timeout seconds (forever if None) for
+        the claimed jobs to be reported and release the rest.
+        """
+        self.mock.draining = True
+        loop = asyncio.get_event_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self.mock.store.processing_job_ids(self.mock.worker_id) and (
+            deadline is None or loop.time() < deadline
+        ):
+            await asyncio.sleep(0.05)
+        return self.mock.drain(timeout=0)
+
+    async def get_processed_products_by_worker(self, worker_id: str) -> List[dict]:
+        """
+        Retrieves products processed by a specific worker.
+        """
+        await asyncio.sleep(0)
+        return self.mock.get_processed_products_by_worker(worker_id)
+
+    async def get_logs_for_product(self, l1c_source: str) -> List[dict]:
+        """
+        Retrieves logs for a specific L1C product.
+        """
+        await asyncio.sleep(0)
+        return self.mock.get_logs_for_product(l1c_source)
+
+    async def close(self) -> None:
+        """
+        Close the mock database connection.
+        """
+        self.mock.close()
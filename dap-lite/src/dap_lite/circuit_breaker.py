@@ -0,0 +1,75 @@
+import random
+import threading
+import time
+from typing import Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """
+    Exponential backoff with full jitter: a random delay between 0 and
+    min(cap, base * 2**attempt), so that many workers retrying after the same
+    failure spread out instead of reconnecting in lockstep.
+    """
+    # Callers count attempts without bound, 2**attempt would overflow the float
+    return random.uniform(0, min(cap, base * 2 ** min(attempt, 64)))
+
+
+class CircuitBreaker:
+    """
+    Stops calls to the database while it is down.
+
+    After failure_threshold consecutive connection failures the breaker opens and
+    allow() returns False until reset_timeout seconds (jittered by +-50%) have
+    passed. Then it goes half open and lets a single trial call through: success
+    closes it again, failure opens it for another period.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._open_for = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go to the database now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self._open_for:
+                    return False
+                self.state = HALF_OPEN
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def retry_in(self) -> Optional[float]:
+        """Seconds until the breaker lets a trial call through, None when closed."""
+        with self._lock:
+            if self.state == CLOSED:
+                return None
+            return max(0.0, self._opened_at + self._open_for - time.monotonic())
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._open_for = self.reset_timeout * random.uniform(0.5, 1.5)
@@ -0,0 +1,207 @@
+import argparse
+import logging
+import sys
+from datetime import date
+from typing import List, Optional
+
+from dap_lite import DriverType
+
+
+def worker(args: argparse.Namespace) -> int:
+    from dap_lite.runner import WorkerRunner
+
+    driver_kwargs = {}
+    if args.lease_seconds is not None:
+        driver_kwargs["lease_seconds"] = args.lease_seconds or None
+    if args.sqlite_path:
+        driver_kwargs["sqlite_path"] = args.sqlite_path
+    if args.outbox_dir:
+        driver_kwargs["outbox_dir"] = args.outbox_dir
+    if args.buffered_logging:
+        driver_kwargs["buffered_logging"] = True
+    if args.tile_affinity:
+        driver_kwargs["tile_affinity"] = True
+    if args.tile_buckets:
+        driver_kwargs["tile_buckets"] = args.tile_buckets
+    if args.job_queue:
+        driver_kwargs["job_queue"] = True
+    if args.fault_profile:
+        driver_kwargs["fault_profile"] = args.fault_profile
+    if args.fault_seed is not None:
+        driver_kwargs["fault_seed"] = args.fault_seed
+    runner = WorkerRunner(
+        args.processor,
+        workers=args.workers,
+        threads=args.threads,
+        driver_type=DriverType(args.driver),
+        processor_id=args.processor_id,
+        src_pattern=args.src_pattern,
+        poll_interval=args.poll_interval,
+        min_poll_interval=args.min_poll_interval,
+        power_off_interval=args.power_off_interval,
+        processor_ids=args.processor_ids,
+        drain_timeout=args.drain_timeout,
+        **driver_kwargs,
+    )
+    return runner.run()
+
+
+def catalog(args: argparse.Namespace) -> int:
+    from dap_lite import synthetic_catalog
+
+    bodies = synthetic_catalog.generate_uri_bodies(
+        args.rows,
+        synthetic_catalog.load_tiles(args.tiles),
+        start=date.fromisoformat(args.start),
+        end=date.fromisoformat(args.end),
+        orbits_per_tile=args.orbits_per_tile,
+        seed=args.seed,
+    )
+    if args.to == "stdout":
+        for body in bodies:
+            print(body)
+        return 0
+    if args.to == "sqlite":
+        loaded = synthetic_catalog.load_sqlite(args.sqlite_path, bodies)
+    else:
+        from dap_lite.driver import BNPDriver
+
+        # Only for the connection settings (BNP_DB_*)
+        driver = BNPDriver(lease_seconds=None)
+        try:
+            tables = ["bnp.dataset_location"]
+            if args.agdc:
+                tables.append("agdc.dataset_location")
+            loaded = synthetic_catalog.copy_to_postgres(
+                driver.connection, bodies, tables
+            )
+        finally:
+            driver.close()
+    logging.info(f"Loaded {loaded} synthetic products.")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="dap-lite")
+    parser.add_argument("--log-level", default="INFO")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_worker = commands.add_parser(
+        "worker", help="Run workers that claim and process jobs"
+    )
+    parser_worker.add_argument(
+        "processor", help="The processor function, as package.module:function"
+    )
+    parser_worker.add_argument(
+        "--workers", type=int, default=1, help="Worker processes (or threads) to run"
+    )
+    parser_worker.add_argument(
+        "--threads", action="store_true", help="Run the workers as threads"
+    )
+    parser_worker.add_argument(
+        "--driver",
+        choices=[DriverType.DB.value, DriverType.MOCK.value, DriverType.SQLITE.value],
+        default=DriverType.DB.value,
+    )
+    parser_worker.add_argument("--processor-id", type=int, default=1)
+    parser_worker.add_argument(
+        "--processor-ids",
+        type=int,
+        nargs="+",
+        help="Scheduler mode, claim jobs of any of these processors by priority",
+    )
+    parser_worker.add_argument("--src-pattern", default="MSIL1C")
+    parser_worker.add_argument(
+        "--poll-interval",
+        type=float,
+        default=60.0,
+        help="Longest wait of an idle worker before it checks the queue again",
+    )
+    parser_worker.add_argument(
+        "--min-poll-interval",
+        type=float,
+        default=0.5,
+        help="First wait of an idle worker, doubled (with jitter) while idle",
+    )
+    parser_worker.add_argument(
+        "--power-off-interval",
+        type=float,
+        default=300.0,
+        help="Wait of idle workers while the power is off",
+    )
+    parser_worker.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=25.0,
+        help="Seconds to let busy workers finish on SIGTERM before interrupting them",
+    )
+    parser_worker.add_argument(
+        "--lease-seconds", type=int, help="Job lease, 0 disables leases"
+    )
+    parser_worker.add_argument(
+        "--sqlite-path",
+        help="Queue file of the sqlite driver (default: BNP_SQLITE_PATH)",
+    )
+    parser_worker.add_argument("--outbox-dir")
+    parser_worker.add_argument("--buffered-logging", action="store_true")
+    parser_worker.add_argument(
+        "--tile-affinity",
+        action="store_true",
+        help="Prefer jobs on the tile the worker processed last",
+    )
+    parser_worker.add_argument(
+        "--tile-buckets",
+        type=int,
+        default=0,
+        help="Let each worker own one of this many tile buckets (implies --tile-affinity)",
+    )
+    parser_worker.add_argument(
+        "--job-queue",
+        action="store_true",
+        help="Claim new products from the bnp.job_queue table",
+    )
+    parser_worker.add_argument(
+        "--fault-profile",
+        help="JSON file of latencies and faults to inject into the mock driver",
+    )
+    parser_worker.add_argument(
+        "--fault-seed", type=int, help="Override the seed of the fault profile"
+    )
+    parser_worker.set_defaults(func=worker)
+
+    parser_catalog = commands.add_parser(
+        "catalog", help="Generate synthetic Sentinel-2 L1C products for scale tests"
+    )
+    parser_catalog.add_argument("--rows", type=int, default=1_000_000)
+    parser_catalog.add_argument(
+        "--to",
+        choices=["stdout", "postgres", "sqlite"],
+        default="stdout",
+        help="Print the uri_body values, COPY them into bnp.dataset_location or add them to a sqlite driver queue",
+    )
+    parser_catalog.add_argument(
+        "--agdc",
+        action="store_true",
+        help="With --to postgres, load agdc.dataset_location too",
+    )
+    parser_catalog.add_argument("--sqlite-path", default="bnp.sqlite")
+    parser_catalog.add_argument(
+        "--tiles", help="Tiles file (default: dap_gui/sentinel2_tiles.json)"
+    )
+    parser_catalog.add_argument("--start", default="2017-01-01")
+    parser_catalog.add_argument("--end", default="2025-12-31")
+    parser_catalog.add_argument("--orbits-per-tile", type=int, default=2)
+    parser_catalog.add_argument("--seed", type=int, default=0)
+    parser_catalog.set_defaults(func=catalog)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="%(asctime)s - %(processName)s %(threadName)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
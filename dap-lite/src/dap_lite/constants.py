@@ -1,5 +1,6 @@
-# This can be put in a table if we go "bigger". Below is just an idea.
-#  For now, the number (id) is the only thing used.
+# The registry now lives in the bnp.processors table (see odc-db-additions.sql),
+# which the claims enforce and BNPDriver.processor_config() reads. This list
+# mirrors its seed row and serves the mock driver and schemas without the table.
 # any numbers of processors can process things using any number of workers
 # as long as the id differs.
 # eg, we can process one baseline with thresholds X as id 3, and another
@@ -10,10 +11,11 @@ PROCESSORS = [
         "id": 1,
         "processor_name": "BNP-Sentinel2_L2A_Force_Processor",
         "source_product_name": "S2A_MSIL1C",
+        "src_pattern": "MSIL1C",  # Matched against the products, see get_next_job
         "target_product_name": "S2A_MSIL2A_{date}_N{baseline}_R{orbit}_T{tile_id}",  # noqa
         "sensor_name": "MSI",
         "baseline": "D001",  # DES baseline,
-        "priority": 10,
+        "priority": 10,  # Share of a scheduled worker pool, see get_next_scheduled_job
         "parameters": {"cloud_threshold": 0.2},
         "required_bands": [
             "B01",
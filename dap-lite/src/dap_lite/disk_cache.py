@@ -0,0 +1,242 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from dap_lite.logger import log
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        uri TEXT NOT NULL,
+        etag TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        last_access REAL NOT NULL
+    )
+"""
+
+# Called with a path that does not exist yet, creates the file or directory there
+Download = Callable[[str], None]
+
+
+def cache_key(uri: str, etag: str) -> str:
+    return hashlib.sha256(f"{uri}\0{etag}".encode()).hexdigest()
+
+
+def disk_usage(path: str) -> int:
+    """Size in bytes of a file, or of all files below a directory."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+class DiskCache:
+    """
+    Local LRU cache of source products and auxiliary data on scratch disk, shared
+    by all worker processes on a node that use the same directory.
+
+    Entries are keyed by source URI and ETag, so a changed object is downloaded
+    again while retries and reprocessing of the same product are served from
+    disk. An entry can be a file or a directory (a .SAFE). The index is a SQLite
+    file (WAL) and every entry has a lock file: open() holds a shared flock while
+    the caller uses the entry, downloads and evictions take it exclusively. So a
+    product is downloaded once even when several processes ask for it at the
+    same time, and an entry in use is never evicted.
+
+    After each download the least recently used entries are evicted until the
+    cache holds at most max_bytes. Unfinished downloads older than
+    stale_seconds (left behind by crashed workers) are removed at start.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, stale_seconds: float = 86400.0):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        for sub in ("data", "tmp", "locks"):
+            os.makedirs(os.path.join(self.directory, sub), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(self.directory, "index.sqlite"),
+            check_same_thread=False,
+            isolation_level=None,
+            timeout=30.0,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(CREATE_TABLE)
+        self._remove_stale_downloads(stale_seconds)
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.directory, "data", key)
+
+    def _remove_stale_downloads(self, stale_seconds: float) -> None:
+        tmp = os.path.join(self.directory, "tmp")
+        for name in os.listdir(tmp):
+            path = os.path.join(tmp, name)
+            try:
+                if time.time() - os.lstat(path).st_mtime > stale_seconds:
+                    _remove(path)
+            except OSError:
+                pass  # Removed by another process
+
+    def _lock_fd(self, key: str, operation: int) -> int:
+        """
+        Open and flock the lock file of key. Evictions remove lock files, so the
+        lock only counts if the file was not replaced while we waited for it.
+        """
+        path = os.path.join(self.directory, "locks", f"{key}.lock")
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, operation)
+            except OSError:
+                os.close(fd)
+                raise
+            try:
+                if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _lookup(self, key: str) -> Optional[str]:
+        """Path of the entry if it is cached, marks it as used."""
+        path = self._data_path(key)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if not os.path.lexists(path):
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+        return path
+
+    def _download(self, key: str, uri: str, etag: str, download: Download) -> str:
+        tmp = os.path.join(
+            self.directory, "tmp", f"{key}-{os.getpid()}-{threading.get_ident()}"
+        )
+        _remove(tmp)
+        try:
+            download(tmp)
+            size = disk_usage(tmp)
+            path = self._data_path(key)
+            _remove(path)  # Left behind without an index row
+            os.replace(tmp, path)
+        except BaseException:
+            _remove(tmp)
+            raise
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, uri, etag, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, uri, etag, size, time.time()),
+            )
+        log.info(f"DiskCache: Downloaded {uri} ({size} bytes).")
+        return path
+
+    @contextmanager
+    def open(self, uri: str, etag: str, download: Download) -> Iterator[str]:
+        """
+        Yield the local path of uri at etag, calling download(path) to fetch it
+        first unless it is cached. The entry is not evicted before the with block
+        ends, do not use the path after that.
+        """
+        key = cache_key(uri, etag)
+        downloaded = False
+        while True:
+            fd = self._lock_fd(key, fcntl.LOCK_SH)
+            path = self._lookup(key)
+            if path is not None:
+                break
+            # flock does not upgrade atomically, take the lock file anew
+            os.close(fd)
+            fd = self._lock_fd(key, fcntl.LOCK_EX)
+            try:
+                # Another process may have downloaded it while we waited
+                if self._lookup(key) is None:
+                    self._download(key, uri, etag, download)
+                    downloaded = True
+            finally:
+                os.close(fd)
+        try:
+            if downloaded:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self.evict()
+            yield path
+        finally:
+            os.close(fd)
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        """
+        Remove least recently used entries that are not in use until the cache
+        holds at most max_bytes (default: the cache's), returns bytes freed.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self._lock:
+            (total,) = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            if total <= max_bytes:
+                return 0
+            candidates = self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY last_access"
+            ).fetchall()
+        freed = 0
+        for key, size in candidates:
+            if total - freed <= max_bytes:
+                break
+            try:
+                fd = self._lock_fd(key, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # In use
+            try:
+                with self._lock:
+                    deleted = self._conn.execute(
+                        "DELETE FROM entries WHERE key = ?", (key,)
+                    ).rowcount
+                if deleted:
+                    _remove(self._data_path(key))
+                    freed += size
+                os.remove(os.path.join(self.directory, "locks", f"{key}.lock"))
+            finally:
+                os.close(fd)
+        return freed
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
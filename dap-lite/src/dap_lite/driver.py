@@ -1,10 +1,82 @@
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from enum import Enum
 import os
-from typing import List, Optional, Tuple
+import select
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple, Union
 import psycopg2
 from psycopg2.extras import DictCursor
 from psycopg2.extras import RealDictCursor
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from dap_lite.circuit_breaker import CircuitBreaker, backoff_delay
+from dap_lite.constants import PROCESSORS
+from dap_lite.job_handle import JobHandle
+from dap_lite.log_buffer import LogBuffer, LogRow
 from dap_lite.logger import log
+from dap_lite.metrics import DriverMetrics, timed
+from dap_lite.outbox import Outbox
+from dap_lite.processor_registry import (
+    PROCESSOR_NOTIFY_CHANNEL,
+    ProcessorCache,
+    processor_from_row,
+)
+
+# Notified by the triggers in odc-db-additions.sql whenever new work may be available
+JOB_NOTIFY_CHANNEL = "bnp_new_jobs"
+# SQLSTATE raised by bnp.raise_report_rejected when a report carries a stale lease token
+STALE_LEASE_PGCODE = "BN001"
+# Raised by the claim functions when another worker created the job first
+CLAIM_CONFLICT_NOTICE = "Conflict: Job already created by another process."
+# SQLSTATE classes of a lost connection: connection exception, operator intervention
+# (e.g. admin_shutdown on failover)
+CONNECTION_LOST_PGCODE_CLASSES = ("08", "57")
+# A schema from before bnp.processors, see processor_config
+UNDEFINED_TABLE_PGCODE = "42P01"
+
+# Server side prepared statements of the hot path, name: (argument types, statement).
+# Each is prepared once per connection, on first use.
+PREPARED_STATEMENTS = {
+    "bnp_get_next_processing_job": (
+        "INTEGER, TEXT, TEXT, INTEGER, INTEGER",
+        "SELECT * FROM bnp.get_next_processing_job($1, $2, $3, $4, $5)",
+    ),
+    "bnp_get_next_processing_jobs": (
+        "INTEGER, TEXT, TEXT, INTEGER, INTEGER, INTEGER",
+        "SELECT * FROM bnp.get_next_processing_jobs($1, $2, $3, $4, $5, $6)",
+    ),
+    "bnp_get_next_queued_jobs": (
+        "INTEGER, TEXT, TEXT, INTEGER, INTEGER, INTEGER",
+        "SELECT * FROM bnp.get_next_queued_jobs($1, $2, $3, $4, $5, $6)",
+    ),
+    "bnp_get_next_affinity_job": (
+        "INTEGER, TEXT, TEXT, TEXT, INTEGER, INTEGER, INTEGER",
+        "SELECT * FROM bnp.get_next_affinity_job($1, $2, $3, $4, $5, $6, $7)",
+    ),
+    "bnp_get_next_scheduled_job": (
+        "TEXT, INTEGER[], INTEGER, INTEGER",
+        "SELECT * FROM bnp.get_next_scheduled_job($1, $2, $3, $4)",
+    ),
+    "bnp_report_finished_processing": (
+        "INTEGER, INTEGER, TEXT, BIGINT",
+        "SELECT bnp.report_finished_processing($1, $2, $3, $4)",
+    ),
+    "bnp_report_processing_failure": (
+        "INTEGER, INTEGER, TEXT, BIGINT",
+        "SELECT bnp.report_processing_failure($1, $2, $3, $4)",
+    ),
+    "bnp_report_processing_skipped": (
+        "INTEGER, INTEGER, TEXT, BIGINT",
+        "SELECT bnp.report_processing_skipped($1, $2, $3, $4)",
+    ),
+    "bnp_store_log_message": (
+        "INTEGER, TEXT, BIGINT",
+        "SELECT bnp.store_log_message($1, $2, $3) AS stored",
+    ),
+}
 
 def get_worker_id():
     # Use Kubernetes pod ID if available
@@ -24,7 +96,121 @@ class BNPDriverException(Exception):
     pass
 
 
+class BNPStaleLeaseException(BNPDriverException):
+    """The job was reclaimed by another worker, this worker must not report it."""
+
+
+class BNPCircuitOpenException(BNPDriverException):
+    """The database is considered down, calls fail fast until retry_in has passed."""
+
+    def __init__(self, retry_in: Optional[float]):
+        super().__init__(
+            f"Database circuit breaker is open, next attempt in {retry_in or 0:.1f}s"
+        )
+        self.retry_in = retry_in
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection that remembers which statements were prepared on it."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def is_connection_error(e: Exception) -> bool:
+    """Whether e means the connection was lost, rather than an error in the query."""
+    if isinstance(e, psycopg2.InterfaceError):
+        return True
+    if not isinstance(e, psycopg2.OperationalError):
+        return False
+    return e.pgcode is None or e.pgcode[:2] in CONNECTION_LOST_PGCODE_CLASSES
+
+
 class BNPDriver:
+    """
+    Driver for the bnp schema in the datacube database.
+
+    By default the driver owns a single connection and tracks one job at a time
+    (current_job). Pass pool_size=N to run it in pooled mode instead: connections
+    are borrowed from a bounded pool of at most N connections per call, and
+    get_next_job/get_next_jobs return JobHandle objects that report on their own,
+    so several threads can work on separate jobs through the same driver.
+
+    With buffered_logging=True, store_log_message only queues the message and a
+    background LogBuffer writes them to bnp.log in bulk, when log_buffer_size
+    messages are queued, every log_flush_interval seconds, before each report
+    call and at close(). While the database is unreachable at most
+    log_buffer_max_pending (10000) rows are kept, the oldest are dropped.
+
+    Claimed jobs carry a lease of lease_seconds (default 600). A background
+    heartbeat thread renews the leases of all in-flight jobs every
+    lease_seconds / 3, so only jobs of crashed or hung workers expire, and those
+    are reclaimed by the next claim (up to the processor's retry_limit attempts).
+    lease_seconds=None disables leases and the heartbeat.
+
+    Every claim also hands out a new lease token which is sent with the report
+    calls and log messages of the job. Once a job has been reclaimed, the old
+    worker's reports raise BNPStaleLeaseException instead of overwriting the
+    result of the worker that took over.
+
+    Lost connections are replaced transparently. Idempotent calls are retried up
+    to retry_attempts times (default 5) with exponential backoff and full jitter
+    (retry_base_delay, retry_max_delay); report_* calls only when they carry a
+    lease token, otherwise they raise once a new connection is in place. After breaker_threshold consecutive
+    connection failures a circuit breaker opens and every call raises
+    BNPCircuitOpenException for about breaker_reset_timeout seconds, see
+    circuit_state.
+
+    get_next_job, get_next_jobs, the report_* calls and store_log_message run as
+    server side prepared statements, so the database parses and plans them once
+    per connection. Pass prepared_statements=False when connecting through a
+    pooler that does not support them (e.g. pgbouncer in transaction mode).
+
+    With outbox_dir set, report_* and log calls that cannot reach the database
+    are persisted to a local SQLite outbox in that directory instead of raising.
+    They are replayed in order once the database is back (by the heartbeat,
+    before each claim and at close), and the outbox survives a restart of the
+    worker. Replays are idempotent thanks to the lease tokens, and the lease of
+    a job waiting in the outbox is kept alive meanwhile.
+
+    With prefetch_depth=N a background thread keeps up to N jobs matching
+    prefetch_src_pattern claimed ahead of time, so get_next_job returns straight
+    from memory. Prefetched jobs that are not handed out within prefetch_ttl
+    seconds (default 300), and all that are left at close(), are released back to
+    the queue.
+
+    In scheduler mode get_next_scheduled_job claims a job of any of the
+    processors in processor_ids (default: all enabled processors), weighted by
+    their priority over the last schedule_window seconds (default 3600). The
+    driver then reports each job for the processor it was claimed for.
+
+    With tile_affinity=True get_next_job prefers products of the tile the worker
+    processed last (last_tile), so per-tile inputs cached on its disk are reused.
+    tile_buckets=N (implies tile_affinity) additionally makes the worker own one
+    of N tile buckets through an advisory lock of its connection and prefer its
+    tiles, see bnp.get_next_affinity_job. It cannot be combined with pool_size.
+
+    With job_queue=True get_next_job, get_next_jobs and queue_depth take new
+    products from the bnp.job_queue table, kept up to date by triggers, instead
+    of scanning bnp.dataset_location for products without a job, so claims do not
+    slow down as the execution history grows (see bnp.get_next_queued_jobs). Only
+    processors registered in bnp.processors have a queue. Tile affinity and
+    scheduler mode keep scanning.
+
+    The processors are registered in bnp.processors, which the claims enforce
+    (enabled, retry_limit). processor_config() reads it from a cache that is
+    reloaded every processor_cache_ttl seconds (default 300) and dropped as soon
+    as the table changes (NOTIFY bnp_processors).
+
+    release_job() gives a claimed job back without reporting it. drain() stops
+    claiming, waits for the in-flight jobs to be reported and releases the rest,
+    for shutting a worker down without stranding its jobs.
+
+    stats() returns latency histograms of the public calls and counters of empty
+    claims, claim conflicts, stale leases, retries and connection errors, see
+    dap_lite.metrics for the Prometheus exporter.
+    """
 
     def __init__(self, **kwargs):  # noqa
         self.db_host = os.getenv("BNP_DB_HOSTNAME", "datasource.main.rise-ck8s.com")
@@ -32,47 +218,677 @@ class BNPDriver:
         self.db_user = os.getenv("BNP_DB_USERNAME", "bnp_db_rw")
         self.db_password = os.getenv("BNP_DB_PASSWORD", "bnp_password")
         self.db_name = os.getenv("BNP_DB_DATABASE", "datacube")
-        self.current_worker_id: str = get_worker_id()
+        self.current_worker_id: str = kwargs.get("worker_id") or get_worker_id()
         self.current_job_id = None
         self.current_src_path = None
         self.processor_id = kwargs.get("processor_id", 1)
+        self.processor_ids: Optional[List[int]] = kwargs.get("processor_ids")
+        self.schedule_window: int = kwargs.get("schedule_window", 3600)
         if not self.db_password:
             raise ValueError("BNP_DB_PASSWORD is not set in the environment variables")
         self.driver_type="DB"
-        self.connection = psycopg2.connect(
+        self.metrics = DriverMetrics()
+        self._connect_kwargs = connect_kwargs = dict(
             host=self.db_host,
             port=self.db_port,
             user=self.db_user,
             password=self.db_password,
             dbname=self.db_name,
             cursor_factory=DictCursor,
+            connection_factory=PreparingConnection,
+        )
+        self.prepared_statements: bool = kwargs.get("prepared_statements", True)
+        self.pool_size: Optional[int] = kwargs.get("pool_size")
+        self.tile_buckets: int = kwargs.get("tile_buckets", 0)
+        self.tile_affinity: bool = kwargs.get("tile_affinity", False) or bool(
+            self.tile_buckets
+        )
+        self.last_tile: Optional[str] = None
+        if self.tile_buckets and self.pool_size:
+            # The bucket lock belongs to one session, pooled calls hop connections
+            raise ValueError("tile_buckets cannot be combined with pool_size")
+        self.pool: Optional[ThreadedConnectionPool] = None
+        self.connection = None
+        # Serializes the threads that share the single connection
+        self._connection_lock = threading.RLock()
+        if self.pool_size:
+            # ThreadedConnectionPool raises when exhausted, the semaphore makes
+            # callers wait for a free connection instead.
+            self.pool = ThreadedConnectionPool(1, self.pool_size, **connect_kwargs)
+            self._pool_slots = threading.BoundedSemaphore(self.pool_size)
+        else:
+            self.connection = psycopg2.connect(**connect_kwargs)
+            self.connection.autocommit = True
+        self._listen_connection = None
+        self._listen_lock = threading.Lock()
+        self.processor_cache = ProcessorCache(
+            self._load_processors, ttl=kwargs.get("processor_cache_ttl", 300.0)
+        )
+        self.retry_attempts: int = kwargs.get("retry_attempts", 5)
+        self.retry_base_delay: float = kwargs.get("retry_base_delay", 0.5)
+        self.retry_max_delay: float = kwargs.get("retry_max_delay", 30.0)
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=kwargs.get("breaker_threshold", 5),
+            reset_timeout=kwargs.get("breaker_reset_timeout", 30.0),
+        )
+        self.lease_seconds: Optional[int] = kwargs.get("lease_seconds", 600)
+        self.job_queue: bool = kwargs.get("job_queue", False)
+        self.max_attempts: int = kwargs.get(
+            "max_attempts", self._processor_config().get("retry_limit", 3)
         )
-        self.connection.autocommit = True
+        self._in_flight: Dict[int, JobHandle] = {}
+        # Kept until the job is reported, also after its lease was lost or it was
+        # released, so that late reports of the job are still fenced
+        self._lease_tokens: Dict[int, Optional[int]] = {}
+        # Processor of each job claimed by get_next_scheduled_job, kept like the tokens
+        self._job_processor_ids: Dict[int, int] = {}
+        # Also notified whenever a job stops being in flight, see drain()
+        self._in_flight_lock = threading.Condition()
+        self.outbox: Optional[Outbox] = None
+        # Jobs whose report waits in the outbox, their leases are still renewed
+        self._deferred: Dict[int, JobHandle] = {}
+        self._replay_lock = threading.Lock()
+        if kwargs.get("outbox_dir"):
+            self.outbox = Outbox(
+                os.path.join(
+                    kwargs["outbox_dir"], f"bnp-outbox-{self.current_worker_id}.sqlite"
+                )
+            )
+        self.log_buffer: Optional[LogBuffer] = None
+        if kwargs.get("buffered_logging", False):
+            self.log_buffer = LogBuffer(
+                self._insert_log_rows,
+                max_size=kwargs.get("log_buffer_size", 100),
+                flush_interval=kwargs.get("log_flush_interval", 2.0),
+                max_pending=kwargs.get("log_buffer_max_pending", 10000),
+            )
+        self.draining = False
+        # Started last, the heartbeat renews the deferred jobs and replays the outbox
+        self._stop_heartbeat = threading.Event()
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        if self.lease_seconds:
+            self._heartbeat_thread = threading.Thread(
+                target=self._heartbeat_loop, name="bnp-heartbeat", daemon=True
+            )
+            self._heartbeat_thread.start()
+        self.prefetch_depth: int = kwargs.get("prefetch_depth", 0)
+        self.prefetch_ttl: float = kwargs.get("prefetch_ttl", 300.0)
+        self.prefetch_src_pattern: str = kwargs.get("prefetch_src_pattern", "MSIL1C")
+        self.prefetch_poll_interval: float = kwargs.get("prefetch_poll_interval", 5.0)
+        # (claimed at, job) in claim order
+        self._prefetched: Deque[Tuple[float, JobHandle]] = deque()
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_wakeup = threading.Event()
+        self._stop_prefetch = threading.Event()
+        self._prefetch_thread: Optional[threading.Thread] = None
+        if self.prefetch_depth > 0:
+            self._prefetch_thread = threading.Thread(
+                target=self._prefetch_loop, name="bnp-prefetch", daemon=True
+            )
+            self._prefetch_thread.start()
+
+    def _processor_config(self) -> dict:
+        # Only a default, the claims apply the retry_limit of bnp.processors
+        return next((p for p in PROCESSORS if p["id"] == self.processor_id), {})
+
+    @property
+    def pooled(self) -> bool:
+        return self.pool is not None
+
+    @property
+    def circuit_state(self) -> str:
+        """closed (healthy), open (database down, failing fast) or half_open."""
+        return self.circuit_breaker.state
+
+    @contextmanager
+    def _cursor(self, cursor_factory=None) -> Iterator[psycopg2.extensions.cursor]:
+        """
+        Yield a cursor on the single connection, held alone for the duration of
+        the block, or on a connection borrowed from the pool. A connection that
+        was lost is replaced on the next use.
+        """
+        try:
+            if self.pool is None:
+                with self._connection_lock:
+                    if self.connection.closed:
+                        log.info("Reconnecting to the database.")
+                        self.connection = psycopg2.connect(**self._connect_kwargs)
+                        self.connection.autocommit = True
+                    with self.connection.cursor(cursor_factory=cursor_factory) as cur:
+                        yield cur
+                return
 
+            with self._pool_slots:
+                conn = self.pool.getconn()
+                broken = False
+                try:
+                    conn.autocommit = True
+                    with conn.cursor(cursor_factory=cursor_factory) as cur:
+                        yield cur
+                except psycopg2.Error as e:
+                    broken = is_connection_error(e)
+                    raise
+                finally:
+                    # Broken connections are dropped, the pool opens a new one
+                    self.pool.putconn(conn, close=broken or bool(conn.closed))
+        except psycopg2.Error as e:
+            if e.pgcode == STALE_LEASE_PGCODE:
+                raise BNPStaleLeaseException(e.diag.message_primary) from e
+            raise
+
+    def _run(
+        self,
+        work: Callable[[psycopg2.extensions.cursor], Any],
+        idempotent: bool = True,
+        cursor_factory=None,
+    ) -> Any:
+        """
+        Call work(cursor) through the circuit breaker. On a lost connection it is
+        retried with backoff when idempotent, otherwise the error is raised.
+        """
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow():
+                self.metrics.inc("circuit_open")
+                raise BNPCircuitOpenException(self.circuit_breaker.retry_in())
+            try:
+                with self._cursor(cursor_factory=cursor_factory) as cur:
+                    result = work(cur)
+            except psycopg2.Error as e:
+                if not is_connection_error(e):
+                    # The database answered, it is up
+                    self.circuit_breaker.record_success()
+                    raise
+                self.circuit_breaker.record_failure()
+                self.metrics.inc("connection_errors")
+                if not idempotent or attempt >= self.retry_attempts:
+                    raise
+                self.metrics.inc("retries")
+                delay = backoff_delay(
+                    attempt, self.retry_base_delay, self.retry_max_delay
+                )
+                log.warning(
+                    f"Lost the database connection, retrying in {delay:.1f}s. {type(e).__name__}: {e}"
+                )
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BNPStaleLeaseException:
+                self.circuit_breaker.record_success()
+                self.metrics.inc("stale_leases")
+                raise
+            self.circuit_breaker.record_success()
+            return result
+
+    def _query(
+        self,
+        query: str,
+        params: tuple,
+        idempotent: bool = True,
+        cursor_factory=None,
+        prepared: Optional[str] = None,
+    ) -> list:
+        """
+        Execute query with _run and return all result rows. When prepared names
+        one of the PREPARED_STATEMENTS, that is executed with params instead.
+        """
+
+        def work(cur):
+            notices = cur.connection.notices
+            del notices[:]
+            if prepared and self.prepared_statements:
+                self._execute_prepared(cur, prepared, params)
+            else:
+                cur.execute(query, params)
+            conflicts = sum(CLAIM_CONFLICT_NOTICE in notice for notice in notices)
+            if conflicts:
+                self.metrics.inc("claim_conflicts", conflicts)
+            return cur.fetchall() if cur.description else []
+
+        return self._run(work, idempotent=idempotent, cursor_factory=cursor_factory)
+
+    @staticmethod
+    def _execute_prepared(
+        cur: psycopg2.extensions.cursor, name: str, params: tuple
+    ) -> None:
+        conn = cur.connection
+        if name not in conn.prepared:
+            types, statement = PREPARED_STATEMENTS[name]
+            cur.execute(f"PREPARE {name} ({types}) AS {statement};")
+            conn.prepared.add(name)
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))});", params)
+
+    @timed
     def get_next_job(
         self,
         src_pattern: str = "MSIL1C",
-    ) -> Tuple[Optional[int], Optional[str]]:
+    ) -> Union[Tuple[Optional[int], Optional[str]], JobHandle]:
         """
         Fetch the next available job for the given processor.
+
+        In pooled mode a JobHandle is returned, it is falsy when no job was found.
+        No job is returned while draining.
         """
+        if self.draining:
+            return self._hand_out(JobHandle(self, None, None))
+        self.replay_outbox()
+        prefetched = self._take_prefetched(1, src_pattern)
+        if prefetched:
+            return self._hand_out(prefetched[0])
+        if self.tile_affinity:
+            rows = self._claim_with_affinity(src_pattern)
+        elif self.job_queue:
+            rows = self._claim_rows(1, src_pattern)
+        else:
+            query = """
+            SELECT * FROM bnp.get_next_processing_job(%s, %s, %s, %s, %s)
+            """
+            log.debug(
+                f"SELECT * FROM bnp.get_next_processing_job('{self.processor_id}', '{self.current_worker_id}', '{src_pattern}', {self.lease_seconds}, {self.max_attempts})"
+            )
+            # A claim whose answer got lost leaves an orphaned job behind, which is
+            # only safe to retry when its lease expires and it gets reclaimed
+            rows = self._query(
+                query,
+                (
+                    self.processor_id,
+                    self.current_worker_id,
+                    src_pattern,
+                    self.lease_seconds,
+                    self.max_attempts,
+                ),
+                idempotent=bool(self.lease_seconds),
+                prepared="bnp_get_next_processing_job",
+            )
+        result = rows[0] if rows else None
+        job_id, src_path, lease_token = None, None, None
+        if result:
+            job_id, src_path = result["job_id"], result["src_uri"]
+            lease_token = result["lease_token"]
+        job = JobHandle(self, job_id, src_path, lease_token)
+        if job:
+            if self.tile_affinity:
+                self.last_tile = result["tile"]
+            self.metrics.inc("claimed_jobs")
+            self._track(job)
+        else:
+            self.metrics.inc("empty_claims")
+        return self._hand_out(job)
+
+    def _claim_with_affinity(self, src_pattern: str) -> list:
         query = """
-        SELECT * FROM bnp.get_next_processing_job(%s, %s, %s)
+        SELECT * FROM bnp.get_next_affinity_job(%s, %s, %s, %s, %s, %s, %s)
         """
         log.debug(
-            f"SELECT * FROM bnp.get_next_processing_job('{self.processor_id}', '{self.current_worker_id}', '{src_pattern}')"
-        )
-        with self.connection.cursor() as cur:
-            cur.execute(query, (self.processor_id, self.current_worker_id, src_pattern))
-            result = cur.fetchone()
-            if result:
-                self.current_job_id = result["job_id"]
-                self.current_src_path = result["src_uri"]
-            else:
-                self.current_job_id = None
-                self.current_src_path = None
+            f"SELECT * FROM bnp.get_next_affinity_job('{self.processor_id}', '{self.current_worker_id}', '{src_pattern}', '{self.last_tile}', {self.tile_buckets}, {self.lease_seconds}, {self.max_attempts})"
+        )
+        return self._query(
+            query,
+            (
+                self.processor_id,
+                self.current_worker_id,
+                src_pattern,
+                self.last_tile,
+                self.tile_buckets,
+                self.lease_seconds,
+                self.max_attempts,
+            ),
+            idempotent=bool(self.lease_seconds),
+            prepared="bnp_get_next_affinity_job",
+        )
+
+    def _hand_out(
+        self, job: JobHandle
+    ) -> Union[Tuple[Optional[int], Optional[str]], JobHandle]:
+        if self.pooled:
+            return job
+        self.current_job_id = job.job_id
+        self.current_src_path = job.src_uri
         return self.current_job_id, self.current_src_path
 
+    @timed
+    def get_next_jobs(
+        self,
+        n: int,
+        src_pattern: str = "MSIL1C",
+    ) -> Union[List[Tuple[int, str]], List[JobHandle]]:
+        """
+        Claim up to n jobs for the given processor in a single round trip.
+
+        The claimed jobs are all owned by this worker and must be reported one by
+        one by passing job_id to the report_* methods. The current job is not
+        changed. In pooled mode a list of JobHandle is returned.
+        """
+        if n < 1 or self.draining:
+            return []
+        self.replay_outbox()
+        jobs = self._take_prefetched(n, src_pattern)
+        if len(jobs) < n:
+            jobs += self._claim_jobs(n - len(jobs), src_pattern)
+        if self.pooled:
+            return jobs
+        return [tuple(job) for job in jobs]
+
+    def _claim_rows(self, n: int, src_pattern: str) -> list:
+        """Rows of up to n claimed jobs, from bnp.job_queue with job_queue on."""
+        function = (
+            "get_next_queued_jobs" if self.job_queue else "get_next_processing_jobs"
+        )
+        query = f"""
+        SELECT * FROM bnp.{function}(%s, %s, %s, %s, %s, %s)
+        """
+        log.debug(
+            f"SELECT * FROM bnp.{function}('{self.processor_id}', '{self.current_worker_id}', '{src_pattern}', {n}, {self.lease_seconds}, {self.max_attempts})"
+        )
+        return self._query(
+            query,
+            (
+                self.processor_id,
+                self.current_worker_id,
+                src_pattern,
+                n,
+                self.lease_seconds,
+                self.max_attempts,
+            ),
+            idempotent=bool(self.lease_seconds),
+            prepared=f"bnp_{function}",
+        )
+
+    def _claim_jobs(self, n: int, src_pattern: str) -> List[JobHandle]:
+        """Claim up to n jobs and track them as in flight."""
+        rows = self._claim_rows(n, src_pattern)
+        jobs = [
+            JobHandle(self, row["job_id"], row["src_uri"], row["lease_token"])
+            for row in rows
+        ]
+        for job in jobs:
+            self._track(job)
+        self.metrics.inc("claimed_jobs", len(jobs))
+        if not jobs:
+            self.metrics.inc("empty_claims")
+        return jobs
+
+    @timed
+    def get_next_scheduled_job(
+        self, processor_ids: Optional[List[int]] = None
+    ) -> JobHandle:
+        """
+        Claim a job of any of processor_ids (default: the driver's processor_ids,
+        or all enabled processors in bnp.processors) in a single round trip. The
+        processors are tried in order of priority, weighted by how many jobs each
+        of them started recently, see bnp.get_next_scheduled_job.
+
+        Returns a JobHandle, also outside of pooled mode, whose processor_id
+        tells which processor the job is for. It is falsy when no job was found.
+        Reports of the job, also by job_id, go to that processor. Outside of
+        pooled mode the job becomes the current job.
+        """
+        if self.draining:
+            return JobHandle(self, None, None)
+        self.replay_outbox()
+        query = """
+        SELECT * FROM bnp.get_next_scheduled_job(%s, %s, %s, %s)
+        """
+        rows = self._query(
+            query,
+            (
+                self.current_worker_id,
+                processor_ids or self.processor_ids,
+                self.lease_seconds,
+                self.schedule_window,
+            ),
+            idempotent=bool(self.lease_seconds),
+            prepared="bnp_get_next_scheduled_job",
+        )
+        job = JobHandle(self, None, None)
+        if rows:
+            row = rows[0]
+            job = JobHandle(
+                self,
+                row["job_id"],
+                row["src_uri"],
+                row["lease_token"],
+                processor_id=row["processor_id"],
+            )
+            self.metrics.inc("claimed_jobs")
+            self._track(job)
+        else:
+            self.metrics.inc("empty_claims")
+        if not self.pooled:
+            self.current_job_id = job.job_id
+            self.current_src_path = job.src_uri
+        return job
+
+    def _take_prefetched(self, n: int, src_pattern: str) -> List[JobHandle]:
+        """Pop up to n prefetched jobs, if they were prefetched for src_pattern."""
+        if self.prefetch_depth < 1 or src_pattern != self.prefetch_src_pattern:
+            return []
+        jobs = []
+        with self._prefetch_lock:
+            while self._prefetched and len(jobs) < n:
+                _, job = self._prefetched.popleft()
+                if not job.lease_lost:
+                    jobs.append(job)
+        self._prefetch_wakeup.set()
+        return jobs
+
+    def _prefetch_loop(self) -> None:
+        """Keep the prefetch queue filled and release jobs that were kept too long."""
+        # Woken early whenever jobs are taken from the queue
+        interval = min(self.prefetch_poll_interval, self.prefetch_ttl)
+        while not self._stop_prefetch.is_set():
+            try:
+                self._release_stale_prefetched()
+                with self._prefetch_lock:
+                    missing = self.prefetch_depth - len(self._prefetched)
+                if missing > 0:
+                    with self.metrics.timer("prefetch_claim"):
+                        jobs = self._claim_jobs(missing, self.prefetch_src_pattern)
+                    now = time.monotonic()
+                    with self._prefetch_lock:
+                        self._prefetched.extend((now, job) for job in jobs)
+            except Exception as e:
+                log.warning(f"Prefetch: Failed to claim jobs. {type(e).__name__}: {e}")
+            self._prefetch_wakeup.wait(interval)
+            self._prefetch_wakeup.clear()
+
+    def _stop_prefetching(self) -> None:
+        """Stop the prefetch thread and release the jobs left in the queue."""
+        self._stop_prefetch.set()
+        self._prefetch_wakeup.set()
+        if self._prefetch_thread is None:
+            return
+        self._prefetch_thread.join()
+        with self._prefetch_lock:
+            unused = [job for _, job in self._prefetched]
+            self._prefetched.clear()
+        try:
+            self._release_jobs(unused, handed_out=False)
+        except psycopg2.Error as e:
+            log.warning(
+                f"Prefetch: Failed to release {len(unused)} prefetched jobs, they are reclaimed when their lease expires. {type(e).__name__}: {e}"
+            )
+
+    def _release_stale_prefetched(self) -> None:
+        deadline = time.monotonic() - self.prefetch_ttl
+        with self._prefetch_lock:
+            stale = [job for claimed, job in self._prefetched if claimed < deadline]
+            self._prefetched = deque(
+                (claimed, job)
+                for claimed, job in self._prefetched
+                if claimed >= deadline
+            )
+        if stale:
+            log.info(f"Prefetch: Releasing {len(stale)} jobs not used in time.")
+            self._release_jobs(stale, handed_out=False)
+
+    def _release_jobs(
+        self, jobs: List[JobHandle], handed_out: bool = True
+    ) -> List[int]:
+        """
+        Give claimed jobs back to the queue (bnp.release_jobs), returns the ids
+        that were released. Jobs that were lost or reported in the meantime are
+        skipped by the database. The lease tokens of jobs that were handed out
+        are kept, so that reports of them are rejected from now on.
+        """
+        if not jobs:
+            return []
+        query = """
+        SELECT * FROM bnp.release_jobs(%s, %s, %s, %s) AS job_id;
+        """
+        by_processor: Dict[int, List[JobHandle]] = {}
+        for job in jobs:
+            processor_id = self._job_processor_id(job.job_id)
+            by_processor.setdefault(processor_id, []).append(job)
+        released = []
+        for processor_id, processor_jobs in by_processor.items():
+            rows = self._query(
+                query,
+                (
+                    processor_id,
+                    self.current_worker_id,
+                    [job.job_id for job in processor_jobs],
+                    [job.lease_token for job in processor_jobs],
+                ),
+            )
+            released += [row["job_id"] for row in rows]
+        for job in jobs:
+            job.lease_lost = True
+            self._untrack(job.job_id, reported=not handed_out)
+            self._forget_job(job.job_id)
+        return released
+
+    def _track(self, job: JobHandle) -> None:
+        with self._in_flight_lock:
+            self._in_flight[job.job_id] = job
+            self._lease_tokens[job.job_id] = job.lease_token
+            if job.processor_id is not None:
+                self._job_processor_ids[job.job_id] = job.processor_id
+
+    def _untrack(self, job_id: Optional[int], reported: bool = True) -> None:
+        with self._in_flight_lock:
+            self._in_flight.pop(job_id, None)
+            if reported:
+                self._lease_tokens.pop(job_id, None)
+                self._job_processor_ids.pop(job_id, None)
+            self._in_flight_lock.notify_all()
+
+    def _lease_token(self, job_id: Optional[int]) -> Optional[int]:
+        with self._in_flight_lock:
+            return self._lease_tokens.get(job_id)
+
+    def _job_processor_id(self, job_id: Optional[int]) -> int:
+        with self._in_flight_lock:
+            return self._job_processor_ids.get(job_id, self.processor_id)
+
+    def _lease_lost(self, job_id: Optional[int]) -> None:
+        """The job is no longer ours, stop renewing it but keep its token."""
+        with self._in_flight_lock:
+            job = self._in_flight.get(job_id)
+        if job is not None:
+            job.lease_lost = True
+        self._untrack(job_id, reported=False)
+
+    @property
+    def in_flight_jobs(self) -> List[JobHandle]:
+        """Jobs claimed by this driver that have not been reported yet."""
+        with self._in_flight_lock:
+            return list(self._in_flight.values())
+
+    @timed
+    def renew_leases(self) -> List[int]:
+        """
+        Extend the lease of all in-flight jobs, returns the ids that were renewed.
+        Jobs whose lease could not be renewed have been reclaimed by another
+        worker (or reported), they are marked lease_lost and no longer tracked.
+        Their lease token is kept so that late reports are still rejected.
+        """
+        with self._in_flight_lock:
+            job_ids = list(self._in_flight) + list(self._deferred)
+        if not job_ids or not self.lease_seconds:
+            return []
+        query = """
+        SELECT * FROM bnp.renew_leases(%s, %s, %s) AS job_id;
+        """
+        rows = self._query(query, (self.current_worker_id, job_ids, self.lease_seconds))
+        renewed = [row["job_id"] for row in rows]
+        for job_id in set(job_ids) - set(renewed):
+            log.warning(f"renew_leases: Lease of job {job_id} was lost.")
+            self._lease_lost(job_id)
+        return renewed
+
+    @timed
+    def release_job(self, job_id: Optional[int] = None) -> bool:
+        """
+        Give a claimed but unfinished job back to the queue without reporting it,
+        so that another worker can claim it right away. Defaults to the current
+        job. Returns False when the job was no longer held by this worker.
+        """
+        job_id = self._resolve_job_id(job_id)
+        if not job_id:
+            raise BNPDriverException(
+                "Current Job is either already reported or never started."
+            )
+        query = """
+        SELECT bnp.release_job(%s, %s, %s, %s) AS released;
+        """
+        self.flush_logs()
+        rows = self._query(
+            query,
+            (
+                self._job_processor_id(job_id),
+                job_id,
+                self.current_worker_id,
+                self._lease_token(job_id),
+            ),
+        )
+        released = rows[0]["released"]
+        self._lease_lost(job_id)
+        self._forget_job(job_id)
+        return released
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop claiming new jobs and release all prefetched ones, then wait up to
+        timeout seconds (forever if None) for the in-flight jobs to be reported.
+        Jobs still in flight after that are released. Returns True when all
+        in-flight jobs were reported.
+
+        In a single threaded worker call it after leaving the processing loop,
+        drain(timeout=0) then releases the job that was interrupted, if any.
+        """
+        self.draining = True
+        self._stop_prefetching()
+        with self._in_flight_lock:
+            drained = self._in_flight_lock.wait_for(
+                lambda: not self._in_flight, timeout
+            )
+            remaining = list(self._in_flight.values())
+        if remaining:
+            log.warning(f"drain: Releasing {len(remaining)} unfinished jobs.")
+            self.flush_logs()
+            self._release_jobs(remaining)
+        return drained
+
+    def _heartbeat_loop(self) -> None:
+        interval = self.lease_seconds / 3
+        while not self._stop_heartbeat.wait(interval):
+            try:
+                self.replay_outbox()
+                self.renew_leases()
+            except Exception as e:
+                log.warning(
+                    f"Heartbeat: Failed to renew leases. {type(e).__name__}: {e}"
+                )
+
+    def _resolve_job_id(self, job_id: Optional[int]) -> Optional[int]:
+        return self.current_job_id if job_id is None else job_id
+
+    def _forget_job(self, job_id: Optional[int]) -> None:
+        if job_id == self.current_job_id:
+            self.current_job_id = None
+            self.current_src_path = None
+
     @property
     def current_job(self) -> Tuple[Optional[int], Optional[str]]:
         return self.current_job_id, self.current_src_path
@@ -81,77 +897,459 @@ class BNPDriver:
     def worker_id(self) -> str:
         return self.current_worker_id
 
-    def report_finished(self, dst_path: str = "s3://dummy/path"):
-        """
-        Mark the job as finished.
+    def _report(self, function: str, job_id: Optional[int], text: str) -> None:
         """
-        query = """
-        SELECT bnp.report_finished_processing(%s, %s, %s);
+        Call one of the bnp.report_* functions with the job's lease token. A job
+        whose lease turned out to be stale is dropped before the exception
+        propagates. With an outbox, a report that cannot reach the database is
+        deferred to it, after the buffered log rows that could not be flushed.
         """
-        with self.connection.cursor() as cur:
-            cur.execute(query, (self.processor_id, self.current_job_id, dst_path))
-            self.connection.commit()
-        self.current_job_id = None
-        self.current_src_path = None
+        try:
+            self.flush_logs()
+        except (psycopg2.Error, BNPCircuitOpenException) as e:
+            if self.outbox is None or not self._is_outage(e):
+                raise
+            log.warning(
+                f"{function}: Database unavailable, buffered log rows deferred to the outbox. {type(e).__name__}: {e}"
+            )
+            rows = self.log_buffer.take()
+            if rows:
+                self._defer_log_rows(rows)
+        lease_token = self._lease_token(job_id)
+        entry = {
+            "call": function,
+            "processor_id": self._job_processor_id(job_id),
+            "job_id": job_id,
+            "text": text,
+            "lease_token": lease_token,
+        }
+        if self.outbox is not None and len(self.outbox):
+            # Earlier calls are still waiting, keep the order
+            self._defer_report(entry)
+            self.replay_outbox()
+            return
+        try:
+            self._replay_report(entry)
+        except BNPStaleLeaseException:
+            self._untrack(job_id)
+            self._forget_job(job_id)
+            raise
+        except (psycopg2.Error, BNPCircuitOpenException) as e:
+            if self.outbox is None or not self._is_outage(e):
+                raise
+            log.warning(
+                f"{function}: Database unavailable, job {job_id} deferred to the outbox. {type(e).__name__}: {e}"
+            )
+            self._defer_report(entry)
+            return
+        self._untrack(job_id)
+
+    def _replay_report(self, entry: dict) -> None:
+        # Only retried with a lease token, which makes the report idempotent
+        self._query(
+            f"SELECT {entry['call']}(%s, %s, %s, %s);",
+            (
+                entry["processor_id"],
+                entry["job_id"],
+                entry["text"],
+                entry["lease_token"],
+            ),
+            idempotent=entry["lease_token"] is not None,
+            prepared=entry["call"].replace(".", "_"),
+        )
+
+    def _defer_report(self, entry: dict) -> None:
+        self.outbox.append(entry)
+        job_id = entry["job_id"]
+        with self._in_flight_lock:
+            job = self._in_flight.get(job_id)
+            if job is not None:
+                self._deferred[job_id] = job
+        self._untrack(job_id, reported=False)
+
+    @staticmethod
+    def _is_outage(e: Exception) -> bool:
+        return isinstance(e, BNPCircuitOpenException) or is_connection_error(e)
 
-    def report_skipped(self, message: str = ""):
+    def replay_outbox(self) -> int:
         """
-        Mark the job as skipped.
+        Replay the calls waiting in the outbox, oldest first, and stop at the
+        first one that still cannot reach the database. Calls rejected by the
+        database (e.g. a stale lease) are dropped. Returns the number of entries
+        that were taken out of the outbox.
         """
-        query = """
-        SELECT bnp.report_skipped_processing(%s, %s, %s);
+        if self.outbox is None or not len(self.outbox):
+            return 0
+        if not self._replay_lock.acquire(blocking=False):
+            return 0  # Another thread is replaying
+        done = 0
+        try:
+            for seq, entry in self.outbox.pending():
+                try:
+                    if entry["call"] == "log":
+                        self._write_log_rows([tuple(row) for row in entry["rows"]])
+                    else:
+                        self._replay_report(entry)
+                except (psycopg2.Error, BNPDriverException) as e:
+                    if self._is_outage(e):
+                        break
+                    log.error(
+                        f"Outbox: Dropping {entry['call']} of job {entry.get('job_id')}, rejected by the database. {type(e).__name__}: {e}"
+                    )
+                self.outbox.remove(seq)
+                if "job_id" in entry:
+                    with self._in_flight_lock:
+                        self._deferred.pop(entry["job_id"], None)
+                        self._lease_tokens.pop(entry["job_id"], None)
+                done += 1
+        finally:
+            self._replay_lock.release()
+        if done:
+            log.info(
+                f"Outbox: Replayed {done} calls, {len(self.outbox)} still pending."
+            )
+        return done
+
+    @timed
+    def report_finished(
+        self, dst_path: str = "s3://dummy/path", job_id: Optional[int] = None
+    ):
         """
-        with self.connection.cursor() as cur:
-            cur.execute(query, (self.processor_id, self.current_job_id, message))
-            self.connection.commit()
-        self.current_job_id = None
-        self.current_src_path = None
+        Mark the job as finished. Defaults to the current job.
+        """
+        job_id = self._resolve_job_id(job_id)
+        self._report("bnp.report_finished_processing", job_id, dst_path)
+        self._forget_job(job_id)
 
-    def report_failure(self, message: str):
+    @timed
+    def report_skipped(self, message: str = "", job_id: Optional[int] = None):
         """
-        Mark the job as failed.
+        Mark the job as skipped. Defaults to the current job.
         """
-        query = """
-        SELECT bnp.report_processing_failure(%s, %s, %s);
+        job_id = self._resolve_job_id(job_id)
+        self._report("bnp.report_processing_skipped", job_id, message)
+        self._forget_job(job_id)
+
+    @timed
+    def report_failure(self, message: str, job_id: Optional[int] = None):
+        """
+        Mark the job as failed. Defaults to the current job.
         """
-        with self.connection.cursor() as cur:
-            cur.execute(query, (self.processor_id, self.current_job_id, message))
-            self.connection.commit()
+        job_id = self._resolve_job_id(job_id)
+        self._report("bnp.report_processing_failure", job_id, message)
 
     # Tracing interface to get full traceability on the processing
-    def store_log_message(self, message: str) -> None:
-        """Stores a log message in the bnp.log table."""
+    @timed
+    def store_log_message(self, message: str, job_id: Optional[int] = None) -> None:
+        """
+        Stores a log message in the bnp.log table.
+
+        Raises BNPStaleLeaseException when the job was reclaimed by another
+        worker. Buffered and outboxed messages of such jobs are dropped at flush
+        instead.
+        """
         query = """
-            SELECT bnp.store_log_message(%s, %s);
+            SELECT bnp.store_log_message(%s, %s, %s) AS stored;
         """
-        if not self.current_job_id:
+        job_id = self._resolve_job_id(job_id)
+        if not job_id:
             raise BNPDriverException(
                 "Current Job is either already reported or never started."
             )
-        with self.connection.cursor() as cur:
-            cur.execute(query, (self.current_job_id, message))
-            self.connection.commit()
+        lease_token = self._lease_token(job_id)
+        if self.log_buffer is not None:
+            self.log_buffer.put(job_id, message, lease_token=lease_token)
+            return
+        if self.outbox is not None:
+            # Goes through the outbox when the database is or was unavailable
+            self._insert_log_rows(
+                [(job_id, message, datetime.now(timezone.utc), lease_token)]
+            )
+            return
+        # A retried log message is at worst stored twice
+        rows = self._query(
+            query, (job_id, message, lease_token), prepared="bnp_store_log_message"
+        )
+        stored = rows[0]["stored"]
+        if not stored:
+            self.metrics.inc("stale_leases")
+            self._lease_lost(job_id)
+            raise BNPStaleLeaseException(
+                f"Lease token {lease_token} of job {job_id} is stale, the job was released or reclaimed"
+            )
+
+    def _insert_log_rows(self, rows: List[LogRow]) -> None:
+        """
+        Write buffered log rows to bnp.log, or defer them to the outbox when it
+        has pending calls or the database is unavailable.
+        """
+        if self.outbox is not None:
+            if not len(self.outbox):
+                try:
+                    self._write_log_rows(rows)
+                    return
+                except (psycopg2.Error, BNPCircuitOpenException) as e:
+                    if not self._is_outage(e):
+                        raise
+                    log.warning(
+                        f"store_log_message: Database unavailable, {len(rows)} log rows deferred to the outbox. {type(e).__name__}: {e}"
+                    )
+            self._defer_log_rows(rows)
+            return
+        self._write_log_rows(rows)
+
+    def _defer_log_rows(self, rows: List[LogRow]) -> None:
+        self.outbox.append(
+            {
+                "call": "log",
+                "rows": [
+                    (job_id, message, ts.isoformat(), lease_token)
+                    for job_id, message, ts, lease_token in rows
+                ],
+            }
+        )
+
+    def _write_log_rows(self, rows: List[LogRow]) -> None:
+        """
+        Write log rows to bnp.log in a single multi-row insert. Rows whose lease
+        token is stale, and rows already stored by an earlier attempt, are skipped.
+        """
+        query = """
+            INSERT INTO bnp.log (job_id, message, ts)
+            SELECT v.job_id, v.message, v.ts
+            FROM (VALUES %s) AS v (job_id, message, ts, lease_token)
+            WHERE (
+                v.lease_token IS NULL
+                OR EXISTS (
+                    SELECT 1
+                    FROM bnp.process_executions pe
+                    WHERE pe.id = v.job_id
+                      AND pe.lease_token = v.lease_token
+                )
+            )
+            AND NOT EXISTS (
+                SELECT 1
+                FROM bnp.log l
+                WHERE l.job_id = v.job_id
+                  AND l.ts = v.ts
+                  AND l.message = v.message
+            );
+        """
+        self._run(
+            lambda cur: execute_values(
+                cur,
+                query,
+                rows,
+                template="(%s, %s, %s::timestamptz, %s::bigint)",
+                page_size=len(rows),
+            )
+        )
+
+    def flush_logs(self) -> None:
+        """Write any buffered log messages to the database now."""
+        if self.log_buffer is not None:
+            self.log_buffer.flush()
+
+    def _get_listen_connection(self):
+        """
+        Dedicated connection that LISTENs for new jobs and processor changes,
+        opened on first use.
+        """
+        if self._listen_connection is None or self._listen_connection.closed:
+            conn = psycopg2.connect(**self._connect_kwargs)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {JOB_NOTIFY_CHANNEL};")
+                cur.execute(f"LISTEN {PROCESSOR_NOTIFY_CHANNEL};")
+            self._listen_connection = conn
+        return self._listen_connection
+
+    def _take_processor_notifies(self, conn) -> bool:
+        """
+        Take the processor notifies out of conn.notifies, keep job notifies.
+        Returns whether bnp.processors changed. Called with _listen_lock, the
+        caller invalidates the processor cache once it released it, as loading
+        the cache takes _listen_lock.
+        """
+        changed = [n for n in conn.notifies if n.channel == PROCESSOR_NOTIFY_CHANNEL]
+        if changed:
+            conn.notifies[:] = [
+                n for n in conn.notifies if n.channel != PROCESSOR_NOTIFY_CHANNEL
+            ]
+        return bool(changed)
+
+    def _poll_processor_notifies(self) -> None:
+        """Read pending notifications without blocking, no round trip."""
+        with self._listen_lock:
+            conn = self._listen_connection
+            if conn is None or conn.closed:
+                return
+            try:
+                conn.poll()
+            except psycopg2.Error as e:
+                log.warning(
+                    f"Processor cache: LISTEN connection lost, relying on the TTL. {type(e).__name__}: {e}"
+                )
+                conn.close()
+                return
+            changed = self._take_processor_notifies(conn)
+        if changed:
+            self.processor_cache.invalidate()
+
+    def _load_processors(self) -> List[dict]:
+        try:
+            with self._listen_lock:
+                # LISTEN before reading, so that no change goes unnoticed
+                self._get_listen_connection()
+        except psycopg2.Error as e:
+            log.warning(
+                f"Processor cache: LISTEN failed, relying on the TTL. {type(e).__name__}: {e}"
+            )
+        try:
+            rows = self._query(
+                "SELECT * FROM bnp.processors ORDER BY id;",
+                (),
+                cursor_factory=RealDictCursor,
+            )
+        except psycopg2.Error as e:
+            if e.pgcode != UNDEFINED_TABLE_PGCODE:
+                raise
+            return list(PROCESSORS)  # Schema without the registry
+        return [processor_from_row(row) for row in rows]
+
+    def processor_config(self, processor_id: Optional[int] = None) -> dict:
+        """
+        The registry entry of processor_id (default: the driver's processor), the
+        columns of bnp.processors merged with its config, {} if it has none.
+        Served from the processor cache, without a round trip in most calls.
+        """
+        self._poll_processor_notifies()
+        processor = self.processor_cache.get(
+            self.processor_id if processor_id is None else processor_id
+        )
+        return dict(processor) if processor else {}
+
+    def wait_for_job(self, timeout: float = 60.0) -> bool:
+        """
+        Block until new work may be available, or until timeout seconds passed.
+
+        Returns True when woken by a notification on the bnp_new_jobs channel and
+        False on timeout. Either way the caller should just try get_next_job
+        again, the timeout doubles as a polling fallback in case a notification
+        was missed. Notifications that arrived while the worker was busy make the
+        next call return immediately, as do prefetched jobs.
+        """
+        with self._prefetch_lock:
+            if self._prefetched:
+                return True
+        try:
+            with self._listen_lock:
+                conn = self._get_listen_connection()
+                changed = self._take_processor_notifies(conn)
+            if changed:
+                self.processor_cache.invalidate()
+            if not conn.notifies:
+                if select.select([conn], [], [], timeout) == ([], [], []):
+                    return False
+                with self._listen_lock:
+                    conn.poll()
+                    changed = self._take_processor_notifies(conn)
+                if changed:
+                    self.processor_cache.invalidate()
+            woken = bool(conn.notifies)
+            conn.notifies.clear()
+            return woken
+        except psycopg2.Error as e:
+            log.warning(
+                f"wait_for_job: LISTEN failed, falling back to polling. {type(e).__name__}: {e}"
+            )
+            if self._listen_connection is not None:
+                self._listen_connection.close()
+            time.sleep(timeout)
+            return False
+
+    @timed
+    def is_power_on(self) -> bool:
+        """Whether the power switch in bnp.globals allows claiming jobs."""
+        rows = self._query("SELECT bnp.is_power_on();", ())
+        return bool(rows and rows[0][0])
+
+    @timed
+    def queue_depth(self, src_pattern: str = "MSIL1C", limit: int = 100) -> int:
+        """
+        Estimate the claimable jobs (new products and expired leases), counting
+        up to limit only. Cheaper than a claim, nothing is locked.
+        """
+        function = "job_queue_depth" if self.job_queue else "queue_depth"
+        rows = self._query(
+            f"SELECT bnp.{function}(%s, %s, %s);",
+            (self.processor_id, src_pattern, limit),
+        )
+        return rows[0][0] if rows and rows[0][0] is not None else 0
 
+    @timed
     def get_processed_products_by_worker(self, worker_id: str) -> List[dict]:
         """Retrieves products processed by a specific worker."""
         query = """
             SELECT * FROM bnp.get_processed_products_by_worker(%s);
         """
-        with self.connection.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query, (worker_id,))
-            return cur.fetchall()
+        return self._query(query, (worker_id,), cursor_factory=RealDictCursor)
 
+    @timed
     def get_logs_for_product(self, l1c_source: str) -> List[dict]:
         """Retrieves logs for a specific L1C product."""
         query = """
             SELECT * FROM bnp.get_logs_for_product(%s);
         """
-        with self.connection.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query, (l1c_source,))
-            return cur.fetchall()
+        return self._query(query, (l1c_source,), cursor_factory=RealDictCursor)
+
+    def stats(self) -> dict:
+        """
+        Latency histograms per method (count, sum, max, p50/p95/p99 in seconds and
+        cumulative buckets), event counters and the current queue gauges.
+        """
+        with self._in_flight_lock:
+            in_flight = len(self._in_flight)
+        with self._prefetch_lock:
+            prefetched = len(self._prefetched)
+        return self.metrics.stats(
+            gauges={
+                "in_flight_jobs": in_flight,
+                "prefetched_jobs": prefetched,
+                "outbox_pending": len(self.outbox) if self.outbox is not None else 0,
+                "circuit_breaker_open": int(self.circuit_state != "closed"),
+            }
+        )
 
     def close(self) -> None:
         """
-        Close the database connection.
+        Close the database connection, or all pooled connections.
         """
-        self.connection.close()
+        self._stop_prefetching()
+        self._stop_heartbeat.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+        if self.log_buffer is not None:
+            try:
+                self.log_buffer.close()
+            except Exception as e:
+                log.warning(
+                    f"close: Flushing {len(self.log_buffer)} buffered log rows failed. {type(e).__name__}: {e}"
+                )
+        if self.outbox is not None:
+            try:
+                self.replay_outbox()
+            except Exception as e:
+                log.warning(f"close: Outbox replay failed. {type(e).__name__}: {e}")
+            if len(self.outbox):
+                log.warning(
+                    f"close: {len(self.outbox)} calls left in {self.outbox.path}, they are replayed on the next start."
+                )
+            self.outbox.close()
+        if self._listen_connection is not None:
+            self._listen_connection.close()
+        if self.pool is not None:
+            self.pool.closeall()
+        else:
+            with self._connection_lock:
+                self.connection.close()
@@ -11,6 +11,14 @@ class BNPDriverProtocol(Protocol):
         """Fetch the next available job for the given processor."""
         pass
 
+    def get_next_jobs(self, n: int, src_pattern: str) -> List[Tuple[int, str]]:
+        """Claim up to n jobs for the given processor in one go."""
+        pass
+
+    def get_next_scheduled_job(self, processor_ids: Optional[List[int]] = None):
+        """Claim a job of any of processor_ids, weighted by their priority."""
+        pass
+
     @property
     def current_job() -> Tuple[Optional[int], Optional[str]]:
         pass
@@ -19,22 +27,50 @@ class BNPDriverProtocol(Protocol):
     def worker_id() -> Optional[str]:
         pass
 
-    def report_finished(self, dst_path: str) -> None:
+    def report_finished(self, dst_path: str, job_id: Optional[int] = None) -> None:
         """Mark the job as finished."""
         pass
 
-    def report_failure(self, message: str) -> None:
+    def report_failure(self, message: str, job_id: Optional[int] = None) -> None:
         """Mark the job as failed."""
         pass
 
-    def report_skipped(self, message: str) -> None:
+    def report_skipped(self, message: str, job_id: Optional[int] = None) -> None:
         """Mark the job as skipped"""
         pass
 
-    def store_log_message(self, message: str) -> None:
+    def store_log_message(self, message: str, job_id: Optional[int] = None) -> None:
         """Store a log message for the given job."""
         pass
 
+    def release_job(self, job_id: Optional[int] = None) -> bool:
+        """Give a claimed job back to the queue without reporting it."""
+        pass
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Stop claiming, wait for in-flight jobs and release what is left."""
+        pass
+
+    def wait_for_job(self, timeout: float) -> bool:
+        """Block until new work may be available or timeout seconds passed."""
+        pass
+
+    def processor_config(self, processor_id: Optional[int] = None) -> dict:
+        """The registry entry of a processor, {} if it is unknown."""
+        pass
+
+    def is_power_on(self) -> bool:
+        """Whether the power switch allows claiming jobs."""
+        pass
+
+    def queue_depth(self, src_pattern: str = "MSIL1C", limit: int = 100) -> int:
+        """Estimate the claimable jobs, counting up to limit only."""
+        pass
+
+    def stats(self) -> dict:
+        """Latency histograms per method, event counters and gauges."""
+        pass
+
     def get_processed_products_by_worker(self, worker_id: str) -> List[dict]:
         """Retrieve products processed by a specific worker."""
         pass
@@ -46,3 +82,69 @@ class BNPDriverProtocol(Protocol):
     def close(self) -> None:
         """Close the connection."""
         pass
+
+
+class AsyncBNPDriverProtocol(Protocol):
+    """Async variant of BNPDriverProtocol, every call is awaited."""
+
+    def __init__(self, **kwargs):
+        """Flexible initialization for different drivers."""
+        pass
+
+    async def get_next_job(
+        self, src_pattern: str
+    ) -> Tuple[Optional[int], Optional[str]]:
+        """Fetch the next available job for the given processor."""
+        pass
+
+    async def get_next_jobs(self, n: int, src_pattern: str) -> List[Tuple[int, str]]:
+        """Claim up to n jobs for the given processor in one go."""
+        pass
+
+    @property
+    def current_job() -> Tuple[Optional[int], Optional[str]]:
+        pass
+
+    @property
+    def worker_id() -> Optional[str]:
+        pass
+
+    async def report_finished(
+        self, dst_path: str, job_id: Optional[int] = None
+    ) -> None:
+        """Mark the job as finished."""
+        pass
+
+    async def report_failure(self, message: str, job_id: Optional[int] = None) -> None:
+        """Mark the job as failed."""
+        pass
+
+    async def report_skipped(self, message: str, job_id: Optional[int] = None) -> None:
+        """Mark the job as skipped"""
+        pass
+
+    async def store_log_message(
+        self, message: str, job_id: Optional[int] = None
+    ) -> None:
+        """Store a log message for the given job."""
+        pass
+
+    async def release_job(self, job_id: Optional[int] = None) -> bool:
+        """Give a claimed job back to the queue without reporting it."""
+        pass
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """Stop claiming, wait for claimed jobs and release what is left."""
+        pass
+
+    async def get_processed_products_by_worker(self, worker_id: str) -> List[dict]:
+        """Retrieve products processed by a specific worker."""
+        pass
+
+    async def get_logs_for_product(self, l1c_source: str) -> List[dict]:
+        """Retrieve logs for a specific L1C product."""
+        pass
+
+    async def close(self) -> None:
+        """Close the connection."""
+        pass
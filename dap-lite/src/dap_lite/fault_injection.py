@@ -0,0 +1,160 @@
+import json
+import math
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from dap_lite.driver import BNPDriverException
+
+# Keys of a method spec, missing ones are taken from the "default" spec
+SPEC_DEFAULTS = {
+    "latency": 0.0,
+    "error_rate": 0.0,
+    "drop_rate": 0.0,
+    "conflict_rate": 0.0,
+}
+
+Latency = Union[float, Dict[str, Union[str, float]]]
+
+
+class InjectedQueryError(BNPDriverException):
+    """An injected error the database answered with, the call is not retried."""
+
+
+class InjectedConnectionError(BNPDriverException):
+    """An injected connection drop, raised before the call reached the store."""
+
+
+def sample_latency(latency: Optional[Latency], rng: random.Random) -> float:
+    """
+    Seconds drawn from a latency spec: a number (constant), or a dict with dist
+    "constant" (value), "uniform" (low, high), "exponential" (mean) or
+    "lognormal" (median, sigma), capped at max if given.
+    """
+    if latency is None:
+        return 0.0
+    if isinstance(latency, (int, float)):
+        return float(latency)
+    dist = latency.get("dist", "constant")
+    if dist == "constant":
+        value = latency.get("value", 0.0)
+    elif dist == "uniform":
+        value = rng.uniform(latency.get("low", 0.0), latency["high"])
+    elif dist == "exponential":
+        value = rng.expovariate(1 / latency["mean"])
+    elif dist == "lognormal":
+        value = rng.lognormvariate(
+            math.log(latency["median"]), latency.get("sigma", 0.5)
+        )
+    else:
+        raise ValueError(f"Unknown latency distribution: {dist}")
+    return max(0.0, min(value, latency.get("max", math.inf)))
+
+
+class FaultProfile:
+    """
+    Latency distributions and fault rates per driver method, for the mock driver.
+
+    profile maps method names (get_next_job, get_next_jobs, report_finished,
+    store_log_message, ...) to specs, "default" holds the spec of all methods and
+    is overridden key by key. A spec has:
+
+        latency        seconds, or a distribution, see sample_latency
+        error_rate     chance that the call fails with InjectedQueryError
+        drop_rate      chance that the connection drops (InjectedConnectionError)
+        conflict_rate  claims only, chance that another worker takes one of the
+                       jobs first, the claim returns one job less
+
+    "outages" lists [start, duration] windows, in seconds after a driver was
+    created, during which every call drops. "seed" (default 0) fixes all random
+    draws, seed overrides it.
+    """
+
+    def __init__(self, profile: Optional[dict] = None, seed: Optional[int] = None):
+        profile = dict(profile or {})
+        profile_seed = profile.pop("seed", 0)
+        self.seed: int = profile_seed if seed is None else seed
+        self.outages: List[Tuple[float, float]] = [
+            (float(start), float(duration))
+            for start, duration in profile.pop("outages", [])
+        ]
+        self.default = {**SPEC_DEFAULTS, **profile.pop("default", {})}
+        self.specs = {
+            method: {**self.default, **spec} for method, spec in profile.items()
+        }
+        rng = random.Random(0)
+        for method, spec in [("default", self.default), *self.specs.items()]:
+            unknown = set(spec) - set(SPEC_DEFAULTS)
+            if unknown:
+                raise ValueError(
+                    f"Fault profile of {method}: Unknown keys {sorted(unknown)}"
+                )
+            sample_latency(spec["latency"], rng)
+
+    @classmethod
+    def load(cls, path: str, seed: Optional[int] = None) -> "FaultProfile":
+        """Read a profile from a JSON file."""
+        with open(path) as f:
+            return cls(json.load(f), seed=seed)
+
+    def spec(self, method: str) -> dict:
+        return self.specs.get(method, self.default)
+
+
+class FaultInjector:
+    """
+    Draws the latencies and faults of one driver from a FaultProfile.
+
+    The random generator is seeded with the profile's seed and the worker id, so
+    a worker sees the same latencies and faults for the same sequence of calls
+    in every run, whatever the other workers do. Drivers shared by several
+    threads (pooled mode) draw in the order the threads call.
+    """
+
+    def __init__(
+        self,
+        profile: FaultProfile,
+        worker_id: str,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.profile = profile
+        self.sleep = sleep
+        self.rng = random.Random(f"{profile.seed}:{worker_id}")
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def in_outage(self) -> bool:
+        elapsed = time.monotonic() - self._started
+        return any(
+            start <= elapsed < start + duration
+            for start, duration in self.profile.outages
+        )
+
+    def before(self, method: str) -> None:
+        """Sleep for the latency of method, then raise its fault, if one is drawn."""
+        spec = self.profile.spec(method)
+        with self._lock:
+            latency = sample_latency(spec["latency"], self.rng)
+            draw = self.rng.random()
+        if latency:
+            self.sleep(latency)
+        if self.in_outage():
+            raise InjectedConnectionError(f"{method}: Injected database outage")
+        if draw < spec["drop_rate"]:
+            raise InjectedConnectionError(f"{method}: Injected connection drop")
+        if draw < spec["drop_rate"] + spec["error_rate"]:
+            raise InjectedQueryError(f"{method}: Injected query error")
+
+    def conflict(self, method: str) -> bool:
+        """Whether a claim of method loses a job to another worker."""
+        rate = self.profile.spec(method)["conflict_rate"]
+        if not rate:
+            return False
+        with self._lock:
+            return self.rng.random() < rate
+
+    def backoff_delay(self, attempt: int, base: float, cap: float) -> float:
+        """circuit_breaker.backoff_delay, with the jitter drawn from the seed."""
+        with self._lock:
+            return self.rng.uniform(0, min(cap, base * 2**attempt))
@@ -0,0 +1,104 @@
+from typing import Optional
+
+
+class JobHandle:
+    """
+    A claimed job bound to the driver that claimed it.
+
+    Returned by the drivers in pooled mode, where several jobs can be in flight at
+    the same time and the driver therefore has no single "current job". A handle
+    still unpacks like the (job_id, src_uri) tuple of the single job API:
+
+        job = driver.get_next_job()
+        job_id, src_uri = job
+        if job:
+            job.store_log_message("Started")
+            job.report_finished("s3://bucket/path")
+
+    lease_token is the fencing token handed out with the claim. The driver sends it
+    with every report, which the database rejects once the job has been reclaimed
+    by another worker. lease_lost is set when the driver notices that earlier.
+    reported is set once one of the report methods of the handle was called.
+    processor_id is the processor the job belongs to, set by scheduled claims.
+    """
+
+    def __init__(
+        self,
+        driver,
+        job_id: Optional[int],
+        src_uri: Optional[str],
+        lease_token: Optional[int] = None,
+        processor_id: Optional[int] = None,
+    ):
+        self.driver = driver
+        self.job_id = job_id
+        self.src_uri = src_uri
+        self.lease_token = lease_token
+        self.processor_id = processor_id
+        self.lease_lost = False
+        self.reported = False
+
+    def __iter__(self):
+        return iter((self.job_id, self.src_uri))
+
+    def __bool__(self) -> bool:
+        return self.job_id is not None
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(job_id={self.job_id}, src_uri={self.src_uri!r})"
+
+    def report_finished(self, dst_path: str = "s3://dummy/path") -> None:
+        """Mark the job as finished."""
+        self.driver.report_finished(dst_path, job_id=self.job_id)
+        self.reported = True
+
+    def report_failure(self, message: str) -> None:
+        """Mark the job as failed."""
+        self.driver.report_failure(message, job_id=self.job_id)
+        self.reported = True
+
+    def report_skipped(self, message: str = "") -> None:
+        """Mark the job as skipped."""
+        self.driver.report_skipped(message, job_id=self.job_id)
+        self.reported = True
+
+    def store_log_message(self, message: str) -> None:
+        """Store a log message for this job."""
+        self.driver.store_log_message(message, job_id=self.job_id)
+
+    def release(self) -> bool:
+        """Give the job back to the queue without reporting it."""
+        return self.driver.release_job(job_id=self.job_id)
+
+
+class AsyncJobHandle(JobHandle):
+    """
+    JobHandle for the async drivers, the report methods are coroutines.
+
+        job = await driver.get_next_job()
+        if job:
+            await job.report_finished("s3://bucket/path")
+    """
+
+    async def report_finished(self, dst_path: str = "s3://dummy/path") -> None:
+        """Mark the job as finished."""
+        await self.driver.report_finished(dst_path, job_id=self.job_id)
+        self.reported = True
+
+    async def report_failure(self, message: str) -> None:
+        """Mark the job as failed."""
+        await self.driver.report_failure(message, job_id=self.job_id)
+        self.reported = True
+
+    async def report_skipped(self, message: str = "") -> None:
+        """Mark the job as skipped."""
+        await self.driver.report_skipped(message, job_id=self.job_id)
+        self.reported = True
+
+    async def store_log_message(self, message: str) -> None:
+        """Store a log message for this job."""
+        await self.driver.store_log_message(message, job_id=self.job_id)
+
+    async def release(self) -> bool:
+        """Give the job back to the queue without reporting it."""
+        return await self.driver.release_job(job_id=self.job_id)
@@ -0,0 +1,121 @@
+import threading
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+from .logger import log
+
+# (job_id, message, client timestamp, lease token or None)
+LogRow = Tuple[int, str, datetime, Optional[int]]
+
+
+class LogBuffer:
+    """
+    Collects (job_id, message, client timestamp, lease token) log rows and hands
+    them to flush_fn in bulk, from a background thread.
+
+    A flush happens when max_size rows are queued, every flush_interval seconds,
+    and whenever flush() or close() is called. Rows that fail to flush are put
+    back in front of the queue and retried on the next flush, so ordering per job
+    is kept. At most max_pending rows are kept while flushes fail (e.g. during a
+    database outage), beyond that the oldest rows are dropped with a warning.
+    """
+
+    def __init__(
+        self,
+        flush_fn: Callable[[List[LogRow]], None],
+        max_size: int = 100,
+        flush_interval: float = 2.0,
+        max_pending: int = 10000,
+    ):
+        self.flush_fn = flush_fn
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._rows: List[LogRow] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="bnp-log-buffer", daemon=True
+        )
+        self._thread.start()
+
+    def put(
+        self,
+        job_id: int,
+        message: str,
+        ts: Optional[datetime] = None,
+        lease_token: Optional[int] = None,
+    ) -> None:
+        """Queue a log row, the timestamp defaults to now."""
+        with self._lock:
+            self._rows.append(
+                (job_id, message, ts or datetime.now(timezone.utc), lease_token)
+            )
+            self._drop_oldest()
+            full = len(self._rows) >= self.max_size
+        if full:
+            self._wakeup.set()
+
+    def _drop_oldest(self) -> None:
+        """Drop the rows beyond max_pending, oldest first. Called with the lock."""
+        excess = len(self._rows) - self.max_pending
+        if excess <= 0:
+            return
+        del self._rows[:excess]
+        self.dropped += excess
+        # Warn on the first drop and then every 1000 rows, not on every put
+        if (
+            self.dropped != excess
+            and self.dropped // 1000 == (self.dropped - excess) // 1000
+        ):
+            return
+        log.warning(
+            f"LogBuffer: {len(self._rows)} log rows pending, dropped the {excess} oldest ({self.dropped} in total)."
+        )
+
+    def take(self) -> List[LogRow]:
+        """Remove and return all queued rows, without flushing them."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+        return rows
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self) -> None:
+        """Write all queued rows now. Raises if flush_fn fails."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return
+            try:
+                self.flush_fn(rows)
+            except Exception:
+                with self._lock:
+                    self._rows[:0] = rows
+                    self._drop_oldest()
+                raise
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning(
+                    f"LogBuffer: Failed to flush {len(self)} log rows, will retry. {type(e).__name__}: {e}"
+                )
+
+    def close(self) -> None:
+        """Stop the background thread and flush what is left."""
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
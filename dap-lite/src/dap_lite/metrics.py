@@ -0,0 +1,232 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds of the latency histogram buckets, a last +Inf bucket is
+# implied. They span in-memory hand outs (prefetch, mock) up to claims that queue
+# behind a busy database.
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+COUNTERS = {
+    "claimed_jobs": "Jobs claimed from the queue.",
+    "empty_claims": "Claims that found no job.",
+    "claim_conflicts": "Products another worker created a job for first during a claim.",
+    "stale_leases": "Reports and log messages rejected because the lease token was stale.",
+    "retries": "Calls retried after a lost connection.",
+    "connection_errors": "Lost or refused database connections.",
+    "circuit_open": "Calls rejected because the circuit breaker was open.",
+}
+
+PROMETHEUS_PREFIX = "bnp_driver"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Latency histogram with fixed bucket bounds, not thread safe on its own."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate the q quantile by linear interpolation inside its bucket, like
+        histogram_quantile() in Prometheus. Values beyond the last bound are
+        estimated as the largest observed value.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.bounds, self.counts):
+            if count and seen + count >= rank:
+                return min(lower + (bound - lower) * (rank - seen) / count, self.max)
+            seen += count
+            lower = bound
+        return self.max
+
+    def snapshot(self) -> dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class DriverMetrics:
+    """
+    Thread safe latency histograms per driver method and event counters, see
+    COUNTERS. stats() returns a snapshot as plain dicts.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def observe(self, method: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(method)
+            if histogram is None:
+                histogram = self._histograms[method] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def inc(self, counter: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + n
+
+    @contextmanager
+    def timer(self, method: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(method, time.perf_counter() - start)
+
+    def stats(self, gauges: Optional[Dict[str, float]] = None) -> dict:
+        with self._lock:
+            return {
+                "latency": {
+                    method: histogram.snapshot()
+                    for method, histogram in sorted(self._histograms.items())
+                },
+                "counters": dict(self._counters),
+                "gauges": dict(gauges or {}),
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters = dict.fromkeys(COUNTERS, 0)
+
+
+def timed(method: Callable) -> Callable:
+    """Record the latency of a driver method in the driver's metrics."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.metrics.timer(method.__name__):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def format_prometheus(
+    stats: dict,
+    labels: Optional[Dict[str, str]] = None,
+    prefix: str = PROMETHEUS_PREFIX,
+) -> str:
+    """Render a stats() snapshot in the Prometheus text exposition format."""
+    labels = dict(labels or {})
+    lines: List[str] = []
+    name = f"{prefix}_call_duration_seconds"
+    lines.append(f"# HELP {name} Latency of driver calls.")
+    lines.append(f"# TYPE {name} histogram")
+    for method, histogram in stats["latency"].items():
+        method_labels = dict(labels, method=method)
+        for bound, count in histogram["buckets"].items():
+            bucket_labels = _labels(dict(method_labels, le=_bound(bound)))
+            lines.append(f"{name}_bucket{bucket_labels} {count}")
+        lines.append(f"{name}_sum{_labels(method_labels)} {histogram['sum']!r}")
+        lines.append(f"{name}_count{_labels(method_labels)} {histogram['count']}")
+    for counter, value in stats["counters"].items():
+        name = f"{prefix}_{counter}_total"
+        lines.append(f"# HELP {name} {COUNTERS.get(counter, counter)}")
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_labels(labels)} {value}")
+    for gauge, value in stats["gauges"].items():
+        name = f"{prefix}_{gauge}"
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def start_prometheus_exporter(
+    driver, port: int = 9464, addr: str = ""
+) -> ThreadingHTTPServer:
+    """
+    Serve driver.stats() in the Prometheus text format on http://addr:port/metrics
+    from a daemon thread. Call shutdown() on the returned server to stop it.
+    """
+    labels = {
+        "driver_type": driver.driver_type,
+        "worker_id": driver.worker_id,
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = format_prometheus(driver.stats(), labels).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scraped every few seconds, keep it out of the worker log
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    threading.Thread(
+        target=server.serve_forever, name="bnp-metrics", daemon=True
+    ).start()
+    return server
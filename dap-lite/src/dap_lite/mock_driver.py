@@ -1,10 +1,36 @@
 from enum import Enum
 import os
 import logging
-from typing import Tuple, Optional, List, Dict
+import threading
+import time
+from typing import Any, Callable, Tuple, Optional, List, Dict, Union
 
 # Configure logging
+from .circuit_breaker import CircuitBreaker
+from .constants import PROCESSORS
+from .driver import BNPCircuitOpenException
+from .fault_injection import (
+    FaultInjector,
+    FaultProfile,
+    InjectedConnectionError,
+    InjectedQueryError,
+)
+from .job_handle import JobHandle
+from .log_buffer import LogBuffer, LogRow
 from .logger import log
+from .metrics import DriverMetrics, timed
+from .mock_store import MockStore, tile_of
+
+DEFAULT_SRC_URIS = [
+    "s3://eodata-sentinel2-s2msi1c-2024/9/15/S2B_MSIL1C_20240915T102559_N0511_R108_T33WXQ_20240915T123129.SAFE",
+    "s3://eodata-sentinel2-s2msi1c-2024/9/15/S2B_MSIL1C_20240915T102559_N0511_R108_T33VVH_20240915T123129.SAFE",
+    "s3://eodata-sentinel2-s2msi1c-2024/9/15/S2B_MSIL1C_20240915T102559_N0511_R108_T33VVJ_20240915T123129.SAFE",
+    "s3://eodata-sentinel2-s2msi1c-2024/9/15/S2B_MSIL1C_20240915T102559_N0511_R108_T33VWJ_20240915T123129.SAFE",
+    "s3://eodata-sentinel2-s2msi1c-2024/9/15/S2B_MSIL1C_20240915T102559_N0511_R108_T33VWH_20240915T123129.SAFE",
+    "s3://eodata-sentinel2-s2msi1c-2023/8/19/S2B_MSIL1C_20230819T101609_N0509_R065_T33VUC_20230819T123928.SAFE",
+    "s3://eodata-sentinel2-s2msi1c-2023/7/8/S2A_MSIL1C_20230708T102601_N0509_R108_T33VUC_20230708T141205.SAFE",
+    "s3://eodata-sentinel2-s2msi1c-2022/7/20/S2A_MSIL1C_20220720T101611_N0400_R065_T33VUC_20220720T140828.SAFE",
+]
 
 
 def get_worker_id() -> str:
@@ -22,61 +48,242 @@ class JobAction(Enum):
 
 
 class BNPDriver:
+    """
+    In-memory stand-in for the DB driver, see MockStore.
+
+    With fault_profile (a FaultProfile, its dict or the path of a JSON file) every
+    call first sleeps for a latency drawn from the profile and may fail: dropped
+    connections are retried like the DB driver does (retry_attempts,
+    retry_base_delay, retry_max_delay) and open a circuit breaker
+    (breaker_threshold, breaker_reset_timeout), injected query errors are raised
+    and claims can lose jobs to conflicts. fault_seed overrides the seed of a
+    profile dict or file. buffered_logging, log_buffer_size and log_flush_interval
+    work like in the DB driver.
+    """
 
     def __init__(self, **kwargs):  # noqa
         """Initialize the mock driver with mock job data."""
         self.driver_type="MOCK"
-        self.mock_jobs: List[Dict[str, Optional[str]]] = [
-            {
-                "job_id": idx + 1,  # Assign unique job IDs starting from 1
-                "src_uri": src_uri,
-                "status": "pending",
-            }
-            for idx, src_uri in enumerate(
-                [
-                    "s3://eodata-sentinel2-s2msi1c-2024/9/15/S2B_MSIL1C_20240915T102559_N0511_R108_T33WXQ_20240915T123129.SAFE",
-                    "s3://eodata-sentinel2-s2msi1c-2024/9/15/S2B_MSIL1C_20240915T102559_N0511_R108_T33VVH_20240915T123129.SAFE",
-                    "s3://eodata-sentinel2-s2msi1c-2024/9/15/S2B_MSIL1C_20240915T102559_N0511_R108_T33VVJ_20240915T123129.SAFE",
-                    "s3://eodata-sentinel2-s2msi1c-2024/9/15/S2B_MSIL1C_20240915T102559_N0511_R108_T33VWJ_20240915T123129.SAFE",
-                    "s3://eodata-sentinel2-s2msi1c-2024/9/15/S2B_MSIL1C_20240915T102559_N0511_R108_T33VWH_20240915T123129.SAFE",
-                    "s3://eodata-sentinel2-s2msi1c-2023/8/19/S2B_MSIL1C_20230819T101609_N0509_R065_T33VUC_20230819T123928.SAFE",
-                    "s3://eodata-sentinel2-s2msi1c-2023/7/8/S2A_MSIL1C_20230708T102601_N0509_R108_T33VUC_20230708T141205.SAFE",
-                    "s3://eodata-sentinel2-s2msi1c-2022/7/20/S2A_MSIL1C_20220720T101611_N0400_R065_T33VUC_20220720T140828.SAFE",
-                ]
-            )
-        ]
-        self.logs: List[Dict[str, Optional[str]]] = []
+        self.metrics = DriverMetrics()
+        # Job queue and logs, pass the same store (or a MockStoreManager proxy of
+        # one) to several drivers to let them share the jobs
+        self.store = kwargs.get("store")
+        if self.store is None:
+            self.store = MockStore(kwargs.get("src_uris") or DEFAULT_SRC_URIS)
         self.current_job_id: Optional[int] = None
         self.current_src_path: Optional[str] = None
         self.current_job_id_and_url: Tuple[Optional[int], Optional[str]] = None, None
-        self.current_worker_id: str = get_worker_id()
+        self.current_worker_id: str = kwargs.get("worker_id") or get_worker_id()
         self.current_processor_id: int = kwargs.get("processor_id", 1)
+        # Mirrors the pooled mode of the DB driver, jobs are returned as JobHandle
+        self.pooled: bool = bool(kwargs.get("pool_size"))
+        self._lock = threading.Lock()
+        self.draining = False
+        self.processor_ids: Optional[List[int]] = kwargs.get("processor_ids")
+        # Jobs claimed per processor by get_next_scheduled_job
+        self._scheduled: Dict[int, int] = {}
+        # Mirrors the power switch in bnp.globals, see is_power_on
+        self.power_on: bool = kwargs.get("power_on", True)
+        # Prefer jobs of last_tile, like the DB driver (tile buckets are not mocked)
+        self.tile_affinity: bool = kwargs.get("tile_affinity", False) or bool(
+            kwargs.get("tile_buckets")
+        )
+        self.last_tile: Optional[str] = None
+        self.faults: Optional[FaultInjector] = None
+        fault_profile = kwargs.get("fault_profile")
+        if isinstance(fault_profile, str):
+            fault_profile = FaultProfile.load(fault_profile, kwargs.get("fault_seed"))
+        elif isinstance(fault_profile, dict):
+            fault_profile = FaultProfile(fault_profile, kwargs.get("fault_seed"))
+        if fault_profile is not None:
+            self.faults = FaultInjector(fault_profile, self.current_worker_id)
+        self.retry_attempts: int = kwargs.get("retry_attempts", 5)
+        self.retry_base_delay: float = kwargs.get("retry_base_delay", 0.5)
+        self.retry_max_delay: float = kwargs.get("retry_max_delay", 30.0)
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=kwargs.get("breaker_threshold", 5),
+            reset_timeout=kwargs.get("breaker_reset_timeout", 30.0),
+        )
+        self.log_buffer: Optional[LogBuffer] = None
+        if kwargs.get("buffered_logging", False):
+            self.log_buffer = LogBuffer(
+                self._insert_log_rows,
+                max_size=kwargs.get("log_buffer_size", 100),
+                flush_interval=kwargs.get("log_flush_interval", 2.0),
+                max_pending=kwargs.get("log_buffer_max_pending", 10000),
+            )
 
+    @property
+    def circuit_state(self) -> str:
+        """closed, open or half_open, only changes under a fault profile."""
+        return self.circuit_breaker.state
+
+    def _call(self, method: str, work: Callable[[], Any]) -> Any:
+        """
+        Call work() behind the injected latency and faults of method. Dropped
+        connections are retried with backoff, all mock calls being idempotent
+        like those of the DB driver with leases.
+        """
+        if self.faults is None:
+            return work()
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow():
+                self.metrics.inc("circuit_open")
+                raise BNPCircuitOpenException(self.circuit_breaker.retry_in())
+            try:
+                self.faults.before(method)
+            except InjectedQueryError:
+                # The database answered, it is up
+                self.circuit_breaker.record_success()
+                raise
+            except InjectedConnectionError as e:
+                self.circuit_breaker.record_failure()
+                self.metrics.inc("connection_errors")
+                if attempt >= self.retry_attempts:
+                    raise
+                self.metrics.inc("retries")
+                delay = self.faults.backoff_delay(
+                    attempt, self.retry_base_delay, self.retry_max_delay
+                )
+                log.warning(
+                    f"Mock {method}: Lost the database connection, retrying in {delay:.1f}s. {type(e).__name__}: {e}"
+                )
+                self.faults.sleep(delay)
+                attempt += 1
+                continue
+            self.circuit_breaker.record_success()
+            return work()
+
+    def _claim(
+        self, method: str, n: int, tile: Optional[str] = None, src_pattern: str = ""
+    ) -> List[Tuple[int, str]]:
+        def work() -> List[Tuple[int, str]]:
+            count = n
+            if self.faults is not None and self.faults.conflict(method):
+                # Another worker took one of the jobs first
+                self.metrics.inc("claim_conflicts")
+                count -= 1
+            if count <= 0:
+                return []
+            return self.store.claim(self.current_worker_id, count, tile, src_pattern)
+
+        return self._call(method, work)
+
+    @timed
     def get_next_job(
         self, src_pattern: str = "MSIL1C"
-    ) -> Tuple[Optional[int], Optional[str]]:
+    ) -> Union[Tuple[Optional[int], Optional[str]], JobHandle]:
         """
         Fetch the next available job for the given processor.
         """
-        for job in self.mock_jobs:
-            if job["status"] == "pending":
-                job["status"] = "processing"
-                job["worker_id"] = self.current_worker_id
-                self.current_job_id = job["job_id"]
-                self.current_src_path = job["src_uri"]
-                self.current_job_id_and_url = job["job_id"], job["src_uri"]
+        if self.draining or not self.power_on:
+            self.current_job_id_and_url = None, None
+            return JobHandle(self, None, None) if self.pooled else (None, None)
+        if self.pooled:
+            jobs = self.get_next_jobs(1, src_pattern)
+            return jobs[0] if jobs else JobHandle(self, None, None)
 
-                log.info(
-                    f"Mock get_next_job: Found job {job['job_id']} for processor {self.current_processor_id}"
-                )
-                return self.current_job_id_and_url
+        tile = self.last_tile if self.tile_affinity else None
+        for job_id, src_uri in self._claim("get_next_job", 1, tile, src_pattern):
+            if self.tile_affinity:
+                self.last_tile = tile_of(src_uri)
+            self.current_job_id = job_id
+            self.current_src_path = src_uri
+            self.current_job_id_and_url = job_id, src_uri
+
+            log.info(
+                f"Mock get_next_job: Found job {job_id} for processor {self.current_processor_id}"
+            )
+            self.metrics.inc("claimed_jobs")
+            return self.current_job_id_and_url
 
         self.current_job_id_and_url = None, None
+        self.metrics.inc("empty_claims")
         log.info(
-            f"Mock get_next_job: No jobs available for processor {self.current_processor_id}. Total jobs: {len(self.mock_jobs)}"
+            f"Mock get_next_job: No jobs available for processor {self.current_processor_id}."
         )
         return self.current_job_id_and_url
 
+    @timed
+    def get_next_jobs(
+        self, n: int, src_pattern: str = "MSIL1C"
+    ) -> Union[List[Tuple[int, str]], List[JobHandle]]:
+        """
+        Claim up to n jobs for the given processor. The current job is not changed.
+        """
+        if self.draining or not self.power_on:
+            return []
+        claimed = self._claim("get_next_jobs", n, src_pattern=src_pattern)
+
+        log.info(
+            f"Mock get_next_jobs: Claimed {len(claimed)} of {n} requested jobs for processor {self.current_processor_id}"
+        )
+        self.metrics.inc("claimed_jobs", len(claimed))
+        if not claimed:
+            self.metrics.inc("empty_claims")
+        if self.pooled:
+            return [JobHandle(self, job_id, src_uri) for job_id, src_uri in claimed]
+        return claimed
+
+    @timed
+    def get_next_scheduled_job(
+        self, processor_ids: Optional[List[int]] = None
+    ) -> JobHandle:
+        """
+        Claim the next pending job for one of processor_ids, picked like the DB
+        driver does: lowest (jobs claimed so far + 1) / priority first, among
+        the processors with a pending job matching their src_pattern.
+        """
+        processor_ids = processor_ids or self.processor_ids
+        if not processor_ids:
+            processor_ids = [p["id"] for p in PROCESSORS if p.get("enabled", True)]
+        if self.draining or not self.power_on:
+            self.current_job_id_and_url = None, None
+            return JobHandle(self, None, None)
+        priorities = {p["id"]: p.get("priority", 1) for p in PROCESSORS}
+        # Processors missing from PROCESSORS take any job
+        src_patterns = {p["id"]: p.get("src_pattern", "") for p in PROCESSORS}
+        ordered = sorted(
+            processor_ids,
+            key=lambda i: (
+                (self._scheduled.get(i, 0) + 1) / max(priorities.get(i, 1), 1),
+                -priorities.get(i, 1),
+                i,
+            ),
+        )
+        jobs: List[Tuple[int, str]] = []
+        for processor_id in ordered:
+            jobs = self._claim(
+                "get_next_scheduled_job",
+                1,
+                src_pattern=src_patterns.get(processor_id, ""),
+            )
+            if jobs:
+                break
+        self.metrics.inc("claimed_jobs", len(jobs))
+        if not jobs:
+            self.metrics.inc("empty_claims")
+            self.current_job_id_and_url = None, None
+            return JobHandle(self, None, None)
+        job_id, src_uri = tuple(jobs[0])
+        with self._lock:
+            self._scheduled[processor_id] = self._scheduled.get(processor_id, 0) + 1
+        if not self.pooled:
+            self.current_job_id = job_id
+            self.current_src_path = src_uri
+            self.current_job_id_and_url = job_id, src_uri
+        return JobHandle(self, job_id, src_uri, processor_id=processor_id)
+
+    def _resolve_job_id(self, job_id: Optional[int]) -> Optional[int]:
+        return self.current_job_id if job_id is None else job_id
+
+    def _forget_job(self, job_id: Optional[int]) -> None:
+        if job_id == self.current_job_id:
+            self.current_job_id = None
+            self.current_src_path = None
+            self.current_job_id_and_url = None, None
+
     @property
     def current_job(self) -> Tuple[Optional[int], Optional[str]]:
         return self.current_job_id_and_url
@@ -85,84 +292,180 @@ class BNPDriver:
     def worker_id(self) -> str:
         return self.current_worker_id
 
-    def report_finished(self, dst_path: str = "s3://dummy/path") -> None:
+    @property
+    def mock_jobs(self) -> List[dict]:
+        """A snapshot of all jobs of the store."""
+        return self.store.jobs()
+
+    @property
+    def logs(self) -> List[dict]:
+        """A snapshot of all stored log messages."""
+        return self.store.logs()
+
+    @timed
+    def report_finished(
+        self, dst_path: str = "s3://dummy/path", job_id: Optional[int] = None
+    ) -> None:
         """
-        Mark the job as finished.
+        Mark the job as finished. Defaults to the current job.
         """
-        for job in self.mock_jobs:
-            if job["job_id"] == self.current_job_id:
-                job["status"] = "finished"
-                log.info(
-                    f"Mock report_finished: Job {self.current_job_id} marked as finished. Output at {dst_path}"
-                )
-                self.current_job_id = None
-                self.current_src_path = None
-                return
+        job_id = self._resolve_job_id(job_id)
+        self.flush_logs()
+        updated = self._call(
+            "report_finished", lambda: self.store.set_status(job_id, "finished")
+        )
+        if updated:
+            log.info(
+                f"Mock report_finished: Job {job_id} marked as finished. Output at {dst_path}"
+            )
+            self._forget_job(job_id)
+            return
 
         log.warning(
-            f"Mock report_finished: Job {self.current_job_id} not found. Unable to mark as finished."
+            f"Mock report_finished: Job {job_id} not found. Unable to mark as finished."
         )
 
-    def report_skipped(self, message: str = "") -> None:
+    @timed
+    def report_skipped(self, message: str = "", job_id: Optional[int] = None) -> None:
         """
-        Mark the job as skipped.
+        Mark the job as skipped. Defaults to the current job.
         """
-        for job in self.mock_jobs:
-            if job["job_id"] == self.current_job_id:
-                job["status"] = "skipped"
-                log.info(
-                    f"Mock report_skipped: Job {self.current_job_id} marked as skipped. Reason: {message}"
-                )
-                self.current_job_id = None
-                self.current_src_path = None
-                return
+        job_id = self._resolve_job_id(job_id)
+        self.flush_logs()
+        updated = self._call(
+            "report_skipped", lambda: self.store.set_status(job_id, "skipped")
+        )
+        if updated:
+            log.info(
+                f"Mock report_skipped: Job {job_id} marked as skipped. Reason: {message}"
+            )
+            self._forget_job(job_id)
+            return
 
         log.warning(
-            f"Mock report_skipped: Job {self.current_job_id} not found. Unable to mark as skipped."
+            f"Mock report_skipped: Job {job_id} not found. Unable to mark as skipped."
         )
 
-    def report_failure(self, message: str) -> None:
+    @timed
+    def report_failure(self, message: str, job_id: Optional[int] = None) -> None:
         """
-        Mark the job as failed.
+        Mark the job as failed. Defaults to the current job.
         """
-        for job in self.mock_jobs:
-            if job["job_id"] == self.current_job_id:
-                job["status"] = "failed"
-                log.warning(
-                    f"Mock report_failure: Job {self.current_job_id} marked as failed. Reason: {message}"
-                )
-                return
+        job_id = self._resolve_job_id(job_id)
+        self.flush_logs()
+        updated = self._call(
+            "report_failure", lambda: self.store.set_status(job_id, "failed")
+        )
+        if updated:
+            log.warning(
+                f"Mock report_failure: Job {job_id} marked as failed. Reason: {message}"
+            )
+            return
 
         log.warning(
-            f"Mock report_failure: Job {self.current_job_id} not found. Unable to mark as failed."
+            f"Mock report_failure: Job {job_id} not found. Unable to mark as failed."
         )
 
-    def store_log_message(self, message: str) -> None:
-        """Stores a log message."""
-        if not self.current_job_id:
+    @timed
+    def store_log_message(self, message: str, job_id: Optional[int] = None) -> None:
+        """Stores a log message. Defaults to the current job."""
+        job_id = self._resolve_job_id(job_id)
+        if not job_id:
             log.warning(
                 "Mock store_log_message: Warning - No current job. Log message not associated with a job."
             )
-        self.logs.append(
-            {
-                "job_id": self.current_job_id,
-                "message": message,
-                "l1c_source": self.current_src_path,
-            }
-        )
+        if self.log_buffer is not None:
+            self.log_buffer.put(job_id, message)
+            return
+        self._call("store_log_message", lambda: self.store.add_log(job_id, message))
         log.info(
-            f"Mock store_log_message: Log message stored for job {self.current_job_id}: {message}"
+            f"Mock store_log_message: Log message stored for job {job_id}: {message}"
         )
 
+    def _insert_log_rows(self, rows: List[LogRow]) -> None:
+        """Store buffered log rows, a flush is one call to the fault injector."""
+
+        def work() -> None:
+            for job_id, message, _, _ in rows:
+                self.store.add_log(job_id, message)
+
+        self._call("flush_logs", work)
+
+    def flush_logs(self) -> None:
+        """Store any buffered log messages now."""
+        if self.log_buffer is not None:
+            self.log_buffer.flush()
+
+    @timed
+    def release_job(self, job_id: Optional[int] = None) -> bool:
+        """
+        Put a claimed job back to pending. Defaults to the current job.
+        """
+        job_id = self._resolve_job_id(job_id)
+        self.flush_logs()
+        if self._call("release_job", lambda: self.store.release(job_id)):
+            log.info(f"Mock release_job: Job {job_id} released.")
+            self._forget_job(job_id)
+            return True
+
+        log.warning(f"Mock release_job: Job {job_id} is not processing, not released.")
+        return False
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop handing out jobs and release the jobs this worker is processing.
+        The mock does not wait for them, returns True if there were none.
+        """
+        self.draining = True
+        processing = self.store.processing_job_ids(self.current_worker_id)
+        for job_id in processing:
+            self.release_job(job_id)
+        return not processing
+
+    def wait_for_job(self, timeout: float = 60.0) -> bool:
+        """
+        Return True at once if there are pending jobs and the power is on,
+        otherwise sleep for timeout seconds and return False.
+        """
+        if self.power_on and self.store.pending_count(limit=1):
+            return True
+        time.sleep(timeout)
+        return False
+
+    def processor_config(self, processor_id: Optional[int] = None) -> dict:
+        """
+        The PROCESSORS entry of processor_id (default: the driver's processor).
+        """
+        if processor_id is None:
+            processor_id = self.current_processor_id
+        return dict(next((p for p in PROCESSORS if p["id"] == processor_id), {}))
+
+    @timed
+    def is_power_on(self) -> bool:
+        """
+        Return the power_on attribute, set it to False to simulate the power
+        switch.
+        """
+        return self._call("is_power_on", lambda: self.power_on)
+
+    @timed
+    def queue_depth(self, src_pattern: str = "MSIL1C", limit: int = 100) -> int:
+        """
+        Count the pending mock jobs matching src_pattern, up to limit.
+        """
+        return self._call(
+            "queue_depth", lambda: self.store.pending_count(src_pattern, limit)
+        )
+
+    @timed
     def get_processed_products_by_worker(self, worker_id: str) -> List[dict]:
         """
         Retrieves products processed by a specific worker.
         """
-        processed = [
-            job
-            for job in self.mock_jobs
-            if job.get("worker_id") == worker_id and job["status"] == "finished"
-        ]
+        processed = self._call(
+            "get_processed_products_by_worker",
+            lambda: self.store.finished_jobs(worker_id),
+        )
         if not processed:
             log.info(
                 f"Mock get_processed_products_by_worker: No finished products found for worker {worker_id}"
@@ -173,6 +476,7 @@ class BNPDriver:
             )
         return processed
 
+    @timed
     def get_logs_for_product(self, l1c_source: str) -> List[dict]:
         """
         Retrieves logs for a specific L1C product.
@@ -181,14 +485,32 @@ class BNPDriver:
             log.warning("Mock get_logs_for_product: Invalid l1c_source provided.")
             return []
 
-        logs = [log for log in self.logs if log["l1c_source"] == l1c_source]
+        logs = self._call(
+            "get_logs_for_product", lambda: self.store.logs_for_product(l1c_source)
+        )
         log.info(
             f"Mock get_logs_for_product: Found {len(logs)} logs for product {l1c_source}"
         )
         return logs
 
+    def stats(self) -> dict:
+        """
+        Latency histograms per method and event counters, like the DB driver.
+        Conflicts, retries and connection errors stay at 0 without a fault
+        profile.
+        """
+        in_flight = len(self.store.processing_job_ids(self.current_worker_id))
+        return self.metrics.stats(gauges={"in_flight_jobs": in_flight})
+
     def close(self) -> None:
         """
         Close the mock database connection.
         """
+        if self.log_buffer is not None:
+            try:
+                self.log_buffer.close()
+            except Exception as e:
+                log.warning(
+                    f"Mock close: Flushing {len(self.log_buffer)} buffered log rows failed. {type(e).__name__}: {e}"
+                )
         log.info("Mock close: Mock connection closed.")
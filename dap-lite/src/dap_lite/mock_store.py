@@ -0,0 +1,265 @@
+import re
+import threading
+from collections import deque
+from multiprocessing.managers import BaseManager
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+# Tile id of a Sentinel-2 product URI, like bnp.tile_name_from_s1c_uri
+TILE_PATTERN = re.compile(r"_T([0-9A-Z]{5})_")
+
+PENDING = "pending"
+PROCESSING = "processing"
+
+
+def tile_of(src_uri: str) -> Optional[str]:
+    tile = TILE_PATTERN.search(src_uri)
+    return tile.group(1) if tile else None
+
+
+class MockStore:
+    """
+    Job queue and logs of the mock driver, shared by all drivers given the same
+    store (threads), or through a MockStoreManager (processes).
+
+    Jobs get ids 1, 2, ... in the order they are added and are kept in lists
+    indexed by id, so millions of synthetic jobs fit in memory. Pending jobs are
+    queued in a deque, per tile for tile affinity and per src_pattern, a pattern
+    queue and count being built on its first use; entries of jobs claimed
+    through another queue are skipped when they come up. Jobs in progress are
+    indexed by worker, finished ones by worker too and log messages by source
+    URI, so no call scans all jobs, but the first one with a new src_pattern and
+    claims with both a tile and a src_pattern, which scan the tile's queue. Every method takes the store's lock and only
+    takes and returns plain values, which lets a manager proxy them.
+    """
+
+    def __init__(self, src_uris: Iterable[str] = ()):
+        self._lock = threading.Lock()
+        self._src_uris: List[str] = []
+        self._statuses: List[str] = []
+        self._worker_ids: List[Optional[str]] = []
+        self._pending: Deque[int] = deque()
+        self._pending_by_tile: Dict[str, Deque[int]] = {}
+        self._pending_count = 0
+        self._pending_by_pattern: Dict[str, Deque[int]] = {}
+        self._pending_count_by_pattern: Dict[str, int] = {}
+        self._processing_by_worker: Dict[str, Set[int]] = {}
+        self._finished_by_worker: Dict[str, List[int]] = {}
+        self._logs_by_source: Dict[Optional[str], List[dict]] = {}
+        self.add_jobs(src_uris)
+
+    def add_jobs(self, src_uris: Iterable[str]) -> int:
+        """Queue a pending job per URI, returns the number added."""
+        with self._lock:
+            first = len(self._src_uris) + 1
+            for src_uri in src_uris:
+                self._src_uris.append(src_uri)
+                self._statuses.append(PENDING)
+                self._worker_ids.append(None)
+            for job_id in range(first, len(self._src_uris) + 1):
+                self._enqueue(job_id)
+            return len(self._src_uris) + 1 - first
+
+    def _enqueue(self, job_id: int, first: bool = False) -> None:
+        src_uri = self._src_uris[job_id - 1]
+        tile = tile_of(src_uri)
+        queues = [self._pending]
+        if tile:
+            queues.append(self._pending_by_tile.setdefault(tile, deque()))
+        for pattern, queue in self._pending_by_pattern.items():
+            if pattern in src_uri:
+                queues.append(queue)
+                self._pending_count_by_pattern[pattern] += 1
+        for queue in queues:
+            if first:
+                queue.appendleft(job_id)
+            else:
+                queue.append(job_id)
+        self._pending_count += 1
+
+    def _unqueue(self, job_id: int) -> None:
+        """Count a pending job as gone, its queue entries are skipped later."""
+        src_uri = self._src_uris[job_id - 1]
+        self._pending_count -= 1
+        for pattern in self._pending_by_pattern:
+            if pattern in src_uri:
+                self._pending_count_by_pattern[pattern] -= 1
+
+    def _pattern_queue(self, src_pattern: str) -> Deque[int]:
+        """The queue of pending jobs matching src_pattern, built on first use."""
+        queue = self._pending_by_pattern.get(src_pattern)
+        if queue is None:
+            seen: Set[int] = set()
+            queue = deque()
+            for job_id in self._pending:
+                if (
+                    job_id not in seen
+                    and self._statuses[job_id - 1] == PENDING
+                    and src_pattern in self._src_uris[job_id - 1]
+                ):
+                    seen.add(job_id)
+                    queue.append(job_id)
+            self._pending_by_pattern[src_pattern] = queue
+            self._pending_count_by_pattern[src_pattern] = len(queue)
+        return queue
+
+    def _pop_pending(self, queue: Deque[int]) -> Optional[int]:
+        while queue:
+            job_id = queue.popleft()
+            if self._statuses[job_id - 1] == PENDING:
+                return job_id
+        return None
+
+    def _pop_matching(self, queue: Deque[int], src_pattern: str) -> Optional[int]:
+        """Take the first pending job whose URI contains src_pattern out of queue."""
+        for i, job_id in enumerate(queue):
+            if (
+                self._statuses[job_id - 1] == PENDING
+                and src_pattern in self._src_uris[job_id - 1]
+            ):
+                del queue[i]
+                return job_id
+        return None
+
+    def _valid(self, job_id: Optional[int]) -> bool:
+        return isinstance(job_id, int) and 0 < job_id <= len(self._src_uris)
+
+    def claim(
+        self,
+        worker_id: str,
+        n: int = 1,
+        tile: Optional[str] = None,
+        src_pattern: str = "",
+    ) -> List[Tuple[int, str]]:
+        """
+        Claim up to n pending jobs for worker_id, those on tile first, oldest
+        (or last released) first. With src_pattern only jobs whose URI contains
+        it are claimed.
+        """
+        claimed = []
+        with self._lock:
+            while len(claimed) < n:
+                job_id = None
+                if tile and tile in self._pending_by_tile:
+                    if src_pattern:
+                        job_id = self._pop_matching(
+                            self._pending_by_tile[tile], src_pattern
+                        )
+                    else:
+                        job_id = self._pop_pending(self._pending_by_tile[tile])
+                if job_id is None:
+                    if src_pattern:
+                        job_id = self._pop_pending(self._pattern_queue(src_pattern))
+                    else:
+                        job_id = self._pop_pending(self._pending)
+                if job_id is None:
+                    break
+                self._unqueue(job_id)
+                self._statuses[job_id - 1] = PROCESSING
+                self._worker_ids[job_id - 1] = worker_id
+                self._processing_by_worker.setdefault(worker_id, set()).add(job_id)
+                claimed.append((job_id, self._src_uris[job_id - 1]))
+        return claimed
+
+    def set_status(self, job_id: int, status: str) -> bool:
+        """Set the final status of a job, returns False if it does not exist."""
+        with self._lock:
+            if not self._valid(job_id):
+                return False
+            previous = self._statuses[job_id - 1]
+            if previous == PENDING:
+                self._unqueue(job_id)
+            worker_id = self._worker_ids[job_id - 1]
+            self._processing_by_worker.get(worker_id, set()).discard(job_id)
+            if status == "finished" and previous != status and worker_id is not None:
+                self._finished_by_worker.setdefault(worker_id, []).append(job_id)
+            self._statuses[job_id - 1] = status
+            return True
+
+    def release(self, job_id: int) -> bool:
+        """Put a processing job back in front of the queue."""
+        with self._lock:
+            if not self._valid(job_id) or self._statuses[job_id - 1] != PROCESSING:
+                return False
+            worker_id = self._worker_ids[job_id - 1]
+            self._processing_by_worker.get(worker_id, set()).discard(job_id)
+            self._statuses[job_id - 1] = PENDING
+            self._worker_ids[job_id - 1] = None
+            self._enqueue(job_id, first=True)
+            return True
+
+    def add_log(self, job_id: Optional[int], message: str) -> Optional[str]:
+        """Store a log message of a job, returns its source URI."""
+        with self._lock:
+            l1c_source = self._src_uris[job_id - 1] if self._valid(job_id) else None
+            self._logs_by_source.setdefault(l1c_source, []).append(
+                {"job_id": job_id, "message": message, "l1c_source": l1c_source}
+            )
+            return l1c_source
+
+    def logs_for_product(self, l1c_source: str) -> List[dict]:
+        with self._lock:
+            return list(self._logs_by_source.get(l1c_source, []))
+
+    def logs(self) -> List[dict]:
+        with self._lock:
+            return [log for logs in self._logs_by_source.values() for log in logs]
+
+    def pending_count(self, src_pattern: str = "", limit: Optional[int] = None) -> int:
+        """Pending jobs whose URI contains src_pattern, counted up to limit."""
+        with self._lock:
+            if not src_pattern:
+                count = self._pending_count
+            else:
+                self._pattern_queue(src_pattern)
+                count = self._pending_count_by_pattern[src_pattern]
+            return count if limit is None else min(count, limit)
+
+    def processing_job_ids(self, worker_id: str) -> List[int]:
+        with self._lock:
+            return sorted(self._processing_by_worker.get(worker_id, ()))
+
+    def _job(self, job_id: int) -> dict:
+        return {
+            "job_id": job_id,
+            "src_uri": self._src_uris[job_id - 1],
+            "status": self._statuses[job_id - 1],
+            "worker_id": self._worker_ids[job_id - 1],
+        }
+
+    def get_job(self, job_id: int) -> Optional[dict]:
+        with self._lock:
+            return self._job(job_id) if self._valid(job_id) else None
+
+    def finished_jobs(self, worker_id: str) -> List[dict]:
+        with self._lock:
+            return [
+                self._job(job_id)
+                for job_id in self._finished_by_worker.get(worker_id, [])
+                if self._statuses[job_id - 1] == "finished"
+            ]
+
+    def jobs(self) -> List[dict]:
+        """A copy of all jobs, meant for tests with few jobs."""
+        with self._lock:
+            return [self._job(job_id) for job_id in range(1, len(self._src_uris) + 1)]
+
+    def status_counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for status in self._statuses:
+                counts[status] = counts.get(status, 0) + 1
+            return counts
+
+
+class MockStoreManager(BaseManager):
+    """
+    Serves a MockStore from a manager process, so that mock drivers in several
+    worker processes share one queue:
+
+        manager = MockStoreManager()
+        manager.start()
+        store = manager.MockStore(src_uris)  # a proxy, pass it on as store=
+    """
+
+
+MockStoreManager.register("MockStore", MockStore)
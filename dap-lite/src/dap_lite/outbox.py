@@ -0,0 +1,67 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT NOT NULL,
+        entry TEXT NOT NULL
+    )
+"""
+
+
+class Outbox:
+    """
+    Local append-only journal of driver calls that could not reach the database.
+
+    Entries are JSON objects kept in a SQLite file (WAL, synchronous=FULL), so a
+    call that was accepted by append() survives a crash or restart of the worker.
+    pending() returns them in the order they were appended, remove() drops an
+    entry once it has been replayed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(CREATE_TABLE)
+        (self._count,) = self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()
+
+    def append(self, entry: dict) -> int:
+        """Persist entry, returns its sequence number."""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO outbox (created_at, entry) VALUES (?, ?)",
+                (datetime.now(timezone.utc).isoformat(), json.dumps(entry)),
+            )
+            self._count += 1
+            return cur.lastrowid
+
+    def pending(self) -> List[Tuple[int, dict]]:
+        """All entries as (seq, entry), oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, entry FROM outbox ORDER BY seq"
+            ).fetchall()
+        return [(seq, json.loads(entry)) for seq, entry in rows]
+
+    def remove(self, seq: int) -> None:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM outbox WHERE seq = ?", (seq,))
+            self._count -= cur.rowcount
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
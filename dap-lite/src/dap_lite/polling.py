@@ -0,0 +1,97 @@
+import random
+import time
+
+from dap_lite.circuit_breaker import backoff_delay
+from dap_lite.logger import log
+
+# Longest single wait_for_job call, so that a stop request is noticed in time
+WAIT_SLICE = 5.0
+
+
+class AdaptivePoller:
+    """
+    Decides how long an idle worker waits before it claims again, from cheap
+    signals of the driver instead of a constant sleep.
+
+    After an empty claim, wait() probes is_power_on() and queue_depth(), both
+    read only, and returns as soon as a claim is worth trying: at once (with a
+    little jitter) when there is work, after power_off_interval while the power
+    is off, otherwise after an exponential backoff with full jitter between
+    min_interval and max_interval. The waits block in wait_for_job, so a
+    notification on new data ends them early. Call reset() after every
+    successful claim.
+
+    queue_depth only counts the jobs of the driver's processor and src_pattern,
+    which need not be the ones the worker claims (e.g. with
+    get_next_scheduled_job). After max_missed_claims empty claims in a row
+    while it showed work, the worker backs off before each further claim.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 0.5,
+        max_interval: float = 60.0,
+        power_off_interval: float = 300.0,
+        max_missed_claims: int = 3,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.power_off_interval = power_off_interval
+        self.max_missed_claims = max_missed_claims
+        self.idle_polls = 0
+        # Empty claims in a row while queue_depth showed work
+        self.missed_claims = 0
+
+    def reset(self) -> None:
+        self.idle_polls = 0
+        self.missed_claims = 0
+
+    def next_interval(self, driver, src_pattern: str = "MSIL1C") -> float:
+        """
+        Seconds to wait before the next probe, 0 when a claim should be tried
+        right away.
+        """
+        try:
+            if not driver.is_power_on():
+                return self.power_off_interval
+            if not driver.queue_depth(src_pattern, limit=1):
+                self.missed_claims = 0
+            else:
+                self.missed_claims += 1
+                if self.missed_claims <= self.max_missed_claims:
+                    return 0.0
+        except Exception as e:
+            log.warning(
+                f"AdaptivePoller: Queue signals unavailable, backing off. {type(e).__name__}: {e}"
+            )
+        delay = backoff_delay(self.idle_polls, self.min_interval, self.max_interval)
+        self.idle_polls += 1
+        return max(self.min_interval, delay)
+
+    def wait(self, driver, src_pattern: str = "MSIL1C", stop=None) -> None:
+        """
+        Block until a claim is worth trying, new work was notified or stop (an
+        Event) is set.
+        """
+        while stop is None or not stop.is_set():
+            interval = self.next_interval(driver, src_pattern)
+            if not interval:
+                # Work is there but the claim came back empty, most likely lost to
+                # another worker. Spread the retries of the fleet.
+                time.sleep(random.uniform(0, self.min_interval))
+                return
+            if self._sleep(driver, interval, stop):
+                return
+            if self.missed_claims > self.max_missed_claims:
+                return  # The backoff was for work the claims keep missing
+
+    @staticmethod
+    def _sleep(driver, seconds: float, stop=None) -> bool:
+        """Wait up to seconds, returns True when woken by new work."""
+        deadline = time.monotonic() + seconds
+        remaining = seconds
+        while remaining > 0 and (stop is None or not stop.is_set()):
+            if driver.wait_for_job(timeout=min(remaining, WAIT_SLICE)):
+                return True
+            remaining = deadline - time.monotonic()
+        return False
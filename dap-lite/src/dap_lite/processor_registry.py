@@ -0,0 +1,79 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from dap_lite.constants import PROCESSORS
+from dap_lite.logger import log
+
+# Notified by bnp.notify_processors_changed whenever bnp.processors changes
+PROCESSOR_NOTIFY_CHANNEL = "bnp_processors"
+
+
+def processor_from_row(row: dict) -> dict:
+    """
+    Flatten a bnp.processors row into the shape of the PROCESSORS entries, the
+    keys of its config column next to the columns.
+    """
+    processor = dict(row.get("config") or {})
+    processor.update((key, value) for key, value in row.items() if key != "config")
+    return processor
+
+
+class ProcessorCache:
+    """
+    TTL cache of the processor registry (bnp.processors), keyed by processor id.
+
+    load returns all processors and is called at most once per ttl seconds, or
+    on the next lookup after invalidate(). When loading fails the last known
+    processors are kept, and PROCESSORS is used before the first successful
+    load. load is called without holding the cache's lock, so it may take
+    locks of its own, and an invalidate() during a load makes the next lookup
+    load again.
+    """
+
+    def __init__(self, load: Callable[[], List[dict]], ttl: float = 300.0):
+        self.load = load
+        self.ttl = ttl
+        self._processors: Optional[Dict[int, dict]] = None
+        self._loaded_at = 0.0
+        # Bumped by invalidate(), loads remember the generation they started in
+        self._generation = 0
+        self._loaded_generation = -1
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._loaded_at = 0.0
+
+    def _current(self) -> Dict[int, dict]:
+        with self._lock:
+            if (
+                self._processors is not None
+                and time.monotonic() - self._loaded_at < self.ttl
+            ):
+                return self._processors
+            generation = self._generation
+        processors: Optional[Dict[int, dict]] = None
+        try:
+            processors = {p["id"]: p for p in self.load()}
+        except Exception as e:
+            log.warning(
+                f"ProcessorCache: Failed to load the processors, keeping the last known. {type(e).__name__}: {e}"
+            )
+        with self._lock:
+            if processors is not None and generation >= self._loaded_generation:
+                # Not older than what another thread loaded meanwhile
+                self._processors = processors
+                self._loaded_generation = generation
+            elif self._processors is None:
+                self._processors = {p["id"]: p for p in PROCESSORS}
+            if generation == self._generation:
+                self._loaded_at = time.monotonic()
+            return self._processors
+
+    def get(self, processor_id: int) -> Optional[dict]:
+        return self._current().get(processor_id)
+
+    def all(self) -> List[dict]:
+        return list(self._current().values())
@@ -0,0 +1,390 @@
+import importlib
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from typing import Callable, List, Optional, Union
+
+from dap_lite import DriverType, get_driver
+from dap_lite.circuit_breaker import backoff_delay
+from dap_lite.driver import (
+    BNPCircuitOpenException,
+    BNPStaleLeaseException,
+    get_worker_id,
+)
+from dap_lite.job_handle import JobHandle
+from dap_lite.logger import log
+from dap_lite.mock_driver import DEFAULT_SRC_URIS
+from dap_lite.mock_store import MockStore, MockStoreManager
+from dap_lite.polling import AdaptivePoller
+from dap_lite.workflow_step import WorkFlowStepSkippedException
+
+# Called with the claimed job, returns the path of the result (or None to report the
+# driver's default). Raise WorkFlowStepSkippedException to skip the job, any other
+# exception fails it. The runner reports the job unless the processor already did
+# through the handle, e.g. by passing it as bnp_driver to a WorkflowStep.
+Processor = Callable[[JobHandle], Optional[str]]
+
+# A worker that ran at least this long before crashing restarts without delay
+STABLE_AFTER_SECONDS = 60.0
+
+
+def load_processor(spec: str) -> Processor:
+    """Import a processor given as "package.module:function"."""
+    module_name, _, attr = spec.partition(":")
+    if not attr:
+        raise ValueError(f"Processor must be given as module:function, got {spec!r}")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def run_worker(
+    processor: Processor,
+    stop: threading.Event,
+    driver_type: DriverType = DriverType.DB,
+    processor_id: int = 1,
+    src_pattern: str = "MSIL1C",
+    poll_interval: float = 60.0,
+    min_poll_interval: float = 0.5,
+    power_off_interval: float = 300.0,
+    processor_ids: Optional[List[int]] = None,
+    **driver_kwargs,
+) -> None:
+    """
+    Claim and process jobs with a driver of its own until stop (a threading or
+    multiprocessing Event) is set, then drain and close the driver. A job that is
+    interrupted (SystemExit, KeyboardInterrupt) is released back to the queue, as
+    is a job whose report fails.
+    When idle the worker waits with an AdaptivePoller, between min_poll_interval
+    and poll_interval seconds. With processor_ids the worker claims jobs of any
+    of those processors with get_next_scheduled_job.
+    """
+    driver = get_driver(
+        driver_type,
+        processor_id=processor_id,
+        processor_ids=processor_ids,
+        **driver_kwargs,
+    )
+    poller = AdaptivePoller(min_poll_interval, poll_interval, power_off_interval)
+    claim_failures = 0
+    try:
+        while not stop.is_set():
+            try:
+                if processor_ids:
+                    job = driver.get_next_scheduled_job()
+                else:
+                    job = driver.get_next_job(src_pattern=src_pattern)
+            except BNPCircuitOpenException as e:
+                log.warning(f"Worker: Database unavailable, pausing. {e}")
+                stop.wait(e.retry_in or 1.0)
+                continue
+            except Exception as e:
+                delay = backoff_delay(claim_failures, 1.0, poll_interval)
+                claim_failures += 1
+                log.warning(
+                    f"Worker: Claim failed, retrying in {delay:.1f}s. {type(e).__name__}: {e}"
+                )
+                stop.wait(delay)
+                continue
+            claim_failures = 0
+            job_id, src_uri = job
+            if not job_id:
+                poller.wait(driver, src_pattern, stop)
+                continue
+            poller.reset()
+            if not isinstance(job, JobHandle):
+                job = JobHandle(driver, job_id, src_uri)
+            _process(processor, job)
+    finally:
+        try:
+            driver.drain(timeout=0)
+        except Exception as e:
+            log.warning(
+                f"Worker: Drain failed, unfinished jobs are reclaimed once their lease expires. {type(e).__name__}: {e}"
+            )
+        driver.close()
+
+
+def _process(processor: Processor, job: JobHandle) -> None:
+    log.info(f"Worker: Processing job {job.job_id}: {job.src_uri}")
+    try:
+        try:
+            dst_path = processor(job)
+        except WorkFlowStepSkippedException as e:
+            if not job.reported:
+                job.report_skipped(str(e))
+            return
+        except Exception as e:
+            log.exception(f"Worker: Job {job.job_id} failed.")
+            if not job.reported:
+                job.report_failure(f"{type(e).__name__}: {e}")
+            return
+        if job.reported:
+            return
+        if dst_path is None:
+            job.report_finished()
+        else:
+            job.report_finished(dst_path)
+    except BNPStaleLeaseException as e:
+        log.warning(f"Worker: Result of job {job.job_id} discarded. {e}")
+    except Exception as e:
+        # The worker and its driver carry on, the job is processed again
+        log.error(
+            f"Worker: Reporting job {job.job_id} failed, releasing it. {type(e).__name__}: {e}"
+        )
+        try:
+            job.release()
+        except Exception as e:
+            log.warning(
+                f"Worker: Releasing job {job.job_id} failed, it is reclaimed once its lease expires. {type(e).__name__}: {e}"
+            )
+
+
+class _WorkerStop:
+    """Stop event of a worker process, also set once the runner died."""
+
+    def __init__(self, event):
+        self.event = event
+        self.runner_pid = os.getppid()
+
+    def is_set(self) -> bool:
+        return self.event.is_set() or os.getppid() != self.runner_pid
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        self.event.wait(timeout)
+        return self.is_set()
+
+
+def _interrupt(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def _ignore_stop_signals() -> None:
+    # The runner handles SIGTERM and SIGINT (which a terminal sends to all of the
+    # processes) and stops the workers through the stop event
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _worker_process(processor, stop, options: dict) -> None:
+    """Entry point of a worker process."""
+    # SIGUSR1 makes a worker give up its current job once the drain timeout passed
+    _ignore_stop_signals()
+    signal.signal(signal.SIGUSR1, _interrupt)
+    if isinstance(processor, str):
+        processor = load_processor(processor)
+    run_worker(processor, _WorkerStop(stop), **options)
+
+
+class _Slot:
+    """One of the runner's workers, restarted under the same worker_id."""
+
+    def __init__(self, worker_id: str):
+        self.worker_id = worker_id
+        self.worker: Union[multiprocessing.Process, threading.Thread, None] = None
+        self.started_at = 0.0
+        self.crashes = 0
+        self.restart_at: Optional[float] = 0.0  # None: finished, not restarted
+        self.crashed = False  # Thread mode, set by the thread itself
+
+
+class WorkerRunner:
+    """
+    Runs worker processes (or threads) that each claim and process jobs with a
+    driver of their own, under a unique worker_id (<pod or host id>-<n>).
+
+    processor is called with each claimed JobHandle and returns the path of the
+    result, see Processor. In process mode it may also be given as
+    "package.module:function". A worker whose claim fails backs off with jitter.
+    An idle worker waits for new jobs with an AdaptivePoller: it backs off from
+    min_poll_interval up to poll_interval seconds while the queue is empty, sleeps
+    power_off_interval seconds while the power is off and is woken early by new
+    data.
+
+    SIGTERM or SIGINT stop the runner: the workers finish their current job, drain
+    and exit. Workers still busy after drain_timeout seconds, or at a second signal,
+    are interrupted (in process mode), which releases their job back to the queue. A worker that
+    crashes is restarted after restart_delay seconds, doubling up to
+    max_restart_delay while it keeps crashing.
+
+    With processor_ids the workers share their time between several processors,
+    see BNPDriver.get_next_scheduled_job. The processor then finds the one a job
+    is for in JobHandle.processor_id.
+
+    driver_kwargs are passed on to get_driver, e.g. lease_seconds or outbox_dir.
+    Mock workers share one MockStore of src_uris, served by a MockStoreManager
+    in process mode, unless a store is passed.
+    """
+
+    def __init__(
+        self,
+        processor: Union[Processor, str],
+        workers: int = 1,
+        threads: bool = False,
+        driver_type: DriverType = DriverType.DB,
+        processor_id: int = 1,
+        src_pattern: str = "MSIL1C",
+        poll_interval: float = 60.0,
+        min_poll_interval: float = 0.5,
+        power_off_interval: float = 300.0,
+        processor_ids: Optional[List[int]] = None,
+        drain_timeout: float = 25.0,
+        restart_delay: float = 1.0,
+        max_restart_delay: float = 60.0,
+        **driver_kwargs,
+    ):
+        if threads and isinstance(processor, str):
+            processor = load_processor(processor)
+        self.processor = processor
+        self.threads = threads
+        self.drain_timeout = drain_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        base_id = driver_kwargs.pop("worker_id", None) or get_worker_id()
+        self.options = dict(
+            driver_type=driver_type,
+            processor_id=processor_id,
+            src_pattern=src_pattern,
+            poll_interval=poll_interval,
+            min_poll_interval=min_poll_interval,
+            power_off_interval=power_off_interval,
+            processor_ids=processor_ids,
+            **driver_kwargs,
+        )
+        self.slots: List[_Slot] = [_Slot(f"{base_id}-{n}") for n in range(workers)]
+        self.stop_event = (
+            threading.Event() if threads else multiprocessing.get_context().Event()
+        )
+        # Only counted by the signal handler, acting on it there could deadlock on
+        # the locks of the stop event
+        self._signals = 0
+
+    def stop(self) -> None:
+        """Ask the workers to finish their current job and exit."""
+        self.stop_event.set()
+
+    def _handle_signal(self, signum, frame) -> None:
+        self._signals += 1
+
+    def run(self) -> int:
+        """
+        Start the workers and supervise them until stopped. Returns 0, or 1 when
+        workers had to be interrupted at shutdown.
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self._handle_signal)
+            signal.signal(signal.SIGINT, self._handle_signal)
+        mode = "threads" if self.threads else "processes"
+        log.info(f"Runner: Starting {len(self.slots)} worker {mode}.")
+        manager = self._share_mock_store()
+        try:
+            while not self.stop_event.is_set() and not self._signals:
+                self._supervise()
+                if all(slot.restart_at is None for slot in self.slots):
+                    break  # Every worker finished on its own
+                time.sleep(0.5)
+            if self._signals:
+                log.info("Runner: Received a signal, draining the workers.")
+        finally:
+            clean = self._shutdown()
+            if manager is not None:
+                manager.shutdown()
+        return 0 if clean else 1
+
+    def _share_mock_store(self) -> Optional[MockStoreManager]:
+        """
+        Give mock workers one store, so that they share the jobs like workers of
+        one database. Returns the manager serving it in process mode.
+        """
+        if (
+            self.options["driver_type"] != DriverType.MOCK
+            or self.options.get("store") is not None
+        ):
+            return None
+        src_uris = self.options.pop("src_uris", None) or DEFAULT_SRC_URIS
+        if self.threads:
+            self.options["store"] = MockStore(src_uris)
+            return None
+        manager = MockStoreManager()
+        manager.start(_ignore_stop_signals)
+        self.options["store"] = manager.MockStore(src_uris)
+        return manager
+
+    def _supervise(self) -> None:
+        now = time.monotonic()
+        for slot in self.slots:
+            if slot.worker is not None and slot.worker.is_alive():
+                continue
+            if slot.worker is not None:
+                self._reap(slot, now)
+            if slot.restart_at is not None and now >= slot.restart_at:
+                self._start(slot)
+
+    def _reap(self, slot: _Slot, now: float) -> None:
+        """Decide whether the worker that exited in slot is restarted, and when."""
+        crashed = slot.crashed if self.threads else slot.worker.exitcode != 0
+        slot.worker = None
+        if not crashed:
+            log.info(f"Runner: Worker {slot.worker_id} finished.")
+            slot.restart_at = None
+            return
+        if now - slot.started_at >= STABLE_AFTER_SECONDS:
+            slot.crashes = 0
+        delay = min(self.max_restart_delay, self.restart_delay * 2**slot.crashes)
+        slot.crashes += 1
+        log.error(
+            f"Runner: Worker {slot.worker_id} crashed, restarting it in {delay:.1f}s."
+        )
+        slot.restart_at = now + delay
+
+    def _start(self, slot: _Slot) -> None:
+        options = dict(self.options, worker_id=slot.worker_id)
+        if self.threads:
+            slot.crashed = False
+            slot.worker = threading.Thread(
+                target=self._worker_thread,
+                args=(slot, options),
+                name=slot.worker_id,
+                daemon=True,
+            )
+        else:
+            slot.worker = multiprocessing.get_context().Process(
+                target=_worker_process,
+                args=(self.processor, self.stop_event, options),
+                name=slot.worker_id,
+            )
+        slot.started_at = time.monotonic()
+        slot.worker.start()
+
+    def _worker_thread(self, slot: _Slot, options: dict) -> None:
+        try:
+            run_worker(self.processor, self.stop_event, **options)
+        except Exception:
+            log.exception(f"Runner: Worker {slot.worker_id} crashed.")
+            slot.crashed = True
+
+    def _shutdown(self) -> bool:
+        """Stop the workers, interrupting those still busy after drain_timeout."""
+        self.stop()
+        deadline = time.monotonic() + self.drain_timeout
+        running = [slot.worker for slot in self.slots if slot.worker is not None]
+        busy = [worker for worker in running if worker.is_alive()]
+        while busy and time.monotonic() < deadline and self._signals < 2:
+            time.sleep(0.2)
+            busy = [worker for worker in busy if worker.is_alive()]
+        if not busy:
+            log.info("Runner: All workers drained.")
+            return True
+        if self.threads:
+            log.warning(
+                f"Runner: {len(busy)} workers still busy, their jobs are reclaimed once the lease expires."
+            )
+            return False
+        log.warning(f"Runner: Interrupting {len(busy)} busy workers.")
+        for worker in busy:
+            os.kill(worker.pid, signal.SIGUSR1)  # The job is released
+        for worker in busy:
+            worker.join(10.0)
+            if worker.is_alive():
+                worker.kill()
+        return False
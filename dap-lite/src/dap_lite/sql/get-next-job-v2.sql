@@ -9,7 +9,7 @@ CREATE OR REPLACE FUNCTION bnp.default_candidate_listing(p_src_pattern TEXT)
 RETURNS TABLE (id INTEGER, uri TEXT) AS $$
 BEGIN
     RETURN QUERY
-    SELECT id,
+    SELECT source.id,
            's3:' || REGEXP_REPLACE(uri_body, '\.stac(_item)?\.json$', '') || '.SAFE' AS uri
     FROM bnp.dataset_location source
     WHERE source.uri_body LIKE '%' || p_src_pattern || '%'
@@ -56,21 +56,7 @@ END;
 $$ LANGUAGE plpgsql;
 
 
------------------------------------------------------------------------------------
---                             bnp.is_power_on
------------------------------------------------------------------------------------
-CREATE OR REPLACE FUNCTION bnp.is_power_on()
-RETURNS BOOLEAN AS $$
-DECLARE
-    power_status TEXT;
-BEGIN
-    SELECT value::TEXT INTO power_status
-    FROM bnp.globals
-    WHERE variable_name = 'power';
-    power_status := TRIM(BOTH '"' FROM power_status);
-    RETURN power_status = 'on';
-END;
-$$ LANGUAGE plpgsql;
+-- bnp.is_power_on is defined in odc-db-additions.sql
 
 -----------------------------------------------------------------------------------
 --                         bnp.get_next_processing_job
@@ -106,7 +92,7 @@ BEGIN
 
     -- Dynamic SQL to call the candidate listing function
     FOR product IN EXECUTE FORMAT(
-        'SELECT id, uri FROM %I(%L)',
+        'SELECT id, uri FROM %s(%L)', -- Allow-listed above, %I would quote the schema dot
         p_candidate_listing_function,
         p_src_pattern
     )
@@ -27,8 +27,10 @@ CREATE TABLE bnp.process_executions (
     attempts INTEGER DEFAULT 0, -- Number of attempts made for this execution
     start_time TIMESTAMP DEFAULT NOW(), -- When the execution started
     finished_time TIMESTAMP, -- When the execution finished (NULL if incomplete)
-    updated_at TIMESTAMP NOT NULL DEFAULT NOW() -- Tracks last modification time
-    err_msg TEXT
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(), -- Tracks last modification time
+    err_msg TEXT,
+    lease_expires_at TIMESTAMP, -- Running jobs not renewed before this may be reclaimed (NULL = never)
+    lease_token BIGINT -- Fencing token, changes on every claim or reclaim of the job
 );
 -- Add the unique constraint to ensure one execution per processor_id and src_product_id, if it doesn't exist
 DO $$
@@ -45,6 +47,13 @@ BEGIN
 END
 $$;
 
+-- Columns added after the first release, so existing installations can be upgraded in place
+ALTER TABLE bnp.process_executions ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP;
+ALTER TABLE bnp.process_executions ADD COLUMN IF NOT EXISTS lease_token BIGINT;
+
+-- Monotonically increasing lease tokens, see bnp.raise_report_rejected
+CREATE SEQUENCE IF NOT EXISTS bnp.lease_token_seq;
+
 CREATE TABLE bnp.globals (
     variable_name TEXT PRIMARY KEY,
     value JSONB NOT NULL
@@ -55,6 +64,47 @@ INSERT INTO bnp.globals (variable_name, value)
 VALUES
     ('power', '"on"');
 
+-- The processor registry, formerly constants.PROCESSORS in dap_lite. The claim
+-- functions only hand out jobs of enabled processors and retry up to retry_limit,
+-- processors without a row keep the arguments of the claim. Changes are notified on
+-- the bnp_processors channel, see bnp.notify_processors_changed.
+CREATE TABLE IF NOT EXISTS bnp.processors (
+    id INTEGER PRIMARY KEY, -- The processor_id of bnp.process_executions
+    processor_name TEXT NOT NULL,
+    src_pattern TEXT NOT NULL DEFAULT 'MSIL1C', -- Matched against agdc.dataset_location.uri_body
+    priority INTEGER NOT NULL DEFAULT 1, -- Share of a scheduled worker pool
+    retry_limit INTEGER NOT NULL DEFAULT 3, -- Attempts before a job is failed for good
+    enabled BOOLEAN NOT NULL DEFAULT TRUE, -- Disabled processors get no jobs
+    output_bucket TEXT,
+    config JSONB NOT NULL DEFAULT '{}', -- Everything else, e.g. parameters and baseline
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO bnp.processors (id, processor_name, src_pattern, priority, retry_limit, enabled, output_bucket, config)
+VALUES (
+    1,
+    'BNP-Sentinel2_L2A_Force_Processor',
+    'MSIL1C',
+    10,
+    3,
+    TRUE,
+    's3://output-bucket/Sentinel2/L2A',
+    '{
+        "source_product_name": "S2A_MSIL1C",
+        "target_product_name": "S2A_MSIL2A_{date}_N{baseline}_R{orbit}_T{tile_id}",
+        "sensor_name": "MSI",
+        "baseline": "D001",
+        "parameters": {"cloud_threshold": 0.2},
+        "required_bands": ["B01", "B02", "B03", "B04", "B08"],
+        "error_handling_policy": "retry",
+        "output_format": "COG",
+        "description": "Processor for converting Sentinel-2 MSI L1C to L2A.",
+        "processor_version": "1.0.0",
+        "l2a_schema_version": "2.12"
+    }'
+)
+ON CONFLICT (id) DO NOTHING;
+
  
 -- Create the user if it doesn't exist, it can only read odc but also write bnp
 DO $$
@@ -67,6 +117,10 @@ $$;
  
 CREATE INDEX idx_processor_status ON bnp.process_executions (processor_id, status);
 CREATE INDEX idx_job_id ON bnp.process_executions (id);
+CREATE INDEX IF NOT EXISTS idx_process_executions_lease
+ON bnp.process_executions (processor_id, lease_expires_at) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS idx_process_executions_start
+ON bnp.process_executions (processor_id, start_time);
 
 -----------------------------------------------------------------------------------
 --                             bnp.baseline_from_s1c_uri
@@ -122,18 +176,259 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql IMMUTABLE STRICT;
 
+-----------------------------------------------------------------------------------
+--                                bnp.is_power_on
+-----------------------------------------------------------------------------------
+-- Workers sleep long while the power is off instead of polling the claim functions
+CREATE OR REPLACE FUNCTION bnp.is_power_on()
+RETURNS BOOLEAN AS $$
+DECLARE
+    power_status TEXT;
+BEGIN
+    SELECT value::TEXT INTO power_status
+    FROM bnp.globals
+    WHERE variable_name = 'power';
+    power_status := TRIM(BOTH '"' FROM power_status);
+    RETURN power_status = 'on';
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-----------------------------------------------------------------------------------
+--                           bnp.processor_max_attempts
+-----------------------------------------------------------------------------------
+-- The attempts a claim of p_processor_id may use: the retry_limit of its row in
+-- bnp.processors, p_max_attempts when it has none, and NULL when it is disabled (no
+-- jobs are handed out then).
+CREATE OR REPLACE FUNCTION bnp.processor_max_attempts(
+    p_processor_id INTEGER,
+    p_max_attempts INTEGER
+)
+RETURNS INTEGER AS $$
+    SELECT CASE
+        WHEN NOT EXISTS (SELECT 1 FROM bnp.processors WHERE id = p_processor_id) THEN p_max_attempts
+        ELSE (SELECT retry_limit FROM bnp.processors WHERE id = p_processor_id AND enabled)
+    END;
+$$ LANGUAGE sql STABLE;
+
+-----------------------------------------------------------------------------------
+--                                bnp.queue_depth
+-----------------------------------------------------------------------------------
+-- Cheap backlog signal for adaptive polling: products matching p_src_pattern that
+-- have no job yet plus running jobs of the processor whose lease expired, counted
+-- up to p_limit only, 0 for a disabled processor. Nothing is locked, so the count
+-- is an estimate a claim may still lose to another worker.
+CREATE OR REPLACE FUNCTION bnp.queue_depth(
+    p_processor_id INTEGER,
+    p_src_pattern TEXT DEFAULT 'MSIL1C',
+    p_limit INTEGER DEFAULT 100
+)
+RETURNS INTEGER AS $$
+    SELECT CASE WHEN bnp.processor_max_attempts(p_processor_id, 0) IS NULL THEN 0 ELSE (
+        SELECT COUNT(*)
+        FROM (
+            SELECT 1
+            FROM bnp.dataset_location source
+            WHERE source.uri_body LIKE '%' || p_src_pattern || '%'
+              AND NOT EXISTS (
+                  SELECT 1
+                  FROM bnp.process_executions pe
+                  WHERE pe.processor_id = p_processor_id
+                    AND pe.src_product_id = source.id
+              )
+            LIMIT p_limit
+        ) unclaimed
+    )::INTEGER + (
+        SELECT COUNT(*)
+        FROM (
+            SELECT 1
+            FROM bnp.process_executions pe
+            WHERE pe.processor_id = p_processor_id
+              AND pe.status = 'running'
+              AND pe.lease_expires_at < NOW()
+            LIMIT p_limit
+        ) expired
+    )::INTEGER END;
+$$ LANGUAGE sql STABLE;
+
+-----------------------------------------------------------------------------------
+--                              bnp.reclaim_expired_jobs
+-----------------------------------------------------------------------------------
+-- Running jobs whose lease was not renewed in time belong to a dead (or hung) worker.
+-- They are handed to p_worker_id with a fresh lease and attempts bumped. Jobs that
+-- already used p_max_attempts are marked failed instead, so a product that kills its
+-- workers is not retried forever. Every reclaim hands out a new lease token.
+DROP FUNCTION IF EXISTS bnp.reclaim_expired_jobs(INTEGER, TEXT, INTEGER, INTEGER, INTEGER);
+CREATE OR REPLACE FUNCTION bnp.reclaim_expired_jobs(
+    p_processor_id INTEGER,
+    p_worker_id TEXT,
+    p_limit INTEGER DEFAULT 1,
+    p_lease_seconds INTEGER DEFAULT NULL,
+    p_max_attempts INTEGER DEFAULT 3
+)
+RETURNS TABLE (job_id INTEGER, src_uri TEXT, lease_token BIGINT) AS $$
+BEGIN
+    WITH exhausted AS (
+        UPDATE bnp.process_executions pe
+        SET status = 'failed',
+            err_msg = 'Lease expired after ' || pe.attempts || ' attempts',
+            updated_at = NOW(),
+            finished_time = NOW(),
+            lease_expires_at = NULL
+        WHERE pe.processor_id = p_processor_id
+          AND pe.status = 'running'
+          AND pe.lease_expires_at < NOW()
+          AND COALESCE(pe.attempts, 0) >= p_max_attempts
+        RETURNING pe.id
+    )
+    INSERT INTO bnp.log (job_id, message)
+    SELECT exhausted.id, 'Lease expired, final status set to FAILED'
+    FROM exhausted;
+
+    RETURN QUERY
+    WITH expired AS (
+        SELECT pe.id, pe.worker_id AS old_worker_id, pe.lease_token AS old_lease_token
+        FROM bnp.process_executions pe
+        WHERE pe.processor_id = p_processor_id
+          AND pe.status = 'running'
+          AND pe.lease_expires_at < NOW()
+        ORDER BY pe.lease_expires_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    ),
+    reclaimed AS (
+        UPDATE bnp.process_executions pe
+        SET worker_id = p_worker_id,
+            attempts = COALESCE(pe.attempts, 0) + 1,
+            start_time = NOW(),
+            updated_at = NOW(),
+            lease_expires_at = NOW() + make_interval(secs => p_lease_seconds),
+            lease_token = nextval('bnp.lease_token_seq')
+        FROM expired
+        WHERE pe.id = expired.id
+        RETURNING pe.id, pe.src_product_id, pe.attempts, pe.lease_token,
+                  expired.old_worker_id, expired.old_lease_token
+    ),
+    logged AS (
+        INSERT INTO bnp.log (job_id, message)
+        SELECT reclaimed.id,
+               FORMAT(CASE WHEN reclaimed.old_lease_token IS NULL  -- see bnp.release_jobs
+                           THEN 'Job released by worker %s, reclaimed by %s (attempt %s)'
+                           ELSE 'Lease of worker %s expired, reclaimed by %s (attempt %s)'
+                      END,
+                      reclaimed.old_worker_id, p_worker_id, reclaimed.attempts)
+        FROM reclaimed
+    )
+    SELECT reclaimed.id,
+           's3:' || REGEXP_REPLACE(dl.uri_body, '\.stac(_item)?\.json$', '') || '.SAFE',
+           reclaimed.lease_token
+    FROM reclaimed
+    INNER JOIN bnp.dataset_location dl ON dl.id = reclaimed.src_product_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-----------------------------------------------------------------------------------
+--                              bnp.renew_leases
+-----------------------------------------------------------------------------------
+-- Heartbeat from a worker. Extends the lease of its running jobs and returns the ids
+-- that were renewed; a missing id means the lease was lost to another worker.
+CREATE OR REPLACE FUNCTION bnp.renew_leases(
+    p_worker_id TEXT,
+    p_job_ids INTEGER[],
+    p_lease_seconds INTEGER
+)
+RETURNS SETOF INTEGER AS $$
+    UPDATE bnp.process_executions
+    SET lease_expires_at = NOW() + make_interval(secs => p_lease_seconds),
+        updated_at = NOW()
+    WHERE id = ANY(p_job_ids)
+      AND worker_id = p_worker_id
+      AND status = 'running'
+    RETURNING id;
+$$ LANGUAGE sql;
+
+-----------------------------------------------------------------------------------
+--                              bnp.release_jobs
+-----------------------------------------------------------------------------------
+-- Gives claimed but unfinished jobs back to the queue. Their lease is expired right
+-- away without counting the attempt, so the next claim reclaims them immediately.
+-- Only jobs still held by p_worker_id (and p_lease_tokens, when given) are released,
+-- the ids of those are returned.
+CREATE OR REPLACE FUNCTION bnp.release_jobs(
+    p_processor_id INTEGER,
+    p_worker_id TEXT,
+    p_job_ids INTEGER[],
+    p_lease_tokens BIGINT[] DEFAULT NULL
+)
+RETURNS SETOF INTEGER AS $$
+BEGIN
+    RETURN QUERY
+    WITH requested AS (
+        SELECT r.job_id, r.lease_token
+        FROM unnest(p_job_ids, COALESCE(p_lease_tokens, '{}'::BIGINT[])) AS r (job_id, lease_token)
+    ),
+    released AS (
+        UPDATE bnp.process_executions pe
+        SET attempts = GREATEST(COALESCE(pe.attempts, 1) - 1, 0),
+            updated_at = NOW(),
+            lease_expires_at = NOW(),
+            lease_token = NULL
+        FROM requested
+        WHERE pe.id = requested.job_id
+          AND pe.processor_id = p_processor_id
+          AND pe.worker_id = p_worker_id
+          AND pe.status = 'running'
+          AND (requested.lease_token IS NULL OR pe.lease_token = requested.lease_token)
+        RETURNING pe.id
+    ),
+    logged AS (
+        INSERT INTO bnp.log (job_id, message)
+        SELECT released.id, 'Released by worker ' || p_worker_id
+        FROM released
+    )
+    SELECT released.id FROM released;
+
+    IF FOUND THEN
+        PERFORM pg_notify('bnp_new_jobs', 'process_executions');
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-----------------------------------------------------------------------------------
+--                              bnp.release_job
+-----------------------------------------------------------------------------------
+-- Single job variant of bnp.release_jobs, returns whether the job was released
+CREATE OR REPLACE FUNCTION bnp.release_job(
+    p_processor_id INTEGER,
+    p_job_id INTEGER,
+    p_worker_id TEXT,
+    p_lease_token BIGINT DEFAULT NULL
+)
+RETURNS BOOLEAN AS $$
+    SELECT EXISTS (
+        SELECT 1
+        FROM bnp.release_jobs(p_processor_id, p_worker_id, ARRAY[p_job_id], ARRAY[p_lease_token])
+    );
+$$ LANGUAGE sql;
+
 -----------------------------------------------------------------------------------
 --                              bnp.get_next_processing_job
 -----------------------------------------------------------------------------------
+-- The lease arguments and lease_token column were added later, drop the old
+-- signatures so calls stay unambiguous
+DROP FUNCTION IF EXISTS bnp.get_next_processing_job(INTEGER, TEXT, TEXT);
+DROP FUNCTION IF EXISTS bnp.get_next_processing_job(INTEGER, TEXT, TEXT, INTEGER, INTEGER);
 CREATE OR REPLACE FUNCTION bnp.get_next_processing_job(
     p_processor_id INTEGER,
     p_worker_id TEXT,
-    p_src_pattern TEXT DEFAULT 'MSIL1C'
+    p_src_pattern TEXT DEFAULT 'MSIL1C',
+    p_lease_seconds INTEGER DEFAULT NULL, -- NULL: the job is never reclaimed
+    p_max_attempts INTEGER DEFAULT 3
 )
-RETURNS TABLE (job_id INTEGER, src_uri TEXT) AS $$
+RETURNS TABLE (job_id INTEGER, src_uri TEXT, lease_token BIGINT) AS $$
 DECLARE
     product RECORD;
     power_status TEXT;
+    new_lease_token BIGINT;
 BEGIN
     -- Log: Starting function execution
     RAISE NOTICE 'Starting get_next_processing_job for processor: %, worker: %', p_processor_id, p_worker_id;
@@ -150,7 +445,23 @@ BEGIN
 
     IF NOT FOUND OR power_status <> 'on' THEN
         RAISE NOTICE 'Power is not ON. Returning NULL.';
-        RETURN QUERY SELECT NULL::INTEGER, NULL::TEXT;
+        RETURN QUERY SELECT NULL::INTEGER, NULL::TEXT, NULL::BIGINT;
+        RETURN;
+    END IF;
+
+    -- The registry overrides the client's retry limit
+    p_max_attempts := bnp.processor_max_attempts(p_processor_id, p_max_attempts);
+    IF p_max_attempts IS NULL THEN
+        RAISE NOTICE 'Processor % is disabled. Returning NULL.', p_processor_id;
+        RETURN QUERY SELECT NULL::INTEGER, NULL::TEXT, NULL::BIGINT;
+        RETURN;
+    END IF;
+
+    -- Jobs of dead workers go first
+    RETURN QUERY
+    SELECT * FROM bnp.reclaim_expired_jobs(p_processor_id, p_worker_id, 1, p_lease_seconds, p_max_attempts);
+    IF FOUND THEN
+        RAISE NOTICE 'Reclaimed a job with an expired lease.';
         RETURN;
     END IF;
 
@@ -163,7 +474,8 @@ BEGIN
           AND NOT EXISTS (
               SELECT 1
               FROM bnp.process_executions pe
-              WHERE pe.src_product_id = source.id
+              WHERE pe.processor_id = p_processor_id
+                AND pe.src_product_id = source.id
           )
         ORDER BY bnp.tile_name_from_s1c_uri(source.uri_body), bnp.acquisition_date_from_s1c_uri(source.uri_body) DESC
         LIMIT 1
@@ -174,7 +486,7 @@ BEGIN
 
             -- Insert a new process_execution row
             INSERT INTO bnp.process_executions (
-                processor_id, src_product_id, worker_id, status, attempts, action
+                processor_id, src_product_id, worker_id, status, attempts, action, lease_expires_at, lease_token
             )
             VALUES (
                 p_processor_id, 
@@ -182,14 +494,16 @@ BEGIN
                 p_worker_id,
                 'running', 
                 1, 
-                'process'
+                'process',
+                NOW() + make_interval(secs => p_lease_seconds),
+                nextval('bnp.lease_token_seq')
             )
-            RETURNING id INTO job_id;
+            RETURNING id, process_executions.lease_token INTO job_id, new_lease_token;
 
             RAISE NOTICE 'Job created: ID: %', job_id;
 
             -- Return the job ID and URI
-            RETURN QUERY SELECT job_id, product.uri;
+            RETURN QUERY SELECT job_id, product.uri, new_lease_token;
 
         EXCEPTION WHEN unique_violation THEN
             RAISE NOTICE 'Conflict: Job already created by another process.';
@@ -199,124 +513,791 @@ BEGIN
 
     -- If no product was successfully claimed, return NULL
     RAISE NOTICE 'No available products found. Returning NULL.';
-    RETURN QUERY SELECT NULL::INTEGER, NULL::TEXT;
+    RETURN QUERY SELECT NULL::INTEGER, NULL::TEXT, NULL::BIGINT;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-----------------------------------------------------------------------------------
+--                         bnp.get_next_processing_jobs
+-----------------------------------------------------------------------------------
+-- Batch version of get_next_processing_job. Claims up to p_limit products in one
+-- set based statement instead of one plpgsql loop (and one round trip) per product.
+-- Rows that another worker claimed in between are silently dropped by
+-- ON CONFLICT, so fewer than p_limit rows (or none at all) may be returned.
+-- Jobs with an expired lease are reclaimed before new products are claimed.
+DROP FUNCTION IF EXISTS bnp.get_next_processing_jobs(INTEGER, TEXT, TEXT, INTEGER);
+DROP FUNCTION IF EXISTS bnp.get_next_processing_jobs(INTEGER, TEXT, TEXT, INTEGER, INTEGER, INTEGER);
+CREATE OR REPLACE FUNCTION bnp.get_next_processing_jobs(
+    p_processor_id INTEGER,
+    p_worker_id TEXT,
+    p_src_pattern TEXT DEFAULT 'MSIL1C',
+    p_limit INTEGER DEFAULT 1,
+    p_lease_seconds INTEGER DEFAULT NULL, -- NULL: the jobs are never reclaimed
+    p_max_attempts INTEGER DEFAULT 3
+)
+RETURNS TABLE (job_id INTEGER, src_uri TEXT, lease_token BIGINT) AS $$
+DECLARE
+    power_status TEXT;
+    n_reclaimed INTEGER;
+BEGIN
+    SELECT value::TEXT INTO power_status
+    FROM bnp.globals
+    WHERE variable_name = 'power';
+
+    IF NOT FOUND OR TRIM(BOTH '"' FROM power_status) <> 'on' THEN
+        RAISE NOTICE 'Power is not ON. Returning no jobs.';
+        RETURN;
+    END IF;
+
+    p_max_attempts := bnp.processor_max_attempts(p_processor_id, p_max_attempts);
+    IF p_max_attempts IS NULL THEN
+        RAISE NOTICE 'Processor % is disabled. Returning no jobs.', p_processor_id;
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    SELECT * FROM bnp.reclaim_expired_jobs(p_processor_id, p_worker_id, p_limit, p_lease_seconds, p_max_attempts);
+    GET DIAGNOSTICS n_reclaimed = ROW_COUNT;
+    IF n_reclaimed >= p_limit THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    WITH candidates AS (
+        SELECT source.id,
+               's3:' || REGEXP_REPLACE(source.uri_body, '\.stac(_item)?\.json$', '') || '.SAFE' AS uri
+        FROM bnp.dataset_location source
+        WHERE source.uri_body LIKE '%' || p_src_pattern || '%'
+          AND NOT EXISTS (
+              SELECT 1
+              FROM bnp.process_executions pe
+              WHERE pe.processor_id = p_processor_id
+                AND pe.src_product_id = source.id
+          )
+        ORDER BY bnp.tile_name_from_s1c_uri(source.uri_body), bnp.acquisition_date_from_s1c_uri(source.uri_body) DESC
+        LIMIT p_limit - n_reclaimed
+        FOR UPDATE SKIP LOCKED
+    ),
+    claimed AS (
+        INSERT INTO bnp.process_executions (
+            processor_id, src_product_id, worker_id, status, attempts, action, lease_expires_at, lease_token
+        )
+        SELECT p_processor_id, c.id, p_worker_id, 'running', 1, 'process',
+               NOW() + make_interval(secs => p_lease_seconds),
+               nextval('bnp.lease_token_seq')
+        FROM candidates c
+        ON CONFLICT ON CONSTRAINT unique_execution DO NOTHING
+        RETURNING id, src_product_id, process_executions.lease_token
+    )
+    SELECT claimed.id, candidates.uri, claimed.lease_token
+    FROM claimed
+    INNER JOIN candidates ON candidates.id = claimed.src_product_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-----------------------------------------------------------------------------------
+--                         bnp.get_next_scheduled_job
+-----------------------------------------------------------------------------------
+-- Scheduler mode: claims one job of any enabled processor in bnp.processors (or of
+-- those in p_processor_ids), so that one worker pool can serve several processors
+-- (e.g. baselines). Processors are tried in order of their recent share of the work,
+-- the jobs started in the last p_window_seconds plus one divided by their priority
+-- (weighted fair sharing): at first the highest priority goes first, over time every
+-- processor gets work in proportion to its priority so that none of them starves.
+-- The first processor with work (an expired lease or a new product matching its
+-- src_pattern) wins.
+DROP FUNCTION IF EXISTS bnp.get_next_scheduled_job(TEXT, INTEGER[], INTEGER[], TEXT[], INTEGER[], INTEGER, INTEGER);
+CREATE OR REPLACE FUNCTION bnp.get_next_scheduled_job(
+    p_worker_id TEXT,
+    p_processor_ids INTEGER[] DEFAULT NULL, -- NULL: all enabled processors
+    p_lease_seconds INTEGER DEFAULT NULL, -- NULL: the job is never reclaimed
+    p_window_seconds INTEGER DEFAULT 3600
+)
+RETURNS TABLE (processor_id INTEGER, job_id INTEGER, src_uri TEXT, lease_token BIGINT) AS $$
+DECLARE
+    proc RECORD;
+BEGIN
+    IF NOT bnp.is_power_on() THEN
+        RAISE NOTICE 'Power is not ON. Returning no jobs.';
+        RETURN;
+    END IF;
+
+    FOR proc IN
+        SELECT p.id, p.src_pattern, p.retry_limit
+        FROM bnp.processors p
+        CROSS JOIN LATERAL (
+            SELECT COUNT(*) AS n
+            FROM bnp.process_executions pe
+            WHERE pe.processor_id = p.id
+              AND pe.start_time > NOW() - make_interval(secs => p_window_seconds)
+        ) recent
+        WHERE p.enabled
+          AND (p_processor_ids IS NULL OR p.id = ANY(p_processor_ids))
+        ORDER BY (recent.n + 1)::NUMERIC / GREATEST(p.priority, 1), p.priority DESC, p.id
+    LOOP
+        RETURN QUERY
+        SELECT proc.id, claimed.job_id, claimed.src_uri, claimed.lease_token
+        FROM bnp.get_next_processing_jobs(proc.id, p_worker_id, proc.src_pattern, 1, p_lease_seconds, proc.retry_limit) claimed;
+        IF FOUND THEN
+            RETURN;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-----------------------------------------------------------------------------------
+--                              bnp.tile_bucket
+-----------------------------------------------------------------------------------
+-- Spreads the tiles over p_buckets buckets, see bnp.get_next_affinity_job
+CREATE OR REPLACE FUNCTION bnp.tile_bucket(p_tile TEXT, p_buckets INTEGER)
+RETURNS INTEGER AS $$
+    SELECT mod(hashtext(p_tile)::BIGINT & 2147483647, GREATEST(p_buckets, 1))::INTEGER;
+$$ LANGUAGE sql IMMUTABLE;
+
+-----------------------------------------------------------------------------------
+--                         bnp.get_next_affinity_job
+-----------------------------------------------------------------------------------
+-- Like bnp.get_next_processing_job, but prefers products whose per-tile inputs (DEMs,
+-- water masks, earlier dates) the worker likely has on its local disk already:
+--   1. products of p_tile, the tile the worker processed last
+--   2. with p_tile_buckets > 0, products of the tile bucket the worker owns. A worker
+--      owns one bucket through a session level advisory lock, taken on its first
+--      claim among the buckets no other session holds and kept until it
+--      disconnects. It needs a connection of its own, no pooling.
+--   3. products of buckets nobody owns, then those of buckets other workers own
+-- Ties keep the usual tile and date order. Expired leases are still reclaimed first.
+CREATE OR REPLACE FUNCTION bnp.get_next_affinity_job(
+    p_processor_id INTEGER,
+    p_worker_id TEXT,
+    p_src_pattern TEXT DEFAULT 'MSIL1C',
+    p_tile TEXT DEFAULT NULL,
+    p_tile_buckets INTEGER DEFAULT 0,
+    p_lease_seconds INTEGER DEFAULT NULL, -- NULL: the job is never reclaimed
+    p_max_attempts INTEGER DEFAULT 3
+)
+RETURNS TABLE (job_id INTEGER, src_uri TEXT, lease_token BIGINT, tile TEXT) AS $$
+DECLARE
+    lock_namespace INTEGER := hashtext('bnp.tile_affinity');
+    owned INTEGER[] := '{}';
+    taken INTEGER[] := '{}';
+    free_bucket INTEGER;
+BEGIN
+    IF NOT bnp.is_power_on() THEN
+        RAISE NOTICE 'Power is not ON. Returning no jobs.';
+        RETURN;
+    END IF;
+
+    p_max_attempts := bnp.processor_max_attempts(p_processor_id, p_max_attempts);
+    IF p_max_attempts IS NULL THEN
+        RAISE NOTICE 'Processor % is disabled. Returning no jobs.', p_processor_id;
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    SELECT reclaimed.job_id, reclaimed.src_uri, reclaimed.lease_token,
+           bnp.tile_name_from_s1c_uri(reclaimed.src_uri)
+    FROM bnp.reclaim_expired_jobs(p_processor_id, p_worker_id, 1, p_lease_seconds, p_max_attempts) reclaimed;
+    IF FOUND THEN
+        RETURN;
+    END IF;
+
+    IF p_tile_buckets > 0 THEN
+        SELECT COALESCE(array_agg(l.objid::BIGINT::INTEGER) FILTER (WHERE l.pid = pg_backend_pid()), '{}'),
+               COALESCE(array_agg(l.objid::BIGINT::INTEGER) FILTER (WHERE l.pid <> pg_backend_pid()), '{}')
+        INTO owned, taken
+        FROM pg_locks l
+        WHERE l.locktype = 'advisory'
+          AND l.classid = lock_namespace::OID
+          AND l.objsubid = 2
+          AND l.granted;
+
+        IF cardinality(owned) = 0 THEN
+            FOR free_bucket IN
+                SELECT b FROM generate_series(0, p_tile_buckets - 1) b
+                WHERE b <> ALL(taken)
+                ORDER BY random()
+            LOOP
+                IF pg_try_advisory_lock(lock_namespace, free_bucket) THEN
+                    owned := ARRAY[free_bucket];
+                    RAISE NOTICE 'Worker % owns tile bucket %', p_worker_id, free_bucket;
+                    EXIT;
+                END IF;
+            END LOOP;
+        END IF;
+    END IF;
+
+    RETURN QUERY
+    WITH candidates AS (
+        SELECT source.id,
+               's3:' || REGEXP_REPLACE(source.uri_body, '\.stac(_item)?\.json$', '') || '.SAFE' AS uri,
+               bnp.tile_name_from_s1c_uri(source.uri_body) AS tile_name
+        FROM bnp.dataset_location source
+        WHERE source.uri_body LIKE '%' || p_src_pattern || '%'
+          AND NOT EXISTS (
+              SELECT 1
+              FROM bnp.process_executions pe
+              WHERE pe.processor_id = p_processor_id
+                AND pe.src_product_id = source.id
+          )
+        ORDER BY
+            (p_tile IS NOT NULL AND bnp.tile_name_from_s1c_uri(source.uri_body) = p_tile) DESC,
+            CASE
+                WHEN p_tile_buckets <= 0 THEN 0
+                WHEN bnp.tile_bucket(bnp.tile_name_from_s1c_uri(source.uri_body), p_tile_buckets) = ANY(owned) THEN 0
+                WHEN bnp.tile_bucket(bnp.tile_name_from_s1c_uri(source.uri_body), p_tile_buckets) = ANY(taken) THEN 2
+                ELSE 1
+            END,
+            bnp.tile_name_from_s1c_uri(source.uri_body),
+            bnp.acquisition_date_from_s1c_uri(source.uri_body) DESC
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    ),
+    claimed AS (
+        INSERT INTO bnp.process_executions (
+            processor_id, src_product_id, worker_id, status, attempts, action, lease_expires_at, lease_token
+        )
+        SELECT p_processor_id, c.id, p_worker_id, 'running', 1, 'process',
+               NOW() + make_interval(secs => p_lease_seconds),
+               nextval('bnp.lease_token_seq')
+        FROM candidates c
+        ON CONFLICT ON CONSTRAINT unique_execution DO NOTHING
+        RETURNING id, src_product_id, process_executions.lease_token
+    )
+    SELECT claimed.id, candidates.uri, claimed.lease_token, candidates.tile_name
+    FROM claimed
+    INNER JOIN candidates ON candidates.id = claimed.src_product_id;
 END;
 $$ LANGUAGE plpgsql;
 
 
+-----------------------------------------------------------------------------------
+--                                bnp.job_queue
+-----------------------------------------------------------------------------------
+-- Materialized work queue: one row per processor in bnp.processors and product
+-- matching its src_pattern that has no job yet. The claim functions above find new
+-- products with an anti-join of bnp.dataset_location against the whole execution
+-- history, ordered by two regex functions, which gets slower as both grow. Claims
+-- from the queue (bnp.get_next_queued_jobs) delete its head instead, an index scan
+-- whose cost only depends on the pending rows.
+--
+-- The queue is kept up to date by triggers: new products are queued for every
+-- processor whose src_pattern they match, jobs take their product out of the queue
+-- (whichever function claimed them) and deleted jobs or products put it back or
+-- remove it. Adding a processor or changing its src_pattern syncs its queue, and
+-- bnp.sync_job_queue rebuilds missing rows in batch (also after bulk loads with
+-- triggers disabled). Tile and acquisition date are computed once, when queued.
+CREATE TABLE IF NOT EXISTS bnp.job_queue (
+    processor_id INTEGER NOT NULL REFERENCES bnp.processors (id) ON DELETE CASCADE,
+    src_product_id INTEGER NOT NULL, -- bnp.dataset_location.id
+    uri_body TEXT NOT NULL,
+    tile TEXT, -- bnp.tile_name_from_s1c_uri(uri_body)
+    acquisition_date TIMESTAMP WITH TIME ZONE, -- bnp.acquisition_date_from_s1c_uri(uri_body)
+    queued_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (processor_id, src_product_id)
+);
+
+-- The claim order of the other claim functions
+CREATE INDEX IF NOT EXISTS idx_job_queue_claim_order
+ON bnp.job_queue (processor_id, tile, acquisition_date DESC);
+
+-- Claims keep deleting the head of the queue, vacuum it often so that index scans
+-- do not have to step over many dead entries
+ALTER TABLE bnp.job_queue SET (
+    autovacuum_vacuum_scale_factor = 0.0,
+    autovacuum_vacuum_threshold = 10000
+);
+
+-----------------------------------------------------------------------------------
+--                              bnp.sync_job_queue
+-----------------------------------------------------------------------------------
+-- Batch sync of bnp.job_queue with bnp.dataset_location, for p_processor_id or all
+-- processors: queues the matching products that have no job yet and drops rows that
+-- no longer match the src_pattern. This is the anti-join the queue saves the claims
+-- from, run once per sync instead of once per claim. Returns the rows queued.
+CREATE OR REPLACE FUNCTION bnp.sync_job_queue(p_processor_id INTEGER DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    n_queued INTEGER;
+BEGIN
+    DELETE FROM bnp.job_queue q
+    USING bnp.processors p
+    WHERE q.processor_id = p.id
+      AND (p_processor_id IS NULL OR p.id = p_processor_id)
+      AND q.uri_body NOT LIKE '%' || p.src_pattern || '%';
+
+    INSERT INTO bnp.job_queue (processor_id, src_product_id, uri_body, tile, acquisition_date)
+    SELECT p.id, source.id, source.uri_body,
+           bnp.tile_name_from_s1c_uri(source.uri_body),
+           bnp.acquisition_date_from_s1c_uri(source.uri_body)
+    FROM bnp.processors p
+    INNER JOIN bnp.dataset_location source
+        ON source.uri_body LIKE '%' || p.src_pattern || '%'
+    WHERE (p_processor_id IS NULL OR p.id = p_processor_id)
+      AND NOT EXISTS (
+          SELECT 1
+          FROM bnp.process_executions pe
+          WHERE pe.processor_id = p.id
+            AND pe.src_product_id = source.id
+      )
+    ON CONFLICT DO NOTHING;
+    GET DIAGNOSTICS n_queued = ROW_COUNT;
+
+    RAISE NOTICE 'Queued % products.', n_queued;
+    RETURN n_queued;
+END;
+$$ LANGUAGE plpgsql;
+
+-----------------------------------------------------------------------------------
+--                           bnp.job_queue triggers
+-----------------------------------------------------------------------------------
+-- Statement level with transition tables, so a bulk load (also COPY) queues its
+-- products in one insert
+CREATE OR REPLACE FUNCTION bnp.queue_new_products()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO bnp.job_queue (processor_id, src_product_id, uri_body, tile, acquisition_date)
+    SELECT p.id, new_products.id, new_products.uri_body,
+           bnp.tile_name_from_s1c_uri(new_products.uri_body),
+           bnp.acquisition_date_from_s1c_uri(new_products.uri_body)
+    FROM new_products
+    INNER JOIN bnp.processors p
+        ON new_products.uri_body LIKE '%' || p.src_pattern || '%'
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM bnp.process_executions pe
+        WHERE pe.processor_id = p.id
+          AND pe.src_product_id = new_products.id
+    )
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_dataset_location_queue_new_products ON bnp.dataset_location;
+CREATE TRIGGER trg_dataset_location_queue_new_products
+AFTER INSERT ON bnp.dataset_location
+REFERENCING NEW TABLE AS new_products
+FOR EACH STATEMENT EXECUTE FUNCTION bnp.queue_new_products();
+
+CREATE OR REPLACE FUNCTION bnp.unqueue_deleted_products()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM bnp.job_queue q
+    USING deleted_products
+    WHERE q.src_product_id = deleted_products.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_dataset_location_unqueue_deleted_products ON bnp.dataset_location;
+CREATE TRIGGER trg_dataset_location_unqueue_deleted_products
+AFTER DELETE ON bnp.dataset_location
+REFERENCING OLD TABLE AS deleted_products
+FOR EACH STATEMENT EXECUTE FUNCTION bnp.unqueue_deleted_products();
+
+-- Jobs created by any claim function take their product out of the queue. Queue
+-- claims already deleted the row, this only costs them an index probe per job.
+CREATE OR REPLACE FUNCTION bnp.unqueue_claimed_products()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM bnp.job_queue q
+    USING new_jobs
+    WHERE q.processor_id = new_jobs.processor_id
+      AND q.src_product_id = new_jobs.src_product_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_process_executions_unqueue_claimed_products ON bnp.process_executions;
+CREATE TRIGGER trg_process_executions_unqueue_claimed_products
+AFTER INSERT ON bnp.process_executions
+REFERENCING NEW TABLE AS new_jobs
+FOR EACH STATEMENT EXECUTE FUNCTION bnp.unqueue_claimed_products();
+
+-- Deleting a job (e.g. to reprocess the product) makes its product claimable again
+CREATE OR REPLACE FUNCTION bnp.requeue_deleted_jobs()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO bnp.job_queue (processor_id, src_product_id, uri_body, tile, acquisition_date)
+    SELECT p.id, source.id, source.uri_body,
+           bnp.tile_name_from_s1c_uri(source.uri_body),
+           bnp.acquisition_date_from_s1c_uri(source.uri_body)
+    FROM deleted_jobs
+    INNER JOIN bnp.processors p ON p.id = deleted_jobs.processor_id
+    INNER JOIN bnp.dataset_location source ON source.id = deleted_jobs.src_product_id
+    WHERE source.uri_body LIKE '%' || p.src_pattern || '%'
+      AND NOT EXISTS (
+          SELECT 1
+          FROM bnp.process_executions pe
+          WHERE pe.processor_id = p.id
+            AND pe.src_product_id = source.id
+      )
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_process_executions_requeue_deleted_jobs ON bnp.process_executions;
+CREATE TRIGGER trg_process_executions_requeue_deleted_jobs
+AFTER DELETE ON bnp.process_executions
+REFERENCING OLD TABLE AS deleted_jobs
+FOR EACH STATEMENT EXECUTE FUNCTION bnp.requeue_deleted_jobs();
+
+-- A new processor, or a new src_pattern, gets its queue filled right away. Rows of
+-- deleted processors go with the foreign key.
+CREATE OR REPLACE FUNCTION bnp.sync_processor_job_queue()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bnp.sync_job_queue(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_processors_sync_job_queue ON bnp.processors;
+CREATE TRIGGER trg_processors_sync_job_queue
+AFTER INSERT OR UPDATE OF src_pattern ON bnp.processors
+FOR EACH ROW EXECUTE FUNCTION bnp.sync_processor_job_queue();
+
+-- Fill the queue of an existing installation, and catch up on rerun of this script
+SELECT bnp.sync_job_queue();
+
+-----------------------------------------------------------------------------------
+--                         bnp.get_next_queued_jobs
+-----------------------------------------------------------------------------------
+-- Like bnp.get_next_processing_jobs, but new products come from bnp.job_queue: up to
+-- p_limit rows are picked from the head of the processor's queue in claim order with
+-- FOR UPDATE SKIP LOCKED, deleted and turned into jobs, all in one statement. The
+-- p_src_pattern only filters the queued rows. Rows whose product got a job in the
+-- meantime (queued by a sync racing a claim) are dropped by ON CONFLICT, so fewer
+-- than p_limit rows may be returned. Expired leases are reclaimed first.
+CREATE OR REPLACE FUNCTION bnp.get_next_queued_jobs(
+    p_processor_id INTEGER,
+    p_worker_id TEXT,
+    p_src_pattern TEXT DEFAULT 'MSIL1C',
+    p_limit INTEGER DEFAULT 1,
+    p_lease_seconds INTEGER DEFAULT NULL, -- NULL: the jobs are never reclaimed
+    p_max_attempts INTEGER DEFAULT 3
+)
+RETURNS TABLE (job_id INTEGER, src_uri TEXT, lease_token BIGINT) AS $$
+DECLARE
+    n_reclaimed INTEGER;
+BEGIN
+    IF NOT bnp.is_power_on() THEN
+        RAISE NOTICE 'Power is not ON. Returning no jobs.';
+        RETURN;
+    END IF;
+
+    p_max_attempts := bnp.processor_max_attempts(p_processor_id, p_max_attempts);
+    IF p_max_attempts IS NULL THEN
+        RAISE NOTICE 'Processor % is disabled. Returning no jobs.', p_processor_id;
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    SELECT * FROM bnp.reclaim_expired_jobs(p_processor_id, p_worker_id, p_limit, p_lease_seconds, p_max_attempts);
+    GET DIAGNOSTICS n_reclaimed = ROW_COUNT;
+    IF n_reclaimed >= p_limit THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    WITH head AS (
+        SELECT q.src_product_id
+        FROM bnp.job_queue q
+        WHERE q.processor_id = p_processor_id
+          AND q.uri_body LIKE '%' || p_src_pattern || '%'
+        ORDER BY q.tile, q.acquisition_date DESC
+        LIMIT p_limit - n_reclaimed
+        FOR UPDATE SKIP LOCKED
+    ),
+    taken AS (
+        DELETE FROM bnp.job_queue q
+        USING head
+        WHERE q.processor_id = p_processor_id
+          AND q.src_product_id = head.src_product_id
+        RETURNING q.src_product_id, q.uri_body
+    ),
+    claimed AS (
+        INSERT INTO bnp.process_executions (
+            processor_id, src_product_id, worker_id, status, attempts, action, lease_expires_at, lease_token
+        )
+        SELECT p_processor_id, taken.src_product_id, p_worker_id, 'running', 1, 'process',
+               NOW() + make_interval(secs => p_lease_seconds),
+               nextval('bnp.lease_token_seq')
+        FROM taken
+        ON CONFLICT ON CONSTRAINT unique_execution DO NOTHING
+        RETURNING id, src_product_id, process_executions.lease_token
+    )
+    SELECT claimed.id,
+           's3:' || REGEXP_REPLACE(taken.uri_body, '\.stac(_item)?\.json$', '') || '.SAFE',
+           claimed.lease_token
+    FROM claimed
+    INNER JOIN taken ON taken.src_product_id = claimed.src_product_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-----------------------------------------------------------------------------------
+--                              bnp.job_queue_depth
+-----------------------------------------------------------------------------------
+-- bnp.queue_depth for drivers claiming from bnp.job_queue: queued products plus
+-- running jobs whose lease expired, each counted up to p_limit
+CREATE OR REPLACE FUNCTION bnp.job_queue_depth(
+    p_processor_id INTEGER,
+    p_src_pattern TEXT DEFAULT 'MSIL1C',
+    p_limit INTEGER DEFAULT 100
+)
+RETURNS INTEGER AS $$
+    SELECT CASE WHEN bnp.processor_max_attempts(p_processor_id, 0) IS NULL THEN 0 ELSE (
+        SELECT COUNT(*)
+        FROM (
+            SELECT 1
+            FROM bnp.job_queue q
+            WHERE q.processor_id = p_processor_id
+              AND q.uri_body LIKE '%' || p_src_pattern || '%'
+            LIMIT p_limit
+        ) queued
+    )::INTEGER + (
+        SELECT COUNT(*)
+        FROM (
+            SELECT 1
+            FROM bnp.process_executions pe
+            WHERE pe.processor_id = p_processor_id
+              AND pe.status = 'running'
+              AND pe.lease_expires_at < NOW()
+            LIMIT p_limit
+        ) expired
+    )::INTEGER END;
+$$ LANGUAGE sql STABLE;
 
 
 -----------------------------------------------------------------------------------
 --                         bnp.report_finished_processing
 -----------------------------------------------------------------------------------
+-- All report functions take the lease token handed out by the claim. When it is given
+-- and no longer matches (the job was reclaimed by another worker) the report is
+-- rejected with SQLSTATE BN001, so a stale worker can never overwrite the result of
+-- the worker that took over. The happy path is a single statement that updates the
+-- status and appends the final log row.
+DROP FUNCTION IF EXISTS bnp.report_finished_processing(INTEGER, INTEGER, TEXT);
 CREATE OR REPLACE FUNCTION bnp.report_finished_processing(
     _processor_id INTEGER,  
     _job_id INTEGER,        
-    _dst_path TEXT         
+    _dst_path TEXT,
+    _lease_token BIGINT DEFAULT NULL
 )
 RETURNS VOID AS $$
 BEGIN
-    -- Validate that the job exists and is started by the specified processor
-    IF NOT EXISTS (
+    -- Update the job as finished, if it is running and started by the specified processor
+    WITH finished AS (
+        UPDATE bnp.process_executions
+        SET status = 'finished',
+            dst_path = _dst_path,
+            updated_at = NOW(),
+            finished_time = NOW(),
+            lease_expires_at = NULL
+        WHERE id = _job_id
+          AND processor_id = _processor_id
+          AND status = 'running'
+          AND (_lease_token IS NULL OR lease_token = _lease_token)
+        RETURNING id
+    )
+    INSERT INTO bnp.log (job_id, message)
+    SELECT finished.id, 'Final status set to FINISHED'
+    FROM finished;
+
+    IF NOT FOUND THEN
+        -- A replayed report (lost answer, worker outbox) that was already applied
+        IF bnp.report_already_applied(_job_id, _lease_token, 'finished') THEN
+            RETURN;
+        END IF;
+        PERFORM bnp.raise_report_rejected(_processor_id, _job_id, _lease_token);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-----------------------------------------------------------------------------------
+--                         bnp.report_already_applied
+-----------------------------------------------------------------------------------
+-- Whether the job already got the final status from the holder of the lease token,
+-- which makes the report functions idempotent for callers that pass a token
+CREATE OR REPLACE FUNCTION bnp.report_already_applied(
+    p_job_id INTEGER,
+    p_lease_token BIGINT,
+    p_status TEXT
+)
+RETURNS BOOLEAN AS $$
+    SELECT p_lease_token IS NOT NULL AND EXISTS (
         SELECT 1
         FROM bnp.process_executions pe
-        WHERE pe.id = _job_id
-          AND pe.processor_id = _processor_id
-          AND pe.status = 'running'
+        WHERE pe.id = p_job_id
+          AND pe.lease_token = p_lease_token
+          AND pe.status::TEXT = p_status
+    );
+$$ LANGUAGE sql;
+
+-----------------------------------------------------------------------------------
+--                         bnp.raise_report_rejected
+-----------------------------------------------------------------------------------
+-- Raises the reason why a report for the job was rejected
+CREATE OR REPLACE FUNCTION bnp.raise_report_rejected(
+    p_processor_id INTEGER,
+    p_job_id INTEGER,
+    p_lease_token BIGINT
+)
+RETURNS VOID AS $$
+BEGIN
+    IF p_lease_token IS NOT NULL AND EXISTS (
+        SELECT 1
+        FROM bnp.process_executions pe
+        WHERE pe.id = p_job_id
+          AND pe.lease_token IS DISTINCT FROM p_lease_token
     ) THEN
-        RAISE EXCEPTION 'Job % is not running or not started by processor %', _job_id, _processor_id;
+        RAISE EXCEPTION 'Lease token % of job % is stale, the job was released or reclaimed', p_lease_token, p_job_id
+            USING ERRCODE = 'BN001';
     END IF;
-
-    -- Update the job as finished
-    UPDATE bnp.process_executions
-    SET status = 'finished',
-        dst_path = _dst_path,
-        updated_at = NOW(),
-        finished_time = NOW()
-    WHERE id = _job_id
-      AND processor_id = _processor_id;
-    
-    PERFORM  bnp.store_log_message(
-        _job_id, 
-        'Final status set to FINISHED' 
-    );
+    RAISE EXCEPTION 'Job % is not running or not started by processor %', p_job_id, p_processor_id;
 END;
 $$ LANGUAGE plpgsql;
 
 -----------------------------------------------------------------------------------
 --                         bnp.report_processing_failure
 -----------------------------------------------------------------------------------
+DROP FUNCTION IF EXISTS bnp.report_processing_failure(INTEGER, INTEGER, TEXT);
 CREATE OR REPLACE FUNCTION bnp.report_processing_failure(
     p_processor_id INTEGER, 
     p_job_id INTEGER,
-    p_message TEXT DEFAULT ''        
+    p_message TEXT DEFAULT '',
+    p_lease_token BIGINT DEFAULT NULL
 )
 RETURNS VOID AS $$
 BEGIN
-    -- Validate that the job exists and is started by the specified processor
-    IF NOT EXISTS (
-        SELECT 1
-        FROM bnp.process_executions pe
-        WHERE pe.id = p_job_id
-          AND pe.processor_id = p_processor_id
-          AND pe.status = 'running'
-    ) THEN
-        RAISE EXCEPTION 'Job % is not running or not started by processor %', p_job_id, p_processor_id;
-    END IF;
+    -- Update the job as failed and set the error message, if it is running and
+    -- started by the specified processor
+    WITH failed AS (
+        UPDATE bnp.process_executions
+        SET status = 'failed',
+            err_msg = p_message,
+            updated_at = NOW(),
+            finished_time = NOW(),
+            lease_expires_at = NULL
+        WHERE id = p_job_id
+          AND processor_id = p_processor_id
+          AND status = 'running'
+          AND (p_lease_token IS NULL OR lease_token = p_lease_token)
+        RETURNING id
+    )
+    INSERT INTO bnp.log (job_id, message)
+    SELECT failed.id, 'Final status set to FAILED'
+    FROM failed;
 
-    -- Update the job as failed and set the error message
-    UPDATE bnp.process_executions
-    SET status = 'failed',
-        err_msg = p_message,
-        updated_at = NOW(),
-        finished_time = NOW()
-    WHERE id = p_job_id
-      AND processor_id = p_processor_id;
-
-    PERFORM  bnp.store_log_message(
-    p_job_id, 
-    'Final status set to FAILED' 
-);
+    IF NOT FOUND THEN
+        -- A replayed report (lost answer, worker outbox) that was already applied
+        IF bnp.report_already_applied(p_job_id, p_lease_token, 'failed') THEN
+            RETURN;
+        END IF;
+        PERFORM bnp.raise_report_rejected(p_processor_id, p_job_id, p_lease_token);
+    END IF;
 END;
 $$ LANGUAGE plpgsql;
 
 -----------------------------------------------------------------------------------
 --                         bnp.report_processing_skipped
 -----------------------------------------------------------------------------------
+DROP FUNCTION IF EXISTS bnp.report_processing_skipped(INTEGER, INTEGER, TEXT);
 CREATE OR REPLACE FUNCTION bnp.report_processing_skipped(
     p_processor_id INTEGER, 
     p_job_id INTEGER,
-    p_message TEXT DEFAULT ''        
+    p_message TEXT DEFAULT '',
+    p_lease_token BIGINT DEFAULT NULL
 )
 RETURNS VOID AS $$
 BEGIN
-    -- Validate that the job exists and is started by the specified processor
-    IF NOT EXISTS (
-        SELECT 1
-        FROM bnp.process_executions pe
-        WHERE pe.id = p_job_id
-          AND pe.processor_id = p_processor_id
-          AND pe.status = 'running'
-    ) THEN
-        RAISE EXCEPTION 'Job % is not running or not started by processor %', p_job_id, p_processor_id;
+    -- Update the job as skipped and set the message, if it is running and
+    -- started by the specified processor
+    WITH skipped AS (
+        UPDATE bnp.process_executions
+        SET status = 'skipped',
+            err_msg = p_message,
+            updated_at = NOW(),
+            finished_time = NOW(),
+            lease_expires_at = NULL
+        WHERE id = p_job_id
+          AND processor_id = p_processor_id
+          AND status = 'running'
+          AND (p_lease_token IS NULL OR lease_token = p_lease_token)
+        RETURNING id
+    )
+    INSERT INTO bnp.log (job_id, message)
+    SELECT skipped.id, 'Final status set to SKIPPED'
+    FROM skipped;
+
+    IF NOT FOUND THEN
+        -- A replayed report (lost answer, worker outbox) that was already applied
+        IF bnp.report_already_applied(p_job_id, p_lease_token, 'skipped') THEN
+            RETURN;
+        END IF;
+        PERFORM bnp.raise_report_rejected(p_processor_id, p_job_id, p_lease_token);
     END IF;
+END;
+$$ LANGUAGE plpgsql;
 
-    -- Update the job as failed and set the error message
-    UPDATE bnp.process_executions
-    SET status = 'skipped',
-        err_msg = p_message,
-        updated_at = NOW(),
-        finished_time = NOW()
-    WHERE id = p_job_id
-      AND processor_id = p_processor_id;
-
-    PERFORM  bnp.store_log_message(
-    p_job_id, 
-    'Final status set to SKIPPED' 
-);
+-----------------------------------------------------------------------------------
+--                              bnp.notify_new_jobs
+-----------------------------------------------------------------------------------
+-- Idle workers block in BNPDriver.wait_for_job on LISTEN bnp_new_jobs instead of
+-- polling get_next_processing_job. The channel is notified when new products land
+-- in bnp.dataset_location, when power is switched on and when a job fails (and so
+-- becomes retryable). Postgres folds identical notifications within a transaction,
+-- so a bulk load only wakes the workers once.
+CREATE OR REPLACE FUNCTION bnp.notify_new_jobs()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('bnp_new_jobs', TG_TABLE_NAME);
+    RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
+DROP TRIGGER IF EXISTS trg_dataset_location_notify_new_jobs ON bnp.dataset_location;
+CREATE TRIGGER trg_dataset_location_notify_new_jobs
+AFTER INSERT ON bnp.dataset_location
+FOR EACH STATEMENT EXECUTE FUNCTION bnp.notify_new_jobs();
+
+DROP TRIGGER IF EXISTS trg_globals_notify_new_jobs ON bnp.globals;
+CREATE TRIGGER trg_globals_notify_new_jobs
+AFTER UPDATE ON bnp.globals
+FOR EACH ROW
+WHEN (NEW.variable_name = 'power' AND NEW.value = '"on"'::JSONB AND OLD.value IS DISTINCT FROM NEW.value)
+EXECUTE FUNCTION bnp.notify_new_jobs();
+
+DROP TRIGGER IF EXISTS trg_process_executions_notify_new_jobs ON bnp.process_executions;
+CREATE TRIGGER trg_process_executions_notify_new_jobs
+AFTER UPDATE OF status ON bnp.process_executions
+FOR EACH ROW
+WHEN (NEW.status = 'failed' AND OLD.status IS DISTINCT FROM NEW.status)
+EXECUTE FUNCTION bnp.notify_new_jobs();
+
+-----------------------------------------------------------------------------------
+--                         bnp.notify_processors_changed
+-----------------------------------------------------------------------------------
+-- Drivers cache bnp.processors and drop the cache when the bnp_processors channel is
+-- notified. Idle workers are woken as well, a processor that was enabled may have
+-- work waiting.
+CREATE OR REPLACE FUNCTION bnp.notify_processors_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('bnp_processors', TG_OP);
+    PERFORM pg_notify('bnp_new_jobs', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_processors_notify_changed ON bnp.processors;
+CREATE TRIGGER trg_processors_notify_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON bnp.processors
+FOR EACH STATEMENT EXECUTE FUNCTION bnp.notify_processors_changed();
+
 -- --------------------------------------------------------------------------------
 --                            bnp.get_product_from_job_id
 -- --------------------------------------------------------------------------------
@@ -357,8 +1338,6 @@ END;
 $$ LANGUAGE plpgsql;
 
 
-    worker_last_logs wll ON ws.worker_id = wll.worker_id;
-
 -- --------------------------------------------------------------------------------
 --                       bnp.get_processed_products_by_worker                   
 -- --------------------------------------------------------------------------------
@@ -532,6 +1511,7 @@ GRANT UPDATE ON agdc.dataset_location TO bnp_db_rw; -- Required for FOR UPDATE
 GRANT SELECT, UPDATE ON TABLE agdc.dataset_location TO bnp_db_rw; -- Verify SELECT and UPDATE privileges
 GRANT USAGE ON SCHEMA agdc TO bnp_db_rw; -- Ensure schema-level access
 GRANT USAGE, SELECT ON SEQUENCE bnp.process_executions_id_seq TO bnp_db_rw;
+GRANT USAGE, SELECT ON SEQUENCE bnp.lease_token_seq TO bnp_db_rw;
 GRANT USAGE, CREATE ON SCHEMA bnp TO bnp_db_rw;
 GRANT SELECT, INSERT, UPDATE, DELETE ON ALL TABLES IN SCHEMA bnp TO bnp_db_rw;
 GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA bnp TO bnp_db_rw;
@@ -7,18 +7,35 @@ CREATE TABLE IF NOT EXISTS bnp.log (
     ts TIMESTAMP DEFAULT NOW() -- Automatically sets to current timestamp
 );
 
+CREATE INDEX IF NOT EXISTS idx_log_job_id ON bnp.log (job_id);
+
 
 -- --------------------------------------------------------------------------------
 --                            bnp.store_log_message
 -- --------------------------------------------------------------------------------
+-- With a lease token the message is only stored while the caller still holds the
+-- lease of the job, log lines from a worker whose job was reclaimed are dropped.
+-- Returns whether the message was stored.
+DROP FUNCTION IF EXISTS bnp.store_log_message(INT, TEXT);
 CREATE OR REPLACE FUNCTION bnp.store_log_message(
     p_job_id INT,
-    p_message TEXT
+    p_message TEXT,
+    p_lease_token BIGINT DEFAULT NULL
 )
-RETURNS VOID AS $$
+RETURNS BOOLEAN AS $$
 BEGIN
+    IF p_lease_token IS NOT NULL AND NOT EXISTS (
+        SELECT 1
+        FROM bnp.process_executions pe
+        WHERE pe.id = p_job_id
+          AND pe.lease_token = p_lease_token
+    ) THEN
+        RETURN FALSE;
+    END IF;
+
     INSERT INTO bnp.log (job_id, message)
     VALUES (p_job_id, p_message);
+    RETURN TRUE;
 END;
 $$ LANGUAGE plpgsql;
 
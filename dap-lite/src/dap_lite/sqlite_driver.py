@@ -0,0 +1,950 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from dap_lite.constants import PROCESSORS
+from dap_lite.driver import (
+    BNPDriverException,
+    BNPStaleLeaseException,
+    get_worker_id,
+)
+from dap_lite.job_handle import JobHandle
+from dap_lite.logger import log
+from dap_lite.metrics import DriverMetrics, timed
+from dap_lite.mock_store import tile_of
+
+# The tables of odc-db-additions.sql and odc-db-bnp-log.sql, timestamps are unix
+# seconds. dataset_location holds the products (agdc.dataset_location), with the
+# tile and acquisition date the claims order by precomputed.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dataset_location (
+    id INTEGER PRIMARY KEY,
+    uri_scheme TEXT NOT NULL DEFAULT 's3',
+    uri_body TEXT NOT NULL,
+    tile TEXT,
+    acquisition_date TEXT,
+    added REAL NOT NULL,
+    UNIQUE (uri_scheme, uri_body)
+);
+CREATE INDEX IF NOT EXISTS idx_dataset_location_order
+ON dataset_location (tile, acquisition_date DESC);
+
+CREATE TABLE IF NOT EXISTS process_executions (
+    id INTEGER PRIMARY KEY,
+    processor_id INTEGER NOT NULL,
+    worker_id TEXT,
+    action TEXT NOT NULL DEFAULT 'process'
+        CHECK (action IN ('process', 'update', 'delete')),
+    src_product_id INTEGER NOT NULL REFERENCES dataset_location (id),
+    dst_path TEXT,
+    status TEXT NOT NULL
+        CHECK (status IN ('running', 'canceled', 'failed', 'finished', 'skipped')),
+    attempts INTEGER DEFAULT 0,
+    start_time REAL,
+    finished_time REAL,
+    updated_at REAL NOT NULL,
+    err_msg TEXT,
+    lease_expires_at REAL,
+    lease_token INTEGER,
+    CONSTRAINT unique_execution UNIQUE (processor_id, src_product_id)
+);
+CREATE INDEX IF NOT EXISTS idx_process_executions_lease
+ON process_executions (processor_id, lease_expires_at) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS idx_process_executions_start
+ON process_executions (processor_id, start_time);
+CREATE INDEX IF NOT EXISTS idx_process_executions_worker
+ON process_executions (worker_id);
+
+CREATE TABLE IF NOT EXISTS globals (
+    variable_name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+INSERT OR IGNORE INTO globals (variable_name, value) VALUES ('power', '"on"');
+INSERT OR IGNORE INTO globals (variable_name, value) VALUES ('lease_token_seq', '0');
+
+CREATE TABLE IF NOT EXISTS processors (
+    id INTEGER PRIMARY KEY,
+    processor_name TEXT NOT NULL,
+    src_pattern TEXT NOT NULL DEFAULT 'MSIL1C',
+    priority INTEGER NOT NULL DEFAULT 1,
+    retry_limit INTEGER NOT NULL DEFAULT 3,
+    enabled INTEGER NOT NULL DEFAULT 1,
+    output_bucket TEXT,
+    config TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS log (
+    id INTEGER PRIMARY KEY,
+    job_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_log_job_id ON log (job_id);
+"""
+
+PROCESSOR_COLUMNS = (
+    "id",
+    "processor_name",
+    "src_pattern",
+    "priority",
+    "retry_limit",
+    "enabled",
+    "output_bucket",
+)
+
+# bnp.acquisition_date_from_s1c_uri
+ACQUISITION_DATE_PATTERN = re.compile(r"MSIL1C_([0-9]{8}T[0-9]{6})")
+
+# Product URI of a row of dataset_location, like bnp.product_uri_from_stac_item_uri
+SRC_URI = "dl.uri_scheme || ':' || dl.uri_body"
+
+RECLAIM_EXPIRED = """
+    SELECT pe.id, pe.worker_id, pe.lease_token
+    FROM process_executions pe
+    WHERE pe.processor_id = ?
+      AND pe.status = 'running'
+      AND pe.lease_expires_at < ?
+    ORDER BY pe.lease_expires_at
+    LIMIT 1
+"""
+
+CLAIM_PRODUCT = f"""
+    INSERT INTO process_executions (
+        processor_id, src_product_id, worker_id, status, attempts, action,
+        start_time, updated_at, lease_expires_at, lease_token
+    )
+    SELECT :processor_id, dl.id, :worker_id, 'running', 1, 'process',
+           :now, :now, :lease_expires_at, :lease_token
+    FROM dataset_location dl
+    WHERE dl.uri_body LIKE '%' || :src_pattern || '%'
+      AND (:tile IS NULL OR dl.tile = :tile)
+      AND NOT EXISTS (
+          SELECT 1
+          FROM process_executions pe
+          WHERE pe.processor_id = :processor_id
+            AND pe.src_product_id = dl.id
+      )
+    ORDER BY dl.tile, dl.acquisition_date DESC
+    LIMIT 1
+    RETURNING id, (SELECT {SRC_URI} FROM dataset_location dl WHERE dl.id = src_product_id), lease_token
+"""
+
+REPORT_MESSAGES = {
+    "finished": "Final status set to FINISHED",
+    "failed": "Final status set to FAILED",
+    "skipped": "Final status set to SKIPPED",
+}
+
+
+def split_uri(src_uri: str) -> Tuple[str, str]:
+    """The uri_scheme and uri_body of a product URI, as in agdc.dataset_location."""
+    scheme, sep, body = src_uri.partition(":")
+    return (scheme, body) if sep else ("s3", src_uri)
+
+
+class BNPDriver:
+    """
+    Driver for a local SQLite file with the tables of the bnp schema, a queue
+    backend without a database server for CI, single node batch runs and
+    benchmarks of concurrent workers on one machine.
+
+    Every driver (thread or process) opens its own connection to sqlite_path
+    (default: BNP_SQLITE_PATH, else bnp.sqlite), which is created on first use
+    and runs in WAL mode so that readers never block. Load products with
+    add_products(). Writes run in BEGIN IMMEDIATE transactions, which SQLite
+    serializes, so claims need no row locks: a claim reclaims an expired lease
+    with UPDATE ... RETURNING or inserts a new execution with
+    INSERT ... SELECT ... RETURNING, like bnp.get_next_processing_job.
+
+    The semantics follow the Postgres functions: leases of lease_seconds
+    (default 600) renewed by a heartbeat thread, lease tokens that fence late
+    reports and log messages (BNPStaleLeaseException), retry_limit and enabled
+    of the processors table (seeded from PROCESSORS), the power switch in the
+    globals table, release_job/drain, get_next_scheduled_job and tile_affinity.
+    Pooled mode, prefetching, buffered logging and the outbox of the DB driver
+    are not available, NOTIFY is emulated by watching PRAGMA data_version.
+    """
+
+    def __init__(self, **kwargs):  # noqa
+        self.sqlite_path: str = kwargs.get("sqlite_path") or os.getenv(
+            "BNP_SQLITE_PATH", "bnp.sqlite"
+        )
+        self.current_worker_id: str = kwargs.get("worker_id") or get_worker_id()
+        self.current_job_id = None
+        self.current_src_path = None
+        self.processor_id = kwargs.get("processor_id", 1)
+        self.processor_ids: Optional[List[int]] = kwargs.get("processor_ids")
+        self.schedule_window: int = kwargs.get("schedule_window", 3600)
+        self.driver_type = "SQLITE"
+        self.metrics = DriverMetrics()
+        self.pooled = False
+        self.tile_affinity: bool = kwargs.get("tile_affinity", False) or bool(
+            kwargs.get("tile_buckets")
+        )
+        self.last_tile: Optional[str] = None
+        self.connection = sqlite3.connect(
+            self.sqlite_path,
+            timeout=kwargs.get("busy_timeout", 30.0),
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._db_lock = threading.RLock()
+        # executescript commits on its own, every statement is re-runnable
+        self.connection.executescript(SCHEMA)
+        with self._transaction() as conn:
+            self._seed_processors(conn)
+        self.lease_seconds: Optional[int] = kwargs.get("lease_seconds", 600)
+        self.max_attempts: int = kwargs.get(
+            "max_attempts", self.processor_config().get("retry_limit", 3)
+        )
+        self._in_flight: Dict[int, JobHandle] = {}
+        # Kept until the job is reported, like the DB driver, so that late reports
+        # of a released or reclaimed job are still fenced
+        self._lease_tokens: Dict[int, Optional[int]] = {}
+        self._job_processor_ids: Dict[int, int] = {}
+        self._in_flight_lock = threading.Condition()
+        self.draining = False
+        self._data_version = self._query("PRAGMA data_version")[0][0]
+        self._stop_heartbeat = threading.Event()
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        if self.lease_seconds:
+            self._heartbeat_thread = threading.Thread(
+                target=self._heartbeat_loop, name="bnp-heartbeat", daemon=True
+            )
+            self._heartbeat_thread.start()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        A write transaction. BEGIN IMMEDIATE takes the write lock up front, so
+        concurrent claims wait for each other (up to busy_timeout) instead of
+        failing when they upgrade from a read.
+        """
+        with self._db_lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def _query(self, query: str, params: Union[tuple, dict] = ()) -> List[tuple]:
+        with self._db_lock:
+            return self.connection.execute(query, params).fetchall()
+
+    @staticmethod
+    def _seed_processors(conn: sqlite3.Connection) -> None:
+        for processor in PROCESSORS:
+            config = {k: v for k, v in processor.items() if k not in PROCESSOR_COLUMNS}
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO processors (
+                    id, processor_name, src_pattern, priority, retry_limit, enabled,
+                    output_bucket, config, updated_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    processor["id"],
+                    processor["processor_name"],
+                    processor.get("src_pattern", "MSIL1C"),
+                    processor.get("priority", 1),
+                    processor.get("retry_limit", 3),
+                    int(processor.get("enabled", True)),
+                    processor.get("output_bucket"),
+                    json.dumps(config),
+                    time.time(),
+                ),
+            )
+
+    @timed
+    def add_products(self, src_uris: Iterable[str]) -> int:
+        """
+        Add products to dataset_location, e.g. s3://bucket/path/X.SAFE. Returns
+        the number of new products, known ones are skipped.
+        """
+        now = time.time()
+        rows = []
+        for src_uri in src_uris:
+            scheme, body = split_uri(src_uri)
+            date = ACQUISITION_DATE_PATTERN.search(body)
+            rows.append(
+                (scheme, body, tile_of(body), date.group(1) if date else None, now)
+            )
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO dataset_location (
+                    uri_scheme, uri_body, tile, acquisition_date, added
+                )
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+            return conn.total_changes - before
+
+    @staticmethod
+    def _is_power_on(conn: sqlite3.Connection) -> bool:
+        row = conn.execute(
+            "SELECT value FROM globals WHERE variable_name = 'power'"
+        ).fetchone()
+        return row is not None and json.loads(row[0]) == "on"
+
+    @staticmethod
+    def _processor_max_attempts(
+        conn: sqlite3.Connection, processor_id: int, max_attempts: int
+    ) -> Optional[int]:
+        """Like bnp.processor_max_attempts, None when the processor is disabled."""
+        row = conn.execute(
+            "SELECT enabled, retry_limit FROM processors WHERE id = ?",
+            (processor_id,),
+        ).fetchone()
+        if row is None:
+            return max_attempts
+        return row[1] if row[0] else None
+
+    def _next_lease_token(self, conn: sqlite3.Connection) -> int:
+        (token,) = conn.execute("""
+            UPDATE globals SET value = CAST(value AS INTEGER) + 1
+            WHERE variable_name = 'lease_token_seq'
+            RETURNING CAST(value AS INTEGER)
+            """).fetchone()
+        return token
+
+    def _log(self, conn: sqlite3.Connection, job_id: int, message: str) -> None:
+        conn.execute(
+            "INSERT INTO log (job_id, message, ts) VALUES (?, ?, ?)",
+            (job_id, message, time.time()),
+        )
+
+    def _claim(
+        self,
+        conn: sqlite3.Connection,
+        processor_id: int,
+        src_pattern: str,
+        n: int,
+        max_attempts: int,
+        tile: Optional[str] = None,
+    ) -> List[Tuple[int, str, int]]:
+        """
+        Claim up to n jobs inside a write transaction, like
+        bnp.get_next_processing_jobs: expired leases first, then new products
+        (those on tile first).
+        """
+        now = time.time()
+        lease_expires_at = now + self.lease_seconds if self.lease_seconds else None
+        exhausted = conn.execute(
+            """
+            UPDATE process_executions
+            SET status = 'failed',
+                err_msg = 'Lease expired after ' || attempts || ' attempts',
+                updated_at = ?,
+                finished_time = ?,
+                lease_expires_at = NULL
+            WHERE processor_id = ?
+              AND status = 'running'
+              AND lease_expires_at < ?
+              AND COALESCE(attempts, 0) >= ?
+            RETURNING id
+            """,
+            (now, now, processor_id, now, max_attempts),
+        ).fetchall()
+        for (job_id,) in exhausted:
+            self._log(conn, job_id, "Lease expired, final status set to FAILED")
+        claimed = []
+        while len(claimed) < n:
+            expired = conn.execute(RECLAIM_EXPIRED, (processor_id, now)).fetchone()
+            if expired is None:
+                break
+            job_id, old_worker_id, old_lease_token = expired
+            attempts, src_uri, lease_token = conn.execute(
+                f"""
+                UPDATE process_executions
+                SET worker_id = ?,
+                    attempts = COALESCE(attempts, 0) + 1,
+                    start_time = ?,
+                    updated_at = ?,
+                    lease_expires_at = ?,
+                    lease_token = ?
+                WHERE id = ?
+                RETURNING attempts,
+                    (SELECT {SRC_URI} FROM dataset_location dl WHERE dl.id = src_product_id),
+                    lease_token
+                """,
+                (
+                    self.current_worker_id,
+                    now,
+                    now,
+                    lease_expires_at,
+                    self._next_lease_token(conn),
+                    job_id,
+                ),
+            ).fetchone()
+            if old_lease_token is None:  # See release_job
+                message = f"Job released by worker {old_worker_id}, reclaimed by {self.current_worker_id} (attempt {attempts})"
+            else:
+                message = f"Lease of worker {old_worker_id} expired, reclaimed by {self.current_worker_id} (attempt {attempts})"
+            self._log(conn, job_id, message)
+            claimed.append((job_id, src_uri, lease_token))
+        while len(claimed) < n:
+            params = dict(
+                processor_id=processor_id,
+                worker_id=self.current_worker_id,
+                now=now,
+                lease_expires_at=lease_expires_at,
+                lease_token=self._next_lease_token(conn),
+                src_pattern=src_pattern,
+                tile=tile,
+            )
+            row = conn.execute(CLAIM_PRODUCT, params).fetchone()
+            if row is None and tile is not None:
+                tile = params["tile"] = None
+                row = conn.execute(CLAIM_PRODUCT, params).fetchone()
+            if row is None:
+                break
+            claimed.append(tuple(row))
+        return claimed
+
+    def _claim_jobs(
+        self,
+        processor_id: int,
+        src_pattern: str,
+        n: int,
+        tile: Optional[str] = None,
+    ) -> List[JobHandle]:
+        with self._transaction() as conn:
+            if not self._is_power_on(conn):
+                return []
+            max_attempts = self._processor_max_attempts(
+                conn, processor_id, self.max_attempts
+            )
+            if max_attempts is None:
+                return []
+            rows = self._claim(conn, processor_id, src_pattern, n, max_attempts, tile)
+        jobs = [
+            JobHandle(self, job_id, src_uri, lease_token, processor_id=processor_id)
+            for job_id, src_uri, lease_token in rows
+        ]
+        for job in jobs:
+            self._track(job)
+        self.metrics.inc("claimed_jobs", len(jobs))
+        if not jobs:
+            self.metrics.inc("empty_claims")
+        return jobs
+
+    @timed
+    def get_next_job(
+        self, src_pattern: str = "MSIL1C"
+    ) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Fetch the next available job for the given processor. No job is returned
+        while draining.
+        """
+        jobs = []
+        if not self.draining:
+            tile = self.last_tile if self.tile_affinity else None
+            jobs = self._claim_jobs(self.processor_id, src_pattern, 1, tile)
+        job_id, src_uri = jobs[0] if jobs else (None, None)
+        if job_id and self.tile_affinity:
+            self.last_tile = tile_of(src_uri)
+        self.current_job_id = job_id
+        self.current_src_path = src_uri
+        return self.current_job_id, self.current_src_path
+
+    @timed
+    def get_next_jobs(
+        self, n: int, src_pattern: str = "MSIL1C"
+    ) -> List[Tuple[int, str]]:
+        """
+        Claim up to n jobs for the given processor in one transaction. The
+        current job is not changed.
+        """
+        if n < 1 or self.draining:
+            return []
+        return [
+            tuple(job) for job in self._claim_jobs(self.processor_id, src_pattern, n)
+        ]
+
+    @timed
+    def get_next_scheduled_job(
+        self, processor_ids: Optional[List[int]] = None
+    ) -> JobHandle:
+        """
+        Claim a job of any of processor_ids (default: the driver's processor_ids,
+        or all enabled processors), like bnp.get_next_scheduled_job: processors
+        are tried in order of (jobs started in the last schedule_window seconds
+        + 1) / priority. The job becomes the current job.
+        """
+        processor_ids = processor_ids or self.processor_ids
+        job = JobHandle(self, None, None)
+        if not self.draining:
+            with self._transaction() as conn:
+                if self._is_power_on(conn):
+                    job = self._claim_scheduled(conn, processor_ids)
+        if job:
+            self.metrics.inc("claimed_jobs")
+            self._track(job)
+        else:
+            self.metrics.inc("empty_claims")
+        self.current_job_id = job.job_id
+        self.current_src_path = job.src_uri
+        return job
+
+    def _claim_scheduled(
+        self, conn: sqlite3.Connection, processor_ids: Optional[List[int]]
+    ) -> JobHandle:
+        processors = conn.execute(
+            """
+            SELECT p.id, p.src_pattern, p.retry_limit
+            FROM processors p
+            WHERE p.enabled
+            ORDER BY (
+                (SELECT COUNT(*) FROM process_executions pe
+                 WHERE pe.processor_id = p.id AND pe.start_time > ?) + 1.0
+            ) / MAX(p.priority, 1), p.priority DESC, p.id
+            """,
+            (time.time() - self.schedule_window,),
+        ).fetchall()
+        for processor_id, src_pattern, retry_limit in processors:
+            if processor_ids and processor_id not in processor_ids:
+                continue
+            rows = self._claim(conn, processor_id, src_pattern, 1, retry_limit)
+            if rows:
+                job_id, src_uri, lease_token = rows[0]
+                return JobHandle(
+                    self, job_id, src_uri, lease_token, processor_id=processor_id
+                )
+        return JobHandle(self, None, None)
+
+    def _track(self, job: JobHandle) -> None:
+        with self._in_flight_lock:
+            self._in_flight[job.job_id] = job
+            self._lease_tokens[job.job_id] = job.lease_token
+            self._job_processor_ids[job.job_id] = job.processor_id
+
+    def _untrack(self, job_id: Optional[int], reported: bool = True) -> None:
+        with self._in_flight_lock:
+            self._in_flight.pop(job_id, None)
+            if reported:
+                self._lease_tokens.pop(job_id, None)
+                self._job_processor_ids.pop(job_id, None)
+            self._in_flight_lock.notify_all()
+
+    def _lease_token(self, job_id: Optional[int]) -> Optional[int]:
+        with self._in_flight_lock:
+            return self._lease_tokens.get(job_id)
+
+    def _job_processor_id(self, job_id: Optional[int]) -> int:
+        with self._in_flight_lock:
+            return self._job_processor_ids.get(job_id, self.processor_id)
+
+    def _lease_lost(self, job_id: Optional[int]) -> None:
+        with self._in_flight_lock:
+            job = self._in_flight.get(job_id)
+        if job is not None:
+            job.lease_lost = True
+        self._untrack(job_id, reported=False)
+
+    @property
+    def in_flight_jobs(self) -> List[JobHandle]:
+        """Jobs claimed by this driver that have not been reported yet."""
+        with self._in_flight_lock:
+            return list(self._in_flight.values())
+
+    @timed
+    def renew_leases(self) -> List[int]:
+        """
+        Extend the lease of all in-flight jobs, returns the ids that were
+        renewed. Jobs whose lease was lost are no longer tracked.
+        """
+        with self._in_flight_lock:
+            job_ids = list(self._in_flight)
+        if not job_ids or not self.lease_seconds:
+            return []
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"""
+                UPDATE process_executions
+                SET lease_expires_at = ?, updated_at = ?
+                WHERE id IN ({', '.join('?' * len(job_ids))})
+                  AND worker_id = ?
+                  AND status = 'running'
+                RETURNING id
+                """,
+                (now + self.lease_seconds, now, *job_ids, self.current_worker_id),
+            ).fetchall()
+        renewed = [row[0] for row in rows]
+        for job_id in set(job_ids) - set(renewed):
+            log.warning(f"renew_leases: Lease of job {job_id} was lost.")
+            self._lease_lost(job_id)
+        return renewed
+
+    def _heartbeat_loop(self) -> None:
+        interval = self.lease_seconds / 3
+        while not self._stop_heartbeat.wait(interval):
+            try:
+                self.renew_leases()
+            except Exception as e:
+                log.warning(
+                    f"Heartbeat: Failed to renew leases. {type(e).__name__}: {e}"
+                )
+
+    def _release(self, job_ids: List[int]) -> List[int]:
+        """
+        Like bnp.release_jobs: expire the lease right away without counting the
+        attempt, so the next claim reclaims the job.
+        """
+        now = time.time()
+        released = []
+        with self._transaction() as conn:
+            for job_id in job_ids:
+                lease_token = self._lease_token(job_id)
+                row = conn.execute(
+                    """
+                    UPDATE process_executions
+                    SET attempts = MAX(COALESCE(attempts, 1) - 1, 0),
+                        updated_at = ?,
+                        lease_expires_at = ?,
+                        lease_token = NULL
+                    WHERE id = ?
+                      AND processor_id = ?
+                      AND worker_id = ?
+                      AND status = 'running'
+                      AND (? IS NULL OR lease_token = ?)
+                    RETURNING id
+                    """,
+                    (
+                        now,
+                        now,
+                        job_id,
+                        self._job_processor_id(job_id),
+                        self.current_worker_id,
+                        lease_token,
+                        lease_token,
+                    ),
+                ).fetchone()
+                if row is not None:
+                    self._log(
+                        conn, job_id, f"Released by worker {self.current_worker_id}"
+                    )
+                    released.append(job_id)
+        for job_id in job_ids:
+            self._lease_lost(job_id)
+            self._forget_job(job_id)
+        return released
+
+    @timed
+    def release_job(self, job_id: Optional[int] = None) -> bool:
+        """
+        Give a claimed but unfinished job back to the queue without reporting it.
+        Defaults to the current job. Returns False when the job was no longer
+        held by this worker.
+        """
+        job_id = self._resolve_job_id(job_id)
+        if not job_id:
+            raise BNPDriverException(
+                "Current Job is either already reported or never started."
+            )
+        return bool(self._release([job_id]))
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop claiming new jobs, wait up to timeout seconds (forever if None) for
+        the in-flight jobs to be reported and release the rest. Returns True
+        when all in-flight jobs were reported.
+        """
+        self.draining = True
+        with self._in_flight_lock:
+            drained = self._in_flight_lock.wait_for(
+                lambda: not self._in_flight, timeout
+            )
+            remaining = list(self._in_flight)
+        if remaining:
+            log.warning(f"drain: Releasing {len(remaining)} unfinished jobs.")
+            self._release(remaining)
+        return drained
+
+    def _resolve_job_id(self, job_id: Optional[int]) -> Optional[int]:
+        return self.current_job_id if job_id is None else job_id
+
+    def _forget_job(self, job_id: Optional[int]) -> None:
+        if job_id == self.current_job_id:
+            self.current_job_id = None
+            self.current_src_path = None
+
+    @property
+    def current_job(self) -> Tuple[Optional[int], Optional[str]]:
+        return self.current_job_id, self.current_src_path
+
+    @property
+    def worker_id(self) -> str:
+        return self.current_worker_id
+
+    def _report(self, status: str, job_id: Optional[int], text: str) -> None:
+        """
+        Set the final status of a running job, like the bnp.report_* functions:
+        a replayed report that was already applied is accepted, one carrying a
+        stale lease token raises BNPStaleLeaseException.
+        """
+        lease_token = self._lease_token(job_id)
+        processor_id = self._job_processor_id(job_id)
+        column = "dst_path" if status == "finished" else "err_msg"
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                f"""
+                UPDATE process_executions
+                SET status = ?,
+                    {column} = ?,
+                    updated_at = ?,
+                    finished_time = ?,
+                    lease_expires_at = NULL
+                WHERE id = ?
+                  AND processor_id = ?
+                  AND status = 'running'
+                  AND (? IS NULL OR lease_token = ?)
+                RETURNING id
+                """,
+                (
+                    status,
+                    text,
+                    now,
+                    now,
+                    job_id,
+                    processor_id,
+                    lease_token,
+                    lease_token,
+                ),
+            ).fetchone()
+            if row is not None:
+                self._log(conn, job_id, REPORT_MESSAGES[status])
+            else:
+                current = conn.execute(
+                    "SELECT status, lease_token FROM process_executions WHERE id = ?",
+                    (job_id,),
+                ).fetchone()
+        if row is None:
+            if lease_token is not None and current is not None:
+                if tuple(current) == (status, lease_token):
+                    self._untrack(job_id)
+                    return  # Already applied
+                self._untrack(job_id)
+                self._forget_job(job_id)
+                self.metrics.inc("stale_leases")
+                raise BNPStaleLeaseException(
+                    f"Lease token {lease_token} of job {job_id} is stale, the job was released or reclaimed"
+                )
+            raise BNPDriverException(
+                f"Job {job_id} is not running or not started by processor {processor_id}"
+            )
+        self._untrack(job_id)
+
+    @timed
+    def report_finished(
+        self, dst_path: str = "s3://dummy/path", job_id: Optional[int] = None
+    ):
+        """
+        Mark the job as finished. Defaults to the current job.
+        """
+        job_id = self._resolve_job_id(job_id)
+        self._report("finished", job_id, dst_path)
+        self._forget_job(job_id)
+
+    @timed
+    def report_skipped(self, message: str = "", job_id: Optional[int] = None):
+        """
+        Mark the job as skipped. Defaults to the current job.
+        """
+        job_id = self._resolve_job_id(job_id)
+        self._report("skipped", job_id, message)
+        self._forget_job(job_id)
+
+    @timed
+    def report_failure(self, message: str, job_id: Optional[int] = None):
+        """
+        Mark the job as failed. Defaults to the current job.
+        """
+        job_id = self._resolve_job_id(job_id)
+        self._report("failed", job_id, message)
+
+    @timed
+    def store_log_message(self, message: str, job_id: Optional[int] = None) -> None:
+        """
+        Stores a log message in the log table. Raises BNPStaleLeaseException
+        when the job was reclaimed by another worker.
+        """
+        job_id = self._resolve_job_id(job_id)
+        if not job_id:
+            raise BNPDriverException(
+                "Current Job is either already reported or never started."
+            )
+        lease_token = self._lease_token(job_id)
+        with self._transaction() as conn:
+            stored = conn.execute(
+                """
+                INSERT INTO log (job_id, message, ts)
+                SELECT ?, ?, ?
+                WHERE ? IS NULL OR EXISTS (
+                    SELECT 1 FROM process_executions
+                    WHERE id = ? AND lease_token = ?
+                )
+                """,
+                (job_id, message, time.time(), lease_token, job_id, lease_token),
+            ).rowcount
+        if not stored:
+            self.metrics.inc("stale_leases")
+            self._lease_lost(job_id)
+            raise BNPStaleLeaseException(
+                f"Lease token {lease_token} of job {job_id} is stale, the job was released or reclaimed"
+            )
+
+    def processor_config(self, processor_id: Optional[int] = None) -> dict:
+        """
+        The processors row of processor_id (default: the driver's processor)
+        merged with its config, {} if it has none.
+        """
+        with self._db_lock:
+            cursor = self.connection.execute(
+                "SELECT * FROM processors WHERE id = ?",
+                (self.processor_id if processor_id is None else processor_id,),
+            )
+            row = cursor.fetchone()
+            names = [column[0] for column in cursor.description]
+        if row is None:
+            return {}
+        processor = dict(zip(names, row))
+        config = json.loads(processor.pop("config") or "{}")
+        config.update(processor, enabled=bool(processor["enabled"]))
+        return config
+
+    def wait_for_job(self, timeout: float = 60.0) -> bool:
+        """
+        Block until another connection committed a change that leaves claimable
+        work (PRAGMA data_version, polled), or until timeout seconds passed.
+        Returns True when woken by such a change.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            (data_version,) = self._query("PRAGMA data_version")[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                if self.is_power_on() and self.queue_depth("", limit=1):
+                    return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(remaining, 0.2))
+
+    @timed
+    def is_power_on(self) -> bool:
+        """Whether the power switch in the globals table allows claiming jobs."""
+        with self._db_lock:
+            return self._is_power_on(self.connection)
+
+    @timed
+    def queue_depth(self, src_pattern: str = "MSIL1C", limit: int = 100) -> int:
+        """
+        Count the claimable jobs (new products and expired leases) up to limit,
+        0 for a disabled processor, like bnp.queue_depth.
+        """
+        rows = self._query(
+            """
+            SELECT CASE WHEN EXISTS (
+                SELECT 1 FROM processors WHERE id = :processor_id AND NOT enabled
+            ) THEN 0 ELSE (
+                SELECT COUNT(*) FROM (
+                    SELECT 1
+                    FROM dataset_location dl
+                    WHERE dl.uri_body LIKE '%' || :src_pattern || '%'
+                      AND NOT EXISTS (
+                          SELECT 1
+                          FROM process_executions pe
+                          WHERE pe.processor_id = :processor_id
+                            AND pe.src_product_id = dl.id
+                      )
+                    LIMIT :limit
+                )
+            ) + (
+                SELECT COUNT(*) FROM (
+                    SELECT 1
+                    FROM process_executions pe
+                    WHERE pe.processor_id = :processor_id
+                      AND pe.status = 'running'
+                      AND pe.lease_expires_at < :now
+                    LIMIT :limit
+                )
+            ) END
+            """,
+            dict(
+                processor_id=self.processor_id,
+                src_pattern=src_pattern,
+                limit=limit,
+                now=time.time(),
+            ),
+        )
+        return min(rows[0][0], limit)
+
+    @timed
+    def get_processed_products_by_worker(self, worker_id: str) -> List[dict]:
+        """Retrieves products processed by a specific worker."""
+        rows = self._query(
+            f"""
+            SELECT pe.id, {SRC_URI}
+            FROM process_executions pe
+            INNER JOIN dataset_location dl ON dl.id = pe.src_product_id
+            WHERE pe.worker_id = ?
+            ORDER BY pe.updated_at DESC
+            """,
+            (worker_id,),
+        )
+        return [{"job_id": job_id, "l1c_source": uri} for job_id, uri in rows]
+
+    @timed
+    def get_logs_for_product(self, l1c_source: str) -> List[dict]:
+        """Retrieves logs for a specific L1C product."""
+        scheme, body = split_uri(l1c_source)
+        rows = self._query(
+            f"""
+            SELECT l.job_id, l.message, l.ts, {SRC_URI}
+            FROM log l
+            INNER JOIN process_executions pe ON pe.id = l.job_id
+            INNER JOIN dataset_location dl ON dl.id = pe.src_product_id
+            WHERE dl.uri_scheme = ? AND dl.uri_body = ?
+            ORDER BY l.id
+            """,
+            (scheme, body),
+        )
+        return [
+            {"job_id": job_id, "message": message, "ts": ts, "l1c_source": uri}
+            for job_id, message, ts, uri in rows
+        ]
+
+    def stats(self) -> dict:
+        """
+        Latency histograms per method and event counters, like the DB driver.
+        Retries and connection errors stay at 0.
+        """
+        with self._in_flight_lock:
+            in_flight = len(self._in_flight)
+        return self.metrics.stats(gauges={"in_flight_jobs": in_flight})
+
+    def close(self) -> None:
+        """
+        Stop the heartbeat and close the connection.
+        """
+        self._stop_heartbeat.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+        with self._db_lock:
+            self.connection.close()
@@ -0,0 +1,210 @@
+import io
+import json
+import random
+import re
+import uuid
+from datetime import date, datetime, timedelta
+from itertools import chain, islice
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from dap_lite.logger import log
+
+# The Sentinel-2 tiles of the GUI, in a source checkout of the repository
+DEFAULT_TILES_PATH = (
+    Path(__file__).resolve().parents[3] / "dap_gui" / "sentinel2_tiles.json"
+)
+
+# Sensing dates from which a processing baseline was used, roughly as ESA rolled
+# them out
+BASELINES = [
+    (date(2015, 6, 23), "N0204"),
+    (date(2017, 10, 23), "N0206"),
+    (date(2018, 11, 6), "N0207"),
+    (date(2019, 7, 8), "N0208"),
+    (date(2020, 1, 28), "N0209"),
+    (date(2021, 1, 26), "N0300"),
+    (date(2021, 3, 30), "N0301"),
+    (date(2022, 1, 25), "N0400"),
+    (date(2022, 12, 6), "N0509"),
+    (date(2024, 2, 6), "N0510"),
+    (date(2024, 7, 23), "N0511"),
+]
+S2B_FIRST_DAY = date(2017, 7, 1)
+# A relative orbit passes over a tile every 10 days per satellite, S2A and S2B
+# five days apart
+REVISIT_DAYS = 5
+RELATIVE_ORBITS = 143
+
+MGRS_BANDS = "CDEFGHJKLMNPQRSTUVWX"
+MGRS_COLUMNS = "ABCDEFGHJKLMNPQRSTUVWXYZ"
+MGRS_ROWS = "ABCDEFGHJKLMNPQRSTUV"
+
+SENSING_TIME_PATTERN = re.compile(r"MSIL1C_([0-9]{8}T[0-9]{6})")
+
+COPY_COLUMNS = "id, dataset_ref, uri_scheme, uri_body, added"
+
+
+def load_tiles(path: Optional[str] = None) -> List[str]:
+    """Tile ids (e.g. 33VVH) of a tiles file like dap_gui/sentinel2_tiles.json."""
+    path = Path(path) if path else DEFAULT_TILES_PATH
+    with open(path) as f:
+        return [tile["name"] for tile in json.load(f)]
+
+
+def synthetic_tiles(exclude: Iterable[str] = ()) -> Iterator[str]:
+    """All well-formed MGRS tile ids, zone by zone, except those in exclude."""
+    exclude = set(exclude)
+    for zone in range(1, 61):
+        for band in MGRS_BANDS:
+            for column in MGRS_COLUMNS:
+                for row in MGRS_ROWS:
+                    tile = f"{zone:02d}{band}{column}{row}"
+                    if tile not in exclude:
+                        yield tile
+
+
+def baseline_of(day: date) -> str:
+    baseline = BASELINES[0][1]
+    for first_day, name in BASELINES:
+        if day >= first_day:
+            baseline = name
+    return baseline
+
+
+def sensing_time(day: date, tile: str, orbit: int) -> datetime:
+    """
+    Datatake start over tile: about 10:30 local solar time, shifted per relative
+    orbit by a few minutes.
+    """
+    longitude = -183 + 6 * int(tile[:2])
+    seconds = int((10.5 - longitude / 15) * 3600) % 86400 + (orbit * 37) % 600
+    return datetime(day.year, day.month, day.day) + timedelta(seconds=seconds)
+
+
+def uri_body(satellite: str, sensed: datetime, orbit: int, tile: str) -> str:
+    """
+    The uri_body of an L1C product in agdc.dataset_location, a STAC item next to
+    the .SAFE.
+    """
+    generated = sensed + timedelta(hours=2, seconds=(orbit * 7919) % 7200)
+    return (
+        f"//eodata-sentinel2-s2msi1c-{sensed.year}/{sensed.month}/{sensed.day}"
+        f"/S2{satellite}_MSIL1C_{sensed:%Y%m%dT%H%M%S}_{baseline_of(sensed.date())}"
+        f"_R{orbit:03d}_T{tile}_{generated:%Y%m%dT%H%M%S}.stac_item.json"
+    )
+
+
+def src_uri(body: str) -> str:
+    """The .SAFE of a uri_body, like bnp.product_uri_from_stac_item_uri."""
+    return "s3:" + re.sub(r"\.stac(_item)?\.json$", "", body) + ".SAFE"
+
+
+def generate_uri_bodies(
+    rows: int,
+    tiles: Sequence[str],
+    start: date = date(2017, 1, 1),
+    end: date = date(2025, 12, 31),
+    orbits_per_tile: int = 2,
+    seed: int = 0,
+) -> Iterator[str]:
+    """
+    Yield rows unique L1C uri_body values in order of sensing date.
+
+    Every tile is seen from orbits_per_tile relative orbits, each of which passes
+    every REVISIT_DAYS days, alternately by S2A and S2B (S2A only before
+    S2B_FIRST_DAY). Once tiles and the date range are used up, further batches of
+    synthetic MGRS tiles follow. The same seed gives the same catalog.
+    """
+    rng = random.Random(seed)
+    tile_source = chain(tiles, synthetic_tiles(tiles))
+    batch_size = max(len(tiles), 1)
+    count = 0
+    while count < rows:
+        batch = list(islice(tile_source, batch_size))
+        if not batch:
+            return
+        plans: List[Tuple[str, int, int]] = []
+        for tile in batch:
+            k = min(orbits_per_tile, REVISIT_DAYS)
+            orbits = rng.sample(range(1, RELATIVE_ORBITS + 1), k)
+            offsets = rng.sample(range(REVISIT_DAYS), k)
+            plans += [(tile, orbit, offset) for orbit, offset in zip(orbits, offsets)]
+        for n in range((end - start).days + 1):
+            day = start + timedelta(days=n)
+            for tile, orbit, offset in plans:
+                if (n - offset) % REVISIT_DAYS:
+                    continue
+                satellite = "A" if (n - offset) // REVISIT_DAYS % 2 == 0 else "B"
+                if satellite == "B" and day < S2B_FIRST_DAY:
+                    continue
+                yield uri_body(satellite, sensing_time(day, tile, orbit), orbit, tile)
+                count += 1
+                if count >= rows:
+                    return
+        log.info(
+            f"synthetic_catalog: {count} products from {len(batch)} tiles, adding synthetic tiles."
+        )
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[list]:
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def copy_to_postgres(
+    conn,
+    bodies: Iterable[str],
+    tables: Sequence[str] = ("bnp.dataset_location",),
+    chunk_size: int = 100_000,
+) -> int:
+    """
+    Load uri_body values with COPY into tables (bnp.dataset_location, and e.g.
+    agdc.dataset_location with the same ids), numbered after the highest id of
+    the first table. Commits every chunk, returns the number of rows loaded.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {tables[0]};")
+        next_id = cur.fetchone()[0] + 1
+        loaded = 0
+        for chunk in _chunks(bodies, chunk_size):
+            buffer = io.StringIO()
+            for body in chunk:
+                sensed = SENSING_TIME_PATTERN.search(body).group(1)
+                added = datetime.strptime(sensed, "%Y%m%dT%H%M%S") + timedelta(hours=6)
+                dataset_ref = uuid.uuid5(uuid.NAMESPACE_URL, body)
+                buffer.write(f"{next_id}\t{dataset_ref}\ts3\t{body}\t{added}+00\n")
+                next_id += 1
+            for table in tables:
+                buffer.seek(0)
+                cur.copy_expert(f"COPY {table} ({COPY_COLUMNS}) FROM STDIN", buffer)
+            conn.commit()
+            loaded += len(chunk)
+    return loaded
+
+
+def load_sqlite(
+    sqlite_path: str, bodies: Iterable[str], chunk_size: int = 100_000
+) -> int:
+    """Add the products to the queue file of the SQLite driver."""
+    from dap_lite.sqlite_driver import BNPDriver
+
+    driver = BNPDriver(sqlite_path=sqlite_path, lease_seconds=None)
+    try:
+        return sum(
+            driver.add_products(src_uri(body) for body in chunk)
+            for chunk in _chunks(bodies, chunk_size)
+        )
+    finally:
+        driver.close()
+
+
+def mock_store(bodies: Iterable[str]):
+    """A MockStore with a job per product, pass it to the mock driver as store."""
+    from dap_lite.mock_store import MockStore
+
+    return MockStore(src_uri(body) for body in bodies)
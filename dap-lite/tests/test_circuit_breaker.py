@@ -0,0 +1,62 @@
+import time
+
+from dap_lite.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    backoff_delay,
+)
+
+
+def test_backoff_delay_stays_below_the_cap():
+    for attempt in range(20):
+        delay = backoff_delay(attempt, base=0.5, cap=4.0)
+        assert 0 <= delay <= min(4.0, 0.5 * 2**attempt)
+
+
+def test_backoff_delay_of_a_huge_attempt_does_not_overflow():
+    assert 0 <= backoff_delay(100000, base=1.0, cap=60.0) <= 60.0
+
+
+def test_breaker_opens_after_the_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60.0)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+        assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert 30.0 <= breaker.retry_in() <= 90.0
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.retry_in() is None
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_the_breaker_again():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+
+import pytest
+
+from dap_lite.disk_cache import DiskCache, cache_key, disk_usage
+
+
+class Downloads:
+    """Download callback that writes size bytes and counts its calls per URI."""
+
+    def __init__(self, size=100, delay=0.0):
+        self.size = size
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, uri):
+        def download(path):
+            with self._lock:
+                self.calls.append(uri)
+            time.sleep(self.delay)
+            with open(path, "wb") as f:
+                f.write(b"x" * self.size)
+
+        return download
+
+
+def test_second_open_is_served_from_disk(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10000)
+    downloads = Downloads()
+    with cache.open("s3://bucket/a", "etag-1", downloads("a")) as path:
+        assert os.path.getsize(path) == 100
+    with cache.open("s3://bucket/a", "etag-1", downloads("a")) as again:
+        assert again == path
+    assert downloads.calls == ["a"]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    cache.close()
+
+
+def test_changed_etag_downloads_again(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10000)
+    downloads = Downloads()
+    with cache.open("s3://bucket/a", "etag-1", downloads("a")):
+        pass
+    with cache.open("s3://bucket/a", "etag-2", downloads("a")):
+        pass
+    assert downloads.calls == ["a", "a"]
+    assert cache_key("s3://bucket/a", "etag-1") != cache_key("s3://bucket/a", "etag-2")
+    cache.close()
+
+
+def test_directory_entries(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=10000)
+
+    def download(path):
+        os.makedirs(os.path.join(path, "GRANULE"))
+        for name in ("a.jp2", os.path.join("GRANULE", "b.jp2")):
+            with open(os.path.join(path, name), "wb") as f:
+                f.write(b"x" * 10)
+
+    with cache.open("s3://bucket/X.SAFE", "etag", download) as path:
+        assert disk_usage(path) == 20
+    assert cache.stats()["bytes"] == 20
+    cache.close()
+
+
+def test_evicts_least_recently_used_first(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=250)
+    downloads = Downloads()
+    for uri in ("a", "b"):
+        with cache.open(uri, "etag", downloads(uri)):
+            pass
+    with cache.open("a", "etag", downloads("a")):
+        pass  # b is now the least recently used
+    with cache.open("c", "etag", downloads("c")):
+        pass
+    assert cache.stats()["entries"] == 2
+    with cache.open("a", "etag", downloads("a")):
+        pass
+    assert downloads.calls == ["a", "b", "c"]
+    with cache.open("b", "etag", downloads("b")):
+        pass
+    assert downloads.calls == ["a", "b", "c", "b"]
+    cache.close()
+
+
+def test_entry_in_use_is_not_evicted(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=150)
+    downloads = Downloads()
+    with cache.open("a", "etag", downloads("a")) as path:
+        with cache.open("b", "etag", downloads("b")):
+            assert os.path.exists(path)
+        assert os.path.exists(path)
+    assert cache.evict() == 100
+    assert cache.stats()["entries"] == 1
+    cache.close()
+
+
+def test_concurrent_opens_download_once(tmp_path):
+    downloads = Downloads(delay=0.2)
+    contents = []
+
+    def worker():
+        cache = DiskCache(str(tmp_path), max_bytes=10000)
+        with cache.open("s3://bucket/a", "etag", downloads("a")) as path:
+            contents.append(open(path, "rb").read())
+        cache.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10.0)
+    assert downloads.calls == ["a"]
+    assert contents == [b"x" * 100] * 4
+
+
+def test_failed_download_leaves_nothing_behind(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10000)
+
+    def download(path):
+        with open(path, "wb") as f:
+            f.write(b"partial")
+        raise ConnectionError("connection reset")
+
+    with pytest.raises(ConnectionError):
+        with cache.open("s3://bucket/a", "etag", download):
+            pass
+    assert os.listdir(tmp_path / "tmp") == []
+    assert cache.stats()["entries"] == 0
+    cache.close()
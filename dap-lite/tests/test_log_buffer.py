@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from dap_lite.log_buffer import LogBuffer
+
+
+class FlakyFlush:
+    """flush_fn that records the rows it stored and fails while down is set."""
+
+    def __init__(self):
+        self.rows = []
+        self.down = False
+        self.calls = 0
+
+    def __call__(self, rows):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("database down")
+        self.rows.extend(rows)
+
+
+def messages(rows):
+    return [row[1] for row in rows]
+
+
+def test_flush_writes_rows_in_order():
+    sink = FlakyFlush()
+    buffer = LogBuffer(sink, flush_interval=60.0)
+    for i in range(5):
+        buffer.put(1, f"message {i}", lease_token=7)
+    assert len(buffer) == 5
+    buffer.flush()
+    assert messages(sink.rows) == [f"message {i}" for i in range(5)]
+    assert {row[3] for row in sink.rows} == {7}
+    assert len(buffer) == 0
+    buffer.close()
+
+
+def test_flush_when_max_size_is_reached():
+    flushed = threading.Event()
+    rows = []
+
+    def flush_fn(batch):
+        rows.extend(batch)
+        flushed.set()
+
+    buffer = LogBuffer(flush_fn, max_size=3, flush_interval=60.0)
+    for i in range(3):
+        buffer.put(1, f"message {i}")
+    assert flushed.wait(5.0)
+    assert messages(rows) == ["message 0", "message 1", "message 2"]
+    buffer.close()
+
+
+def test_failed_flush_keeps_rows_in_front():
+    sink = FlakyFlush()
+    buffer = LogBuffer(sink, flush_interval=60.0)
+    buffer.put(1, "first")
+    sink.down = True
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+    buffer.put(1, "second")
+    sink.down = False
+    buffer.flush()
+    assert messages(sink.rows) == ["first", "second"]
+    buffer.close()
+
+
+def test_max_pending_drops_oldest_rows():
+    sink = FlakyFlush()
+    sink.down = True
+    buffer = LogBuffer(sink, flush_interval=60.0, max_pending=3)
+    for i in range(5):
+        buffer.put(1, f"message {i}")
+    assert len(buffer) == 3
+    assert buffer.dropped == 2
+    sink.down = False
+    buffer.flush()
+    assert messages(sink.rows) == ["message 2", "message 3", "message 4"]
+    buffer.close()
+
+
+def test_close_flushes_what_is_left():
+    sink = FlakyFlush()
+    buffer = LogBuffer(sink, flush_interval=60.0)
+    buffer.put(1, "last words")
+    buffer.close()
+    assert messages(sink.rows) == ["last words"]
+
+
+def test_close_raises_but_stops_when_the_last_flush_fails():
+    sink = FlakyFlush()
+    sink.down = True
+    buffer = LogBuffer(sink, flush_interval=60.0)
+    buffer.put(1, "lost")
+    with pytest.raises(ConnectionError):
+        buffer.close()
+    assert not buffer._thread.is_alive()
+    assert len(buffer) == 1
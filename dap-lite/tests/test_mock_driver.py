@@ -0,0 +1,59 @@
+from dap_lite.mock_driver import BNPDriver
+
+
+def status(driver, job_id):
+    return next(job["status"] for job in driver.mock_jobs if job["job_id"] == job_id)
+
+
+def test_get_next_jobs_claims_each_job_once():
+    driver = BNPDriver()
+    first = driver.get_next_jobs(3)
+    rest = driver.get_next_jobs(100)
+    job_ids = [job_id for job_id, _ in first + rest]
+    assert len(first) == 3
+    assert sorted(job_ids) == list(range(1, len(driver.mock_jobs) + 1))
+    assert driver.get_next_jobs(1) == []
+    driver.close()
+
+
+def test_report_finished_clears_the_current_job():
+    driver = BNPDriver()
+    job_id, _ = driver.get_next_job()
+    driver.report_finished("s3://bucket/out")
+    assert driver.current_job == (None, None)
+    assert status(driver, job_id) == "finished"
+    processed = driver.get_processed_products_by_worker(driver.worker_id)
+    assert [job["job_id"] for job in processed] == [job_id]
+    driver.close()
+
+
+def test_pooled_claims_return_job_handles():
+    driver = BNPDriver(pool_size=2)
+    jobs = driver.get_next_jobs(2)
+    for job in jobs:
+        job.report_finished()
+        assert status(driver, job.job_id) == "finished"
+    driver.close()
+
+
+def test_release_job_makes_the_job_claimable_again():
+    driver = BNPDriver()
+    job_id, _ = driver.get_next_job()
+    assert driver.release_job()
+    assert driver.current_job == (None, None)
+    assert status(driver, job_id) == "pending"
+    assert not driver.release_job(job_id)
+    assert driver.get_next_job()[0] == job_id
+    driver.close()
+
+
+def test_drain_releases_processing_jobs_and_stops_claims():
+    driver = BNPDriver()
+    claimed = driver.get_next_jobs(2)
+    assert not driver.drain(timeout=0)
+    for job_id, _ in claimed:
+        assert status(driver, job_id) == "pending"
+    assert driver.get_next_job() == (None, None)
+    assert driver.get_next_jobs(1) == []
+    assert driver.drain(timeout=0)
+    driver.close()
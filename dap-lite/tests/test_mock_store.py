@@ -0,0 +1,131 @@
+import multiprocessing
+
+from dap_lite.mock_driver import DEFAULT_SRC_URIS, BNPDriver
+from dap_lite.mock_store import MockStore, MockStoreManager, tile_of
+
+URIS = [
+    "s3://b/S2A_MSIL1C_20240101T000000_N0500_R001_T33VVH_20240101T000000.SAFE",
+    "s3://b/S2A_MSIL2A_20240101T000000_N0500_R001_T33VVH_20240101T000000.SAFE",
+    "s3://b/S2A_MSIL1C_20240102T000000_N0500_R001_T33VUC_20240102T000000.SAFE",
+    "s3://b/S2A_MSIL2A_20240102T000000_N0500_R001_T33VUC_20240102T000000.SAFE",
+    "s3://b/S2A_MSIL1C_20240103T000000_N0500_R001_T33VVH_20240103T000000.SAFE",
+]
+
+
+def test_claims_oldest_first_and_each_job_once():
+    store = MockStore(URIS)
+    assert store.claim("w1", 2) == [(1, URIS[0]), (2, URIS[1])]
+    assert [job_id for job_id, _ in store.claim("w2", 10)] == [3, 4, 5]
+    assert store.claim("w1") == []
+    assert store.processing_job_ids("w1") == [1, 2]
+    assert store.pending_count() == 0
+
+
+def test_src_pattern_claims_and_counts():
+    store = MockStore(URIS)
+    assert store.pending_count("MSIL1C") == 3
+    assert store.pending_count("MSIL2A", limit=1) == 1
+    claimed = store.claim("w1", 2, src_pattern="MSIL1C")
+    assert [job_id for job_id, _ in claimed] == [1, 3]
+    assert store.pending_count("MSIL1C") == 1
+    assert store.pending_count("MSIL2A") == 2
+    assert [job_id for job_id, _ in store.claim("w1", 5)] == [2, 4, 5]
+    assert store.pending_count("MSIL1C") == 0
+
+
+def test_pattern_counts_follow_releases_and_reports():
+    store = MockStore(URIS)
+    store.pending_count("MSIL1C")  # Builds the pattern index
+    [(job_id, _)] = store.claim("w1", src_pattern="MSIL1C")
+    assert store.pending_count("MSIL1C") == 2
+    assert store.release(job_id)
+    assert store.pending_count("MSIL1C") == 3
+    assert store.set_status(3, "finished")
+    assert store.pending_count("MSIL1C") == 2
+    store.add_jobs([URIS[0].replace("20240101", "20240201")])
+    assert store.pending_count("MSIL1C") == 3
+
+
+def test_tile_is_preferred():
+    store = MockStore(URIS)
+    assert tile_of(URIS[2]) == "33VUC"
+    assert store.claim("w1", tile="33VUC") == [(3, URIS[2])]
+    assert store.claim("w1", tile="33VUC", src_pattern="MSIL1C") == [(1, URIS[0])]
+    assert store.claim("w1", tile="33XXX") == [(2, URIS[1])]
+
+
+def test_released_job_goes_back_in_front():
+    store = MockStore(URIS)
+    store.claim("w1", 3)
+    assert store.release(2)
+    assert not store.release(2)
+    assert store.get_job(2) == {
+        "job_id": 2,
+        "src_uri": URIS[1],
+        "status": "pending",
+        "worker_id": None,
+    }
+    assert store.claim("w2") == [(2, URIS[1])]
+
+
+def test_finished_jobs_and_logs():
+    store = MockStore(URIS)
+    store.claim("w1", 2)
+    store.set_status(1, "finished")
+    store.set_status(2, "failed")
+    assert [job["job_id"] for job in store.finished_jobs("w1")] == [1]
+    assert store.add_log(1, "done") == URIS[0]
+    assert store.logs_for_product(URIS[0]) == [
+        {"job_id": 1, "message": "done", "l1c_source": URIS[0]}
+    ]
+    assert store.status_counts() == {"finished": 1, "failed": 1, "pending": 3}
+
+
+def test_drivers_sharing_a_store_split_the_jobs():
+    store = MockStore(DEFAULT_SRC_URIS)
+    drivers = [BNPDriver(worker_id=f"w{n}", store=store) for n in range(2)]
+    claimed = []
+    while True:
+        jobs = [job for driver in drivers for job in driver.get_next_jobs(1)]
+        if not jobs:
+            break
+        claimed.extend(job_id for job_id, _ in jobs)
+    assert sorted(claimed) == list(range(1, len(DEFAULT_SRC_URIS) + 1))
+    for driver in drivers:
+        driver.close()
+
+
+def claim_all(store, worker_id, results):
+    driver = BNPDriver(worker_id=worker_id, store=store)
+    claimed = []
+    while True:
+        job_id, _ = driver.get_next_job(src_pattern="")
+        if not job_id:
+            break
+        claimed.append(job_id)
+        driver.report_finished()
+    results.put(claimed)
+    driver.close()
+
+
+def test_processes_share_a_store_through_the_manager():
+    manager = MockStoreManager()
+    manager.start()
+    try:
+        src_uris = [f"s3://b/product-{n}.SAFE" for n in range(200)]
+        store = manager.MockStore(src_uris)
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=claim_all, args=(store, f"w{n}", results))
+            for n in range(3)
+        ]
+        for worker in workers:
+            worker.start()
+        claimed = [results.get(timeout=30.0) for _ in workers]
+        for worker in workers:
+            worker.join(10.0)
+        all_claimed = sorted(job_id for jobs in claimed for job_id in jobs)
+        assert all_claimed == list(range(1, 201))
+        assert store.status_counts() == {"finished": 200}
+    finally:
+        manager.shutdown()
@@ -0,0 +1,92 @@
+import threading
+
+import psycopg2
+
+from dap_lite.driver import BNPDriver, BNPStaleLeaseException
+from dap_lite.outbox import Outbox
+
+
+def report(job_id, lease_token=1):
+    return {
+        "call": "bnp.report_finished",
+        "processor_id": 1,
+        "job_id": job_id,
+        "text": f"s3://bucket/{job_id}",
+        "lease_token": lease_token,
+    }
+
+
+def test_pending_returns_entries_oldest_first(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    seqs = [outbox.append(report(job_id)) for job_id in (3, 1, 2)]
+    assert len(outbox) == 3
+    assert [seq for seq, _ in outbox.pending()] == sorted(seqs)
+    assert [entry["job_id"] for _, entry in outbox.pending()] == [3, 1, 2]
+    outbox.remove(seqs[0])
+    assert len(outbox) == 2
+    assert [entry["job_id"] for _, entry in outbox.pending()] == [1, 2]
+    outbox.close()
+
+
+def test_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "nested" / "outbox.sqlite")
+    outbox = Outbox(path)
+    outbox.append(report(7))
+    outbox.close()
+    outbox = Outbox(path)
+    assert len(outbox) == 1
+    assert outbox.pending()[0][1] == report(7)
+    outbox.close()
+
+
+def outbox_driver(path, replay):
+    """A DB driver without a connection whose reports are replayed through replay."""
+    driver = BNPDriver.__new__(BNPDriver)
+    driver.outbox = Outbox(path)
+    driver._replay_lock = threading.Lock()
+    driver._in_flight_lock = threading.Condition()
+    driver._deferred = {}
+    driver._lease_tokens = {}
+    driver._replay_report = replay
+    return driver
+
+
+def test_replay_stops_at_an_outage_and_keeps_the_order(tmp_path):
+    replayed = []
+    down = {3}
+
+    def replay(entry):
+        if entry["job_id"] in down:
+            raise psycopg2.OperationalError("server closed the connection")
+        replayed.append(entry["job_id"])
+
+    driver = outbox_driver(str(tmp_path / "outbox.sqlite"), replay)
+    for job_id in (1, 2, 3, 4):
+        driver.outbox.append(report(job_id))
+        driver._lease_tokens[job_id] = 1
+    assert driver.replay_outbox() == 2
+    assert replayed == [1, 2]
+    assert [entry["job_id"] for _, entry in driver.outbox.pending()] == [3, 4]
+    assert sorted(driver._lease_tokens) == [3, 4]
+    down.clear()
+    assert driver.replay_outbox() == 2
+    assert replayed == [1, 2, 3, 4]
+    assert len(driver.outbox) == 0
+    driver.outbox.close()
+
+
+def test_replay_drops_calls_the_database_rejects(tmp_path):
+    replayed = []
+
+    def replay(entry):
+        if entry["job_id"] == 1:
+            raise BNPStaleLeaseException("stale")
+        replayed.append(entry["job_id"])
+
+    driver = outbox_driver(str(tmp_path / "outbox.sqlite"), replay)
+    driver.outbox.append(report(1))
+    driver.outbox.append(report(2))
+    assert driver.replay_outbox() == 2
+    assert replayed == [2]
+    assert len(driver.outbox) == 0
+    driver.outbox.close()
@@ -0,0 +1,77 @@
+import threading
+
+from dap_lite.polling import AdaptivePoller
+
+
+class QueueSignals:
+    """Driver stand-in that reports a fixed power state and queue depth."""
+
+    def __init__(self, power_on=True, depth=0):
+        self.power_on = power_on
+        self.depth = depth
+        self.waits = []
+
+    def is_power_on(self):
+        return self.power_on
+
+    def queue_depth(self, src_pattern="MSIL1C", limit=100):
+        return min(self.depth, limit)
+
+    def wait_for_job(self, timeout=60.0):
+        self.waits.append(timeout)
+        return False
+
+
+def test_claim_right_away_when_there_is_work():
+    poller = AdaptivePoller(0.5, 60.0, max_missed_claims=3)
+    assert poller.next_interval(QueueSignals(depth=5)) == 0.0
+
+
+def test_power_off_waits_power_off_interval():
+    poller = AdaptivePoller(0.5, 60.0, power_off_interval=300.0)
+    assert poller.next_interval(QueueSignals(power_on=False, depth=5)) == 300.0
+
+
+def test_empty_queue_backs_off_between_the_bounds():
+    poller = AdaptivePoller(0.5, 4.0)
+    driver = QueueSignals()
+    intervals = [poller.next_interval(driver) for _ in range(20)]
+    assert all(0.5 <= interval <= 4.0 for interval in intervals)
+    assert poller.idle_polls == 20
+    poller.reset()
+    assert poller.idle_polls == 0
+
+
+def test_backs_off_when_claims_keep_missing_the_work():
+    poller = AdaptivePoller(0.5, 4.0, max_missed_claims=3)
+    driver = QueueSignals(depth=5)
+    assert [poller.next_interval(driver) for _ in range(3)] == [0.0] * 3
+    assert poller.next_interval(driver) >= 0.5
+    driver.depth = 0
+    poller.next_interval(driver)
+    driver.depth = 5
+    assert poller.next_interval(driver) == 0.0
+
+
+def test_wait_returns_after_one_backoff_for_missed_work():
+    poller = AdaptivePoller(0.01, 0.05, max_missed_claims=0)
+    driver = QueueSignals(depth=5)
+    poller.wait(driver)
+    assert len(driver.waits) >= 1
+    assert poller.missed_claims == 1
+
+
+def test_wait_returns_when_stopped():
+    poller = AdaptivePoller(0.01, 0.05)
+    stop = threading.Event()
+    stop.set()
+    poller.wait(QueueSignals(), stop=stop)
+
+
+def test_failing_queue_signals_back_off():
+    class Down(QueueSignals):
+        def is_power_on(self):
+            raise ConnectionError("database down")
+
+    poller = AdaptivePoller(0.5, 4.0)
+    assert 0.5 <= poller.next_interval(Down()) <= 4.0
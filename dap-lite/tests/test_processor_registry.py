@@ -0,0 +1,94 @@
+import threading
+
+from dap_lite.constants import PROCESSORS
+from dap_lite.processor_registry import ProcessorCache, processor_from_row
+
+
+def test_processor_from_row_flattens_the_config():
+    row = {"id": 2, "processor_name": "ndvi", "config": {"bands": ["B04", "B08"]}}
+    assert processor_from_row(row) == {
+        "id": 2,
+        "processor_name": "ndvi",
+        "bands": ["B04", "B08"],
+    }
+
+
+def test_loads_once_per_ttl_and_after_invalidate():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return [{"id": 1, "version": len(loads)}]
+
+    cache = ProcessorCache(load, ttl=300.0)
+    assert cache.get(1)["version"] == 1
+    assert cache.get(1)["version"] == 1
+    cache.invalidate()
+    assert cache.get(1)["version"] == 2
+    assert len(loads) == 2
+
+
+def test_failed_load_keeps_the_last_known_processors():
+    rows = [{"id": 1, "version": 1}]
+
+    def load():
+        if rows is None:
+            raise ConnectionError("database down")
+        return rows
+
+    cache = ProcessorCache(load, ttl=0.0)
+    assert cache.get(1)["version"] == 1
+    rows = None
+    assert cache.get(1)["version"] == 1
+
+
+def test_failed_first_load_falls_back_to_processors():
+    def load():
+        raise ConnectionError("database down")
+
+    cache = ProcessorCache(load)
+    assert [p["id"] for p in cache.all()] == [p["id"] for p in PROCESSORS]
+
+
+def test_invalidate_during_a_load_loads_again():
+    loading = threading.Event()
+    proceed = threading.Event()
+    versions = iter([1, 2])
+
+    def load():
+        version = next(versions)
+        if version == 1:
+            loading.set()
+            proceed.wait(5.0)
+        return [{"id": 1, "version": version}]
+
+    cache = ProcessorCache(load, ttl=300.0)
+    first = threading.Thread(target=cache.get, args=(1,))
+    first.start()
+    assert loading.wait(5.0)
+    cache.invalidate()
+    proceed.set()
+    first.join(5.0)
+    assert cache.get(1)["version"] == 2
+
+
+def test_load_may_take_a_lock_held_around_invalidate():
+    # Like the LISTEN lock of the DB driver, which loads the processors on the
+    # same connection
+    driver_lock = threading.Lock()
+    loading = threading.Event()
+
+    def load():
+        loading.set()
+        with driver_lock:
+            return [{"id": 1}]
+
+    cache = ProcessorCache(load, ttl=300.0)
+    with driver_lock:
+        lookup = threading.Thread(target=cache.get, args=(1,))
+        lookup.start()
+        assert loading.wait(5.0)
+        cache.invalidate()  # Must not wait for the load
+    lookup.join(5.0)
+    assert not lookup.is_alive()
+    assert cache.get(1) == {"id": 1}
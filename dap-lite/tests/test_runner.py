@@ -0,0 +1,140 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from dap_lite import DriverType
+from dap_lite.job_handle import JobHandle
+from dap_lite.mock_driver import BNPDriver
+from dap_lite.runner import WorkerRunner, _process
+from dap_lite.workflow_step import WorkFlowStepSkippedException
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+
+
+def status(driver, job_id):
+    return next(job["status"] for job in driver.mock_jobs if job["job_id"] == job_id)
+
+
+def claim(driver):
+    job_id, src_uri = driver.get_next_job()
+    return JobHandle(driver, job_id, src_uri)
+
+
+def test_process_reports_the_outcome_of_the_processor():
+    driver = BNPDriver()
+
+    def skip(job):
+        raise WorkFlowStepSkippedException("nothing to do")
+
+    def fail(job):
+        raise ValueError("broken product")
+
+    outcomes = {}
+    for processor in (lambda job: "s3://bucket/out", skip, fail):
+        job = claim(driver)
+        _process(processor, job)
+        outcomes[job.job_id] = status(driver, job.job_id)
+    assert sorted(outcomes.values()) == ["failed", "finished", "skipped"]
+    driver.close()
+
+
+def test_process_releases_a_job_whose_report_fails():
+    driver = BNPDriver()
+
+    def report_finished(*args, **kwargs):
+        raise ConnectionError("database down")
+
+    driver.report_finished = report_finished
+    job = claim(driver)
+    _process(lambda job: None, job)
+    assert status(driver, job.job_id) == "pending"
+    driver.close()
+
+
+def test_thread_workers_process_jobs_until_stopped():
+    processed = []
+
+    def processor(job):
+        processed.append(job.job_id)
+
+    runner = WorkerRunner(
+        processor,
+        workers=2,
+        threads=True,
+        driver_type=DriverType.MOCK,
+        poll_interval=0.2,
+        min_poll_interval=0.05,
+        drain_timeout=5.0,
+    )
+
+    def stop_when_done():
+        while len(processed) < 8:
+            time.sleep(0.05)
+        runner.stop()
+
+    threading.Thread(target=stop_when_done, daemon=True).start()
+    assert runner.run() == 0
+    assert len(processed) >= 8
+
+
+RUNNER_SCRIPT = """
+import sys
+import time
+
+from dap_lite import DriverType
+from dap_lite.runner import WorkerRunner
+
+
+def processor(job):
+    with open(sys.argv[1], "a") as f:
+        f.write(f"start {job.job_id}\\n")
+    time.sleep(float(sys.argv[2]))
+    with open(sys.argv[1], "a") as f:
+        f.write(f"done {job.job_id}\\n")
+
+
+if __name__ == "__main__":
+    runner = WorkerRunner(
+        processor,
+        workers=1,
+        driver_type=DriverType.MOCK,
+        drain_timeout=float(sys.argv[3]),
+    )
+    sys.exit(runner.run())
+"""
+
+
+def run_and_terminate(tmp_path, job_seconds, drain_timeout):
+    """Start a process mode runner, SIGTERM it during its first job."""
+    script = tmp_path / "runner.py"
+    script.write_text(RUNNER_SCRIPT)
+    events = tmp_path / "events"
+    events.touch()
+    args = [str(script), str(events), str(job_seconds), str(drain_timeout)]
+    runner = subprocess.Popen(
+        [sys.executable, *args], env=dict(os.environ, PYTHONPATH=SRC)
+    )
+    deadline = time.monotonic() + 30.0
+    while "start" not in events.read_text() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    runner.send_signal(signal.SIGTERM)
+    returncode = runner.wait(30.0)
+    return returncode, events.read_text().split("\n")[:-1]
+
+
+def test_sigterm_lets_the_worker_finish_its_job(tmp_path):
+    returncode, events = run_and_terminate(tmp_path, 1.0, 10.0)
+    assert returncode == 0
+    assert events[:2] == ["start 1", "done 1"]
+    assert len(events) % 2 == 0 and events[-1].startswith("done")
+
+
+def test_sigterm_interrupts_a_worker_busy_after_the_drain_timeout(tmp_path):
+    start = time.monotonic()
+    returncode, events = run_and_terminate(tmp_path, 60.0, 0.5)
+    assert returncode == 1
+    assert time.monotonic() - start < 30.0
+    assert len(events) == 1 and events[0].startswith("start")
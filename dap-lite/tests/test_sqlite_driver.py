@@ -0,0 +1,194 @@
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from dap_lite.driver import BNPDriverException, BNPStaleLeaseException
+from dap_lite.sqlite_driver import BNPDriver
+
+URIS = [
+    f"s3://b/S2A_MSIL1C_2024010{day}T000000_N0500_R001_T33VVH_2024010{day}T000000.SAFE"
+    for day in range(1, 6)
+]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "bnp.sqlite")
+
+
+def make_driver(path, worker_id, **kwargs):
+    return BNPDriver(sqlite_path=path, worker_id=worker_id, **kwargs)
+
+
+def execute(path, query):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute(query)
+    conn.close()
+
+
+def expire_leases(path):
+    """Let the leases of all running jobs run out, as if their workers died."""
+    execute(
+        path,
+        "UPDATE process_executions SET lease_expires_at = 0 WHERE status = 'running'",
+    )
+
+
+def statuses(path):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT id, status, attempts FROM process_executions")
+    result = {job_id: (status, attempts) for job_id, status, attempts in rows}
+    conn.close()
+    return result
+
+
+def test_claims_each_product_once(path):
+    driver = make_driver(path, "w1")
+    assert driver.add_products(URIS) == 5
+    assert driver.add_products(URIS[:1]) == 0
+    other = make_driver(path, "w2")
+    jobs = driver.get_next_jobs(3) + other.get_next_jobs(3)
+    assert sorted(src_uri for _, src_uri in jobs) == sorted(URIS)
+    assert driver.get_next_job() == (None, None)
+    assert driver.queue_depth() == 0
+    driver.close()
+    other.close()
+
+
+def test_report_finished(path):
+    driver = make_driver(path, "w1")
+    driver.add_products(URIS[:1])
+    assert driver.queue_depth() == 1
+    job_id, src_uri = driver.get_next_job()
+    driver.store_log_message("working")
+    driver.report_finished("s3://out/a")
+    assert driver.current_job == (None, None)
+    assert statuses(path)[job_id] == ("finished", 1)
+    assert driver.get_processed_products_by_worker("w1") == [
+        {"job_id": job_id, "l1c_source": src_uri}
+    ]
+    messages = [row["message"] for row in driver.get_logs_for_product(src_uri)]
+    assert messages == ["working", "Final status set to FINISHED"]
+    with pytest.raises(BNPDriverException):
+        driver.report_finished("s3://out/a", job_id=job_id)
+    driver.close()
+
+
+def test_expired_lease_is_reclaimed_and_fences_the_old_worker(path):
+    dead = make_driver(path, "dead")
+    dead.add_products(URIS[:1])
+    job_id, _ = dead.get_next_job()
+    expire_leases(path)
+    alive = make_driver(path, "alive")
+    assert alive.queue_depth() == 1
+    assert alive.get_next_job()[0] == job_id
+    with pytest.raises(BNPStaleLeaseException):
+        dead.store_log_message("still working")
+    with pytest.raises(BNPStaleLeaseException):
+        dead.report_finished("s3://out/late", job_id=job_id)
+    alive.report_finished("s3://out/a")
+    assert statuses(path)[job_id] == ("finished", 2)
+    dead.close()
+    alive.close()
+
+
+def test_job_fails_after_retry_limit_attempts(path):
+    drivers = [make_driver(path, f"w{n}") for n in range(3)]
+    drivers[0].add_products(URIS[:1])
+    execute(path, "UPDATE processors SET retry_limit = 2 WHERE id = 1")
+    job_id, _ = drivers[0].get_next_job()
+    expire_leases(path)
+    assert drivers[1].get_next_job()[0] == job_id
+    expire_leases(path)
+    assert drivers[2].get_next_job() == (None, None)
+    assert statuses(path)[job_id] == ("failed", 2)
+    for driver in drivers:
+        driver.close()
+
+
+def test_renew_leases_drops_lost_leases(path):
+    driver = make_driver(path, "w1")
+    driver.add_products(URIS[:1])
+    job_id, _ = driver.get_next_job()
+    assert driver.renew_leases() == [job_id]
+    expire_leases(path)
+    other = make_driver(path, "w2")
+    other.get_next_job()
+    assert driver.renew_leases() == []
+    assert driver.in_flight_jobs == []
+    driver.close()
+    other.close()
+
+
+def test_release_job_lets_another_worker_claim_it(path):
+    driver = make_driver(path, "w1")
+    driver.add_products(URIS[:1])
+    job_id, _ = driver.get_next_job()
+    assert driver.release_job()
+    assert not driver.release_job(job_id)
+    other = make_driver(path, "w2")
+    assert other.get_next_job()[0] == job_id
+    other.report_finished()
+    assert statuses(path)[job_id] == ("finished", 1)
+    with pytest.raises(BNPStaleLeaseException):
+        driver.report_finished(job_id=job_id)
+    driver.close()
+    other.close()
+
+
+def test_drain_releases_unfinished_jobs_and_stops_claims(path):
+    driver = make_driver(path, "w1")
+    driver.add_products(URIS)
+    (done, _), (unfinished, _) = driver.get_next_jobs(2)
+    driver.report_finished(job_id=done)
+    assert not driver.drain(timeout=0)
+    assert driver.get_next_job() == (None, None)
+    assert driver.get_next_jobs(1) == []
+    assert driver.in_flight_jobs == []
+    other = make_driver(path, "w2")
+    assert other.get_next_job()[0] == unfinished
+    assert driver.drain(timeout=0)
+    driver.close()
+    other.close()
+
+
+def test_no_claims_while_the_power_is_off(path):
+    driver = make_driver(path, "w1")
+    driver.add_products(URIS[:1])
+    execute(path, "UPDATE globals SET value = '\"off\"' WHERE variable_name = 'power'")
+    assert not driver.is_power_on()
+    assert driver.get_next_job() == (None, None)
+    driver.close()
+
+
+def claim_all(path, worker_id, results):
+    driver = make_driver(path, worker_id)
+    claimed = []
+    while True:
+        job_id, _ = driver.get_next_job(src_pattern="")
+        if not job_id:
+            break
+        claimed.append(job_id)
+        driver.report_finished()
+    results.put(claimed)
+    driver.close()
+
+
+def test_processes_claim_each_job_once(path):
+    driver = make_driver(path, "loader")
+    driver.add_products(f"s3://b/product-{n}.SAFE" for n in range(100))
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=claim_all, args=(path, f"w{n}", results))
+        for n in range(3)
+    ]
+    for worker in workers:
+        worker.start()
+    claimed = [results.get(timeout=60.0) for _ in workers]
+    for worker in workers:
+        worker.join(10.0)
+    all_claimed = sorted(job_id for jobs in claimed for job_id in jobs)
+    assert all_claimed == list(range(1, 101))
+    assert {status for status, _ in statuses(path).values()} == {"finished"}
+    driver.close()